@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Memory and scrape concurrency of many accounts on one host (see src/accounts.py).
+   Builds the Accounts of N accounts with the same timetables and a week of schedule
+   each, and reports the traced memory per account. Then refreshes all of them with a
+   stand-in browser that takes --scrape seconds, and reports how many scrapes (and so
+   browsers) ran at once and how long the refresh of every account took.
+
+   usage: python3 benchmarks/bench_accounts.py [--scrape 0.2] [--max-scrapes 2] [counts...]"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import datetime as dt
+
+from os import path, makedirs
+
+sys.path.insert(0, path.normpath(path.join(path.dirname(__file__), "../src")))
+
+from accounts import Accounts
+from json_helper import JsonHelper, ACCOUNTS_DIR
+from models import schedule_to_json, Day, Lesson, ScheduleException
+from timetable import NORMAL
+
+TIMETABLES = {"short": ["08:30 - 09:10", "09:10 - 09:50", "09:50 - 10:30", "10:50 - 11:30", "11:30 - 12:10",
+                        "12:10 - 12:50", "13:20 - 14:00", "14:00 - 14:40", "14:40 - 15:20"]}
+
+
+class StandInBrowser:
+    """Counts the scrapes that run at the same time, instead of starting Chrome"""
+
+    base_url = "https://esprit.magister.net"
+
+    def __init__(self, duration: float):
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def fetch_agenda_html(self, creds: dict) -> str:
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.duration)
+        with self.lock:
+            self.active -= 1
+        return ""
+
+    def close(self) -> None:
+        pass
+
+
+def make_accounts(json_dir: str, count: int) -> list:
+    week = [Day(dt.date(2026, 9, 7) + dt.timedelta(days=i), ScheduleException.NONE,
+                tuple(Lesson(number, f"WISB - abc - {number}", NORMAL.timeslot(number), *NORMAL.slot(number))
+                      for number in range(1 + i % 2, 8)))
+            for i in range(5)]
+    names = [f"student{i}" for i in range(count)]
+    for name in names:
+        account_dir = path.join(json_dir, ACCOUNTS_DIR, name)
+        makedirs(account_dir, exist_ok=True)
+        files = {"credentials.json": {"username": name, "password": "-"},
+                 "config.json": {"last_update": dt.datetime(2026, 9, 6).isoformat(), "timetables": TIMETABLES},
+                 "out.json": schedule_to_json(week),
+                 "prev_out.json": {}}
+        for file_name, data in files.items():
+            with open(path.join(account_dir, file_name), "w", encoding="utf-8") as fhandler:
+                json.dump(data, fhandler)
+    return names
+
+
+def bench(count: int, scrape: float, max_scrapes: int) -> dict:
+    with tempfile.TemporaryDirectory() as json_dir:
+        names = make_accounts(json_dir, count)
+        browser = StandInBrowser(scrape)
+
+        tracemalloc.start()
+        accounts = Accounts(names, (1800, 2400, 1200), "../audio-files/alarm_sound.mp3", 10,
+                            json_helper=JsonHelper(json_dir), max_scrapes=max_scrapes, browser=browser)
+        for malarm in accounts.malarms.values():
+            malarm.json_helper.get_schedule()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        started = time.perf_counter()
+        for thread in accounts.refresh_magister_data():
+            thread.join()
+        elapsed = time.perf_counter() - started
+        for malarm in accounts.malarms.values():
+            malarm.json_helper.flush()
+
+    return {"kib": size / 1024, "per_account": size / 1024 / count, "peak": browser.peak, "refresh": elapsed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scrape", type=float, default=0.2)
+    parser.add_argument("--max-scrapes", type=int, default=2)
+    parser.add_argument("counts", nargs="*", type=int, default=[1, 4, 16, 64])
+    args = parser.parse_args()
+    # The refreshes fail on purpose (the stand-in returns no agenda), keep that out of the table
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'accounts':>8} {'memory':>11} {'per account':>12} {'peak scrapes':>13} {'refresh all':>12}")
+    for count in args.counts:
+        result = bench(count, args.scrape, args.max_scrapes)
+        print(f"{count:>8} {result['kib']:>7.0f} KiB {result['per_account']:>8.1f} KiB {result['peak']:>13}"
+              f" {result['refresh']:>10.2f} s")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for the EventDispatcher event store.
+   Measures dispatch, cancel and sorted listing at different event counts.
+
+   usage: python3 benchmarks/bench_dispatcher.py [counts...]"""
+
+import sys
+import time
+import random
+import logging
+import datetime as dt
+
+from os import path
+
+sys.path.insert(0, path.normpath(path.join(path.dirname(__file__), "../src")))
+
+from event_dispatcher import EventDispatcher
+from function import EventFunction
+
+COUNTS = (10, 1_000, 100_000)
+LIST_REPEATS = 20
+
+
+def bench(count: int) -> dict:
+    dispatcher = EventDispatcher()
+    dispatcher.log.setLevel(logging.WARNING)
+    func = EventFunction(lambda: None, type="Bench")
+    start = dt.datetime.now() + dt.timedelta(days=1)
+    times = [start + dt.timedelta(minutes=i) for i in range(count)]
+    random.shuffle(times)
+
+    t0 = time.perf_counter()
+    for _time in times:
+        dispatcher.dispatch(_time, func)
+    t_dispatch = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(LIST_REPEATS):
+        dispatcher.get_current()
+    t_list = (time.perf_counter() - t0) / LIST_REPEATS
+
+    names = [f"Bench-{i}" for i in range(1, count + 1)]
+    random.shuffle(names)
+    t0 = time.perf_counter()
+    for name in names:
+        dispatcher.cancel_event_by_name(name)
+    t_cancel = time.perf_counter() - t0
+    dispatcher.timer.stop()
+
+    return {"dispatch": t_dispatch / count * 1e6,
+            "cancel": t_cancel / count * 1e6,
+            "list": t_list * 1e3}
+
+
+if __name__ == "__main__":
+    counts = [int(c) for c in sys.argv[1:]] or COUNTS
+    print(f"{'events':>8} {'dispatch (us/op)':>18} {'cancel (us/op)':>16} {'list (ms)':>10}")
+    for count in counts:
+        result = bench(count)
+        print(f"{count:>8} {result['dispatch']:>18.2f} {result['cancel']:>16.2f} {result['list']:>10.3f}")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Load test for the web interface.
+   Requests every path from a number of concurrent connections for a while, once
+   with plain GETs and once as conditional GETs that send the ETag of the first
+   response (If-None-Match), and reports the requests per second. Run it against
+   the server before and after a change to compare; a server without ETags
+   answers the conditional GETs with full responses as well.
+
+   usage: python3 app.py   (or python3 asgi_app.py)
+          python3 benchmarks/bench_http.py [--url http://127.0.0.1:5000] [--duration 5]
+                                           [--concurrency 4] [paths...]"""
+
+import time
+import argparse
+import threading
+import http.client
+
+from collections import Counter
+from urllib.parse import urlsplit
+
+PATHS = ["/", "/out_json", "/api/state", "/static/alarm-fill.svg?v=0"]
+
+
+def get(conn: http.client.HTTPConnection, path: str, headers: dict) -> http.client.HTTPResponse:
+    conn.request("GET", path, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    return response
+
+
+def worker(url, path: str, headers: dict, deadline: float, latencies: list, statuses: Counter, lock) -> None:
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=10)
+    own_latencies = []
+    own_statuses = Counter()
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = get(conn, path, headers)
+        own_latencies.append(time.perf_counter() - started)
+        own_statuses[response.status] += 1
+    conn.close()
+    with lock:
+        latencies.extend(own_latencies)
+        statuses.update(own_statuses)
+
+
+def bench(url, path: str, headers: dict, duration: float, concurrency: int) -> dict:
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=worker, args=(url, path, headers, deadline, latencies, statuses, lock))
+               for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {"rps": len(latencies) / elapsed,
+            "p50": latencies[len(latencies) // 2] * 1e3 if latencies else 0.0,
+            "p99": latencies[int(len(latencies) * 0.99)] * 1e3 if latencies else 0.0,
+            "statuses": ",".join(f"{status}x{count}" for status, count in sorted(statuses.items()))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("paths", nargs="*", default=PATHS)
+    args = parser.parse_args()
+    url = urlsplit(args.url)
+
+    print(f"{'path':<28} {'mode':<12} {'req/s':>8} {'p50':>9} {'p99':>9}  statuses")
+    for path in args.paths:
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=10)
+        etag = get(conn, path, {}).getheader("ETag")
+        conn.close()
+
+        modes = [("plain", {})]
+        modes.append(("conditional", {"If-None-Match": etag} if etag else {}))
+        for mode, headers in modes:
+            result = bench(url, path, headers, args.duration, args.concurrency)
+            print(f"{path:<28} {mode:<12} {result['rps']:>8.0f} {result['p50']:>6.2f} ms {result['p99']:>6.2f} ms"
+                  f"  {result['statuses']}")
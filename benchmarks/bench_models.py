@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Memory and parse time of a school year of schedule data, as the plain dicts
+   of out.json versus the slotted models, and of the dispatcher events.
+
+   usage: python3 benchmarks/bench_models.py [days]"""
+
+import sys
+import json
+import time
+import tracemalloc
+import datetime as dt
+
+from os import path
+
+sys.path.insert(0, path.normpath(path.join(path.dirname(__file__), "../src")))
+
+from models import schedule_to_json, schedule_from_json, Day, Lesson, ScheduleException, ScheduledEvent
+from timetable import NORMAL
+
+DAYS = 200
+
+
+def make_days(count: int) -> tuple:
+    start = dt.date(2025, 8, 25)
+    days = []
+    for i in range(count):
+        hours = tuple(Lesson(number, f"WISB - abc - {number}", NORMAL.timeslot(number), *NORMAL.slot(number))
+                      for number in range(1, 9) if number != 4)
+        days.append(Day(start + dt.timedelta(days=i), ScheduleException(i % 3), hours))
+    return tuple(days)
+
+
+def measure(build):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - t0
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def make_legacy_events(count: int) -> list:
+    class LegacyEvent:
+        def __init__(self, name, time, func, handle=None, seq=0):
+            self.name = name
+            self.time = time
+            self.func = func
+            self.handle = handle
+            self.seq = seq
+
+    now = dt.datetime.now()
+    return [LegacyEvent(f"Alarm-{i}", now + dt.timedelta(days=i), None, None, i) for i in range(count)]
+
+
+def make_events(count: int) -> list:
+    now = dt.datetime.now()
+    return [ScheduledEvent(f"Alarm-{i}", now + dt.timedelta(days=i), None, i, None, 0) for i in range(count)]
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DAYS
+    text = json.dumps(schedule_to_json(make_days(count)))
+
+    _, dict_size, dict_time = measure(lambda: json.loads(text))
+    _, model_size, model_time = measure(lambda: schedule_from_json(json.loads(text)))
+    _, legacy_event_size, _ = measure(lambda: make_legacy_events(count))
+    _, event_size, _ = measure(lambda: make_events(count))
+
+    print(f"{'':>12} {'dicts':>12} {'models':>12}")
+    print(f"{'days (KiB)':>12} {dict_size / 1024:>12.1f} {model_size / 1024:>12.1f}")
+    print(f"{'parse (ms)':>12} {dict_time * 1e3:>12.2f} {model_time * 1e3:>12.2f}")
+    print(f"{'events (KiB)':>12} {legacy_event_size / 1024:>12.1f} {event_size / 1024:>12.1f}")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Benchmark for the startup time of the program.
+   Times importing the entry points, and the first use of the lazily loaded
+   audio and speech stacks, in fresh interpreters. Every run is appended to
+   benchmarks/results/startup.csv, so the startup time can be followed over time.
+   The heavy column lists the scraping, TTS and audio packages that got imported.
+
+   usage: python3 benchmarks/bench_startup.py [--runs N] [--no-record] [targets...]"""
+
+import csv
+import sys
+import argparse
+import datetime as dt
+import platform
+import statistics
+import subprocess
+
+from os import path, makedirs
+
+SRC_DIR = path.normpath(path.join(path.dirname(__file__), "../src"))
+HISTORY = path.join(path.dirname(__file__), "results", "startup.csv")
+
+HEAVY = ("selenium", "bs4", "lxml", "gtts", "pydub", "pygame")
+
+# name: (setup, timed statement)
+TARGETS = {"import app": ("", "import app"),
+           "import asgi_app": ("", "import asgi_app"),
+           "import malarm": ("", "import malarm"),
+           "import function": ("", "import function"),
+           "function.get_sm()": ("import function", "function.get_sm()")}
+
+SCRIPT = """
+import sys, time
+{setup}
+t0 = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - t0
+print(elapsed, ",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def run(setup: str, statement: str) -> tuple:
+    """Returns (seconds, heavy packages) of one fresh interpreter, raises RuntimeError on a failure"""
+
+    result = subprocess.run([sys.executable, "-c", SCRIPT.format(setup=setup, statement=statement, heavy=HEAVY)],
+                            cwd=SRC_DIR, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    elapsed, _, heavy = result.stdout.strip().splitlines()[-1].partition(" ")
+    return float(elapsed), heavy
+
+
+def bench(setup: str, statement: str, runs: int) -> dict:
+    times = []
+    heavy = ""
+    for _ in range(runs):
+        elapsed, heavy = run(setup, statement)
+        times.append(elapsed)
+    return {"median": statistics.median(times) * 1e3, "min": min(times) * 1e3, "heavy": heavy}
+
+
+def commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True)
+    return result.stdout.strip()
+
+
+def record(rows: list) -> None:
+    makedirs(path.dirname(HISTORY), exist_ok=True)
+    new = not path.exists(HISTORY)
+    with open(HISTORY, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new:
+            writer.writerow(["date", "commit", "python", "machine", "target", "median_ms", "min_ms", "heavy"])
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-record", action="store_true")
+    parser.add_argument("targets", nargs="*", default=list(TARGETS))
+    args = parser.parse_args()
+
+    date = dt.datetime.now().isoformat(timespec="seconds")
+    rows = []
+    print(f"{'target':<20} {'median':>10} {'min':>10}  heavy imports")
+    for target in args.targets:
+        try:
+            result = bench(*TARGETS[target], args.runs)
+        except RuntimeError as e:
+            print(f"{target:<20} failed: {e}")
+            continue
+        print(f"{target:<20} {result['median']:>7.1f} ms {result['min']:>7.1f} ms  {result['heavy'] or '-'}")
+        rows.append([date, commit(), platform.python_version(), platform.machine(), target,
+                     f"{result['median']:.1f}", f"{result['min']:.1f}", result["heavy"]])
+
+    if rows and not args.no_record:
+        record(rows)
+        print(f"\nAppended to {path.relpath(HISTORY)}")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Benchmark for the text to speech backends.
+   Measures the latency of synthesizing single phrases and the throughput
+   of synthesizing them in one batch, for every backend that is available.
+
+   usage: python3 benchmarks/bench_tts.py [backends...]"""
+
+import sys
+import time
+import tempfile
+
+from os import path
+
+sys.path.insert(0, path.normpath(path.join(path.dirname(__file__), "../src")))
+
+from speech import BACKENDS
+
+PHRASES = ["Good morning",
+           "Tot morgen",
+           "Je begint vandaag het 1e uur met wiskunde b om 08:30. Je hebt vandaag geen tussenuren. Fijne dag!",
+           "Je begint vandaag het 2e uur met nederlands om 09:20. Vandaag heb je verkort rooster. "
+           "Je hebt vandaag de volgende tussenuren: het 4e,5e. Fijne dag!",
+           "Je hebt vandaag vrij, dus ik weet niet waarom je een wekker zet, oelewapper!"] * 4
+
+
+def bench(backend) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        latencies = []
+        for i, text in enumerate(PHRASES):
+            t0 = time.perf_counter()
+            backend.synthesize(text, "nl", path.join(tmp_dir, f"single-{i}"))
+            latencies.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        backend.synthesize_many([(text, "nl", path.join(tmp_dir, f"batch-{i}")) for i, text in enumerate(PHRASES)])
+        t_batch = time.perf_counter() - t0
+
+    latencies.sort()
+    return {"p50": latencies[len(latencies) // 2] * 1e3,
+            "max": latencies[-1] * 1e3,
+            "single": len(PHRASES) / sum(latencies),
+            "batch": len(PHRASES) / t_batch}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BACKENDS)
+    print(f"{'backend':>8} {'p50 (ms)':>10} {'max (ms)':>10} {'single (phrases/s)':>20} {'batch (phrases/s)':>19}")
+    for name in names:
+        backend = BACKENDS[name]()
+        if not backend.available():
+            print(f"{name:>8} {'not available':>10}")
+            continue
+        result = bench(backend)
+        print(f"{name:>8} {result['p50']:>10.1f} {result['max']:>10.1f} {result['single']:>20.2f} {result['batch']:>19.2f}")
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Import-time profile of an entry point of the program.
+   Imports the module in a fresh interpreter with `python -X importtime` and
+   reports the slowest imports, by cumulative time and by top-level package.
+
+   usage: python3 benchmarks/import_profile.py [module] [top]
+          (default: app 15)"""
+
+import re
+import sys
+import subprocess
+
+from os import path
+from collections import defaultdict
+
+SRC_DIR = path.normpath(path.join(path.dirname(__file__), "../src"))
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def profile(module: str) -> tuple:
+    """Returns ([(self_us, cumulative_us, depth, name)], error) of importing module"""
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=SRC_DIR, capture_output=True, text=True)
+    imports = []
+    error = ""
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append((int(self_us), int(cumulative_us), len(indent) // 2, name))
+        elif not line.startswith("import time:"):
+            error = line
+    return imports, error if result.returncode else ""
+
+
+def report(module: str, top: int) -> None:
+    imports, error = profile(module)
+    # Children are listed before their parent, the module itself comes last
+    total = next((cumulative for _, cumulative, depth, name in imports if depth == 0 and name == module),
+                 sum(cumulative for _, cumulative, depth, _ in imports if depth == 0))
+    print(f"import {module}: {total / 1e3:.1f} ms, {len(imports)} modules")
+    if error:
+        print(f"  failed: {error}")
+
+    print(f"\n{'cumulative':>12} {'self':>10}  module")
+    for self_us, cumulative_us, depth, name in sorted(imports, key=lambda i: -i[1])[:top]:
+        print(f"{cumulative_us / 1e3:>9.1f} ms {self_us / 1e3:>7.1f} ms  {'  ' * depth}{name}")
+
+    packages = defaultdict(lambda: [0, 0])
+    for self_us, _, _, name in imports:
+        packages[name.split(".")[0]][0] += self_us
+        packages[name.split(".")[0]][1] += 1
+    print(f"\n{'self total':>12} {'modules':>8}  package")
+    for package, (self_us, count) in sorted(packages.items(), key=lambda i: -i[1][0])[:top]:
+        print(f"{self_us / 1e3:>9.1f} ms {count:>8}  {package}")
+
+
+if __name__ == "__main__":
+    report(sys.argv[1] if len(sys.argv) > 1 else "app", int(sys.argv[2]) if len(sys.argv) > 2 else 15)
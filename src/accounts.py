@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Runs the alarms of several Magister accounts (a household, a dorm floor) on one
+   host. Every account has its own json files in accounts/<name>/ and its own Malarm,
+   the alarms of all of them are scheduled on one dispatcher (their event types carry
+   the account, e.g. "Alarm@alice") and the scrapes share a limited number of slots,
+   so a refresh of every account never starts a browser per account at once.
+
+   usage: python3 accounts.py add <name>   (asks for the Magister credentials)
+          python3 accounts.py list
+   app.py, asgi_app.py and owner.py run all accounts once there is one"""
+
+import os
+import sys
+import asyncio
+import logging
+import threading
+import datetime as dt
+
+from os import path
+
+from malarm import Malarm, MalarmStatus
+from json_helper import JsonHelper, ACCOUNTS_DIR
+
+
+def account_names(json_dir="../") -> list:
+    accounts_path = path.normpath(path.join(path.dirname(__file__), json_dir, ACCOUNTS_DIR))
+    if not path.isdir(accounts_path):
+        return []
+    return sorted(name for name in os.listdir(accounts_path) if path.isdir(path.join(accounts_path, name)))
+
+
+def create(times: tuple, audio_path: str, pin: int, json_helper: JsonHelper, **kwargs):
+    """The Accounts when accounts/ has any, otherwise a single Malarm on the main json files"""
+
+    names = account_names(json_helper.path)
+    if names:
+        return Accounts(names, times, audio_path, pin, json_helper=json_helper, **kwargs)
+    return Malarm(times, audio_path, pin, json_helper=json_helper, **kwargs)
+
+
+def members(malarm) -> list:
+    """The Malarms behind malarm: the ones of an Accounts, or malarm itself"""
+
+    if isinstance(malarm, Accounts):
+        return list(malarm.malarms.values())
+    return [malarm]
+
+
+class Accounts:
+    """Takes the place of a Malarm for the web interface and the live feed. The status
+       is Scraping while any of the accounts scrapes, and the actions apply to all of them"""
+
+    def __init__(self, names, times: tuple, audio_path: str, pin: int, json_helper: JsonHelper = None,
+                 max_scrapes: int = None, **kwargs):
+        """kwargs are passed on to the Malarm of every account. max_scrapes is taken
+           from "max_scrapes" in the main config.json when not given, by default 2"""
+
+        # The main json files only hold the shared settings, not an account
+        self.json_helper = json_helper or JsonHelper(json_dir="../")
+        self.json_helper.initialize(files=("config.json", "out.json", "prev_out.json"))
+        max_scrapes = max_scrapes or self.json_helper.get_config().get("max_scrapes", 2)
+        self.scrape_slots = threading.BoundedSemaphore(max_scrapes)
+        self.malarms = {name: Malarm(times, audio_path, pin, account=name,
+                                     json_helper=JsonHelper(self.json_helper.path, account=name),
+                                     scrape_slots=self.scrape_slots, keep_browser=False, **kwargs)
+                        for name in names}
+        self.status_listeners = []
+        self.log = logging.getLogger("Malarm")
+        for malarm in self.malarms.values():
+            malarm.add_status_listener(self.__on_status)
+        self.log.info("Running %d accounts, at most %d scrapes at a time", len(self.malarms), max_scrapes)
+
+    def get_status(self) -> MalarmStatus:
+        if any(malarm.get_status() == MalarmStatus.Scraping for malarm in self.malarms.values()):
+            return MalarmStatus.Scraping
+        return MalarmStatus.Running
+
+    @property
+    def phase(self) -> str:
+        """The phases of the running scrapes, e.g. "alice: login, bob: queued" """
+
+        return ", ".join(f"{name}: {malarm.phase}" for name, malarm in self.malarms.items() if malarm.phase) or None
+
+    def add_status_listener(self, listener) -> None:
+        """listener(status: MalarmStatus, phase: str) is called on every status
+           change and phase transition of any of the accounts"""
+
+        self.status_listeners.append(listener)
+
+    def __on_status(self, status: MalarmStatus, phase: str) -> None:
+        status, phase = self.get_status(), self.phase
+        for listener in self.status_listeners:
+            try:
+                listener(status, phase)
+            except:
+                self.log.exception("Exception inside status listener")
+
+    def get_last_update(self) -> dt.datetime:
+        """The last update of the account that was updated longest ago"""
+
+        return min(malarm.get_last_update() for malarm in self.malarms.values())
+
+    def refresh_magister_data(self) -> list:
+        """Starts a refresh of every account, they wait for a scrape slot. Returns the threads"""
+
+        return [malarm.refresh_magister_data() for malarm in self.malarms.values()]
+
+    async def refresh_magister_data_async(self) -> bool:
+        results = await asyncio.gather(*(malarm.refresh_magister_data_async() for malarm in self.malarms.values()))
+        return all(results)
+
+    def setup_alarms(self, dispatcher) -> list:
+        return [f"{name}: {msg}" for name, malarm in self.malarms.items() for msg in malarm.setup_alarms(dispatcher)]
+
+    def update_alarms(self, dispatcher) -> list:
+        return [f"{name}: {msg}" for name, malarm in self.malarms.items() for msg in malarm.update_alarms(dispatcher)]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "add":
+        JsonHelper(account=sys.argv[2]).initialize()
+    elif sys.argv[1:] == ["list"]:
+        print("\n".join(account_names()) or "No accounts")
+    else:
+        sys.exit(__doc__)
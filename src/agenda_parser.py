@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Parser backends for the Magister agenda page. Every backend yields the rows
+   of the k-grid-content tbody as (kind, text) tuples:
+     ("day", text of the row)            for a date row (role="row")
+     ("hour", text of the third cell)    for a lesson row
+     ("other", text of the row)          for any other row
+   A row nested in another one is a row of its own as well, and the text of
+   script and style elements is left out, as bs4 does"""
+
+from html.parser import HTMLParser
+
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input",
+                 "link", "meta", "param", "source", "track", "wbr"}
+GRID_CLASS = "k-grid-content"
+LESUUR_BIND = "dataItem.lesuur"
+
+
+def bs4_rows(html: str):
+    """The original BeautifulSoup tree, builds the whole page"""
+
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for entry in soup.find(class_=GRID_CLASS).tbody.find_all("tr"):
+        if entry.has_attr("role") and entry["role"] == "row":
+            yield "day", entry.text
+        elif entry.find(attrs={"ng-bind": LESUUR_BIND}):
+            cells = entry.find_all("td")
+            yield "hour", cells[2].text if len(cells) > 2 else None
+        else:
+            yield "other", entry.text
+
+
+def lxml_rows(html: str):
+    """C-backed libxml2 parser, still builds the whole page but much faster"""
+
+    import lxml.html
+
+    root = lxml.html.fromstring(html)
+    grid = root.xpath(f"//*[contains(concat(' ', normalize-space(@class), ' '), ' {GRID_CLASS} ')]")[0]
+    tbody = grid.xpath(".//tbody")[0]
+    # text_content() would include their code, drop_tree keeps the text after them
+    for element in tbody.xpath(".//script | .//style"):
+        element.drop_tree()
+    for entry in tbody.iter("tr"):
+        if entry.get("role") == "row":
+            yield "day", entry.text_content()
+        elif entry.xpath(f".//*[@ng-bind='{LESUUR_BIND}']"):
+            cells = entry.xpath(".//td")
+            yield "hour", cells[2].text_content() if len(cells) > 2 else None
+        else:
+            yield "other", entry.text_content()
+
+
+class AgendaTokenizer(HTMLParser):
+    """Streaming tokenizer that only keeps state for the rows of the first
+       tbody inside the k-grid-content element, and stops once it is closed.
+       The open rows form a stack: the text and cells of a nested row count for
+       the rows around it too, and the rows are yielded in the order they start"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.done = False
+        self.grid_tag = None
+        self.grid_depth = 0
+        self.tbody_depth = 0
+        self.seen_tbody = False
+        self.skip_depth = 0
+        self.open_rows = []
+        # Rows in the order they started, yielded once the outermost one is closed
+        self.pending = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if self.grid_tag is None:
+            classes = (dict(attrs).get("class") or "").split()
+            if GRID_CLASS in classes and tag not in VOID_ELEMENTS:
+                self.grid_tag = tag
+                self.grid_depth = 1
+            return
+        if tag == self.grid_tag:
+            self.grid_depth += 1
+        if tag == "tbody":
+            if self.seen_tbody and self.tbody_depth == 0:
+                return
+            self.seen_tbody = True
+            self.tbody_depth += 1
+            return
+        if self.tbody_depth == 0:
+            return
+
+        if tag in ("script", "style"):
+            self.skip_depth += 1
+        if tag == "tr":
+            row = {"role": dict(attrs).get("role"), "text": [], "lesuur": False,
+                   "cells": 0, "cell_text": None, "cell_depth": 0}
+            self.open_rows.append(row)
+            self.pending.append(row)
+            return
+        for row in self.open_rows:
+            if tag == "td":
+                row["cells"] += 1
+                if row["cell_depth"] > 0:
+                    row["cell_depth"] += 1
+                elif row["cells"] == 3:
+                    row["cell_text"] = []
+                    row["cell_depth"] = 1
+            if ("ng-bind", LESUUR_BIND) in attrs:
+                row["lesuur"] = True
+
+    def handle_endtag(self, tag):
+        if self.done or self.grid_tag is None:
+            return
+        if tag == self.grid_tag:
+            self.grid_depth -= 1
+            if self.grid_depth == 0:
+                self.done = True
+                return
+        if self.tbody_depth == 0:
+            return
+        if tag == "tbody":
+            self.tbody_depth -= 1
+            if self.tbody_depth == 0:
+                self.done = True
+            return
+
+        if tag in ("script", "style") and self.skip_depth:
+            self.skip_depth -= 1
+        if not self.open_rows:
+            return
+        if tag == "td":
+            for row in self.open_rows:
+                if row["cell_depth"] > 0:
+                    row["cell_depth"] -= 1
+        elif tag == "tr":
+            self.open_rows.pop()
+            if not self.open_rows:
+                self.rows.extend(map(self.row_tuple, self.pending))
+                self.pending.clear()
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        for row in self.open_rows:
+            row["text"].append(data)
+            if row["cell_depth"] > 0:
+                row["cell_text"].append(data)
+
+    @staticmethod
+    def row_tuple(row: dict) -> tuple:
+        if row["role"] == "row":
+            return "day", "".join(row["text"])
+        if row["lesuur"]:
+            return "hour", "".join(row["cell_text"]) if row["cell_text"] is not None else None
+        return "other", "".join(row["text"])
+
+
+def stream_rows(html: str, chunk_size=16384):
+    """Incremental tokenizer, skips everything before the grid and stops after its tbody"""
+
+    start = html.find(GRID_CLASS)
+    if start == -1:
+        return
+    start = html.rfind("<", 0, start)
+
+    tokenizer = AgendaTokenizer()
+    for i in range(max(start, 0), len(html), chunk_size):
+        tokenizer.feed(html[i:i + chunk_size])
+        yield from tokenizer.rows
+        tokenizer.rows.clear()
+        if tokenizer.done:
+            return
+    tokenizer.close()
+    yield from tokenizer.rows
+
+
+BACKENDS = {"bs4": bs4_rows,
+            "lxml": lxml_rows,
+            "stream": stream_rows}
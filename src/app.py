@@ -1,104 +1,226 @@
 #!/usr/bin/env python3
 
+import os
+import json
 import string
 import random
 import logging
 import datetime as dt
 
 from os import path
-from functools import cmp_to_key
-from flask import Flask, render_template, request, redirect, url_for, flash
-from malarm import Malarm
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session
+import accounts
 from event_dispatcher import EventDispatcher
 from json_helper import JsonHelper
-from function import alarm_function, available_functions
+from journal import AlarmJournal
+from refresh_scheduler import RefreshScheduler
+from input_events import InputEvents
+from recurrence import rule_for
+from metrics import REGISTRY, CONTENT_TYPE
+from live_feed import LiveFeed, sse_stream
+from http_cache import RenderCache, make_etag, not_modified, static_version, page_version, document_version, \
+    REVALIDATE, STATIC_CACHE_CONTROL, UNVERSIONED_CACHE_CONTROL
+from function import available_functions, warmup
     
 app = Flask(__name__, template_folder="../templates", static_folder="../static")
 app.secret_key = "".join([random.choice(string.ascii_letters + string.digits) for _ in range(20)])
 json_helper = JsonHelper()
+feed = LiveFeed()
+cache = RenderCache()
+# The event types the page can schedule, wsgi.py takes them from the owner
+functions = available_functions
 # app_file_handler = logging.FileHandler(path.normpath(path.join(path.dirname(__file__), "../logs/malarm.log")))
 # app.logger.addHandler(app_file_handler)
 
+def finish(msgs=None):
+    """Ends a form post: the messages are flashed on the index page, or returned as
+       json when the client asked for json (the page posts its forms that way)"""
+
+    if isinstance(msgs, str):
+        msgs = [msgs]
+    msgs = msgs or []
+    if request.accept_mimetypes.best == "application/json":
+        return {"messages": msgs}
+    for msg in msgs:
+        flash(msg)
+    return redirect(url_for("index"))
+
+
+def cached(name: str, version: tuple, render, mimetype="text/html") -> Response:
+    """304 Not Modified when the client has this version already, otherwise the
+       cached rendering of this version (rendered by render() on a miss)"""
+
+    etag = make_etag(name, version)
+    if not_modified(request.headers.get("If-None-Match"), etag):
+        response = Response(status=304)
+    else:
+        etag, body = cache.get(name, version, render)
+        response = Response(body, mimetype=mimetype)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE
+    return response
+
+
+def state_version() -> tuple:
+    """Version of everything the page shows, wsgi.py takes it from the owner so
+       every worker makes the same etags"""
+
+    return page_version(feed, dispatcher, json_helper)
+
+
+def out_version() -> tuple:
+    return document_version(json_helper, "out.json")
+
+
+@app.url_defaults
+def static_url_version(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        values["v"] = static_version(path.join(app.static_folder, values["filename"]))
+
+
+@app.after_request
+def static_cache_headers(response):
+    if request.endpoint == "static":
+        response.headers["Cache-Control"] = STATIC_CACHE_CONTROL if "v" in request.args else UNVERSIONED_CACHE_CONTROL
+    return response
+
+
+def render_index() -> str:
+    # Taken before reading the state, the page follows the feed from here
+    seq = feed.seq
+    _format = "%H:%M (%d-%m-%Y)"
+    event_list = dispatcher.get_current()
+    current_events = [(e.time.strftime(_format), e.name, str(e.rule) if e.rule else "",
+                       e.time.isoformat(timespec="minutes")) for e in event_list]
+    last_update = malarm.get_last_update()
+    if last_update == dt.datetime(year=1, month=1, day=1):
+        last_update = "Never"
+    else:
+        last_update = last_update.strftime(_format)
+    _status = malarm.get_status().name
+
+    return render_template("index.html", current_events=current_events
+                           , last_update=last_update
+                           , status=_status
+                           , seq=seq
+                           , types = list(functions))
+
+
 @app.route("/", methods=["GET"])
 def index():
-    if request.method == "GET":
-        _format = "%H:%M (%d-%m-%Y)"
-        event_list = dispatcher.get_current()
-        event_list.sort(key=cmp_to_key(EventDispatcher.compare_events))
-        current_events = [(e.time.strftime(_format), e.name) for e in event_list]
-        last_update = json_helper.get_last_update()
-        if last_update == dt.datetime(year=1, month=1, day=1):
-            last_update = "Never"
-        else:
-            last_update = last_update.strftime(_format)
-        _status = malarm.get_status().name
-
-        return render_template("index.html", current_events=current_events
-                               , last_update=last_update
-                               , status=_status
-                               , types = available_functions.keys())
+    if "_flashes" in session:
+        # The messages are shown once, so that page is not cached
+        return render_index()
+    return cached("index", state_version(), render_index)
 
 
 @app.route("/schedule_event", methods=["POST"])
 def schedule_event():
     event_due = dt.datetime.fromisoformat(request.form["datetime"])
     event_function = request.form["function"]
-    msgs = dispatcher.dispatch(event_due, available_functions[event_function])
-    if msgs:
-        if isinstance(msgs, list):
-            for msg in msgs:
-                flash(msg)
-        else:
-            flash(msgs)
-
-    return redirect(url_for("index"))
+    if event_function not in functions:
+        return finish(f"Unknown event type {event_function}")
+    rule = rule_for(request.form.get("repeat", "once"), event_due)
+    if rule:
+        msgs = dispatcher.dispatch_rule(rule, functions[event_function])
+    else:
+        msgs = dispatcher.dispatch(event_due, functions[event_function])
+    return finish(msgs)
 
 
 @app.route("/cancel_event", methods=["POST"])
 def cancel_event():
-    msg = dispatcher.cancel_event_by_name(request.form["name"])
-    if msg:
-        flash(msg)
-    return redirect(url_for("index"))
+    return finish(dispatcher.cancel_event_by_name(request.form["name"]))
 
 
 @app.route("/cancel_all", methods=["POST"])
 def cancel_all():
     dispatcher.cancel_all()
-    return redirect(url_for("index"))
+    return finish()
 
 
 @app.route("/status", methods=["POST"])
 def status():
     dispatcher.status()
-    return redirect(url_for("index"))
+    app.logger.info("Json cache: %s", json_helper.stats())
+    return finish()
 
 
 @app.route("/magister_scrape", methods=["POST"])
 def magister_scrape():
     malarm.refresh_magister_data()
-    return redirect(url_for("index"))
+    return finish()
 
 
 @app.route("/setup_alarms", methods=["POST"])
 def setup_alarms():
-    msgs = malarm.setup_alarms(dispatcher)
-    if msgs:
-        if type(msgs) == list:
-            for msg in msgs:
-                flash(msg)
-        else:
-            flash(msgs)
-    return redirect(url_for("index"))
+    return finish(malarm.setup_alarms(dispatcher))
+
+
+@app.route("/update_alarms", methods=["POST"])
+def update_alarms():
+    return finish(malarm.update_alarms(dispatcher))
+
+
+@app.route("/stop", methods=["POST"])
+def stop():
+    stopped = inputs.stop_alarm("http")
+    return finish(f"Stopped {', '.join(stopped)}" if stopped else "No alarm is ringing")
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+
+@app.route("/api/state", methods=["GET"])
+def api_state():
+    return cached("state", state_version(), lambda: json.dumps(feed.state(dispatcher, malarm)), "application/json")
+
+
+@app.route("/api/changes", methods=["GET"])
+def api_changes():
+    """Long poll: waits up to timeout seconds for the deltas after since"""
+
+    since = request.args.get("since", feed.seq, type=int)
+    deltas = feed.wait(since, min(request.args.get("timeout", 25, type=float), 30))
+    if deltas is None:
+        return {"seq": feed.seq, "reset": True, "deltas": []}
+    return {"seq": deltas[-1]["seq"] if deltas else since, "reset": False, "deltas": deltas}
+
+
+@app.route("/api/stream", methods=["GET"])
+def api_stream():
+    """Server-sent events, a reconnecting EventSource continues from its Last-Event-ID"""
+
+    since = request.headers.get("Last-Event-ID", request.args.get("since", feed.seq, type=int), type=int)
+    return Response(sse_stream(feed, since), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route("/out_json", methods=["GET"])
 def out_json():
-    return {"out_json" : json_helper.get_out()}
+    """Serialized once per version of out.json, which only changes after a scrape"""
+
+    return cached("out_json", out_version(),
+                  lambda: json.dumps({"out_json": json_helper.get_out()}), "application/json")
 
 
 if __name__ == "__main__":
-    global m, dispatcher
-    malarm = Malarm((1800, 2400, 1200), "../audio-files/alarm_sound.mp3", 10)
-    dispatcher = EventDispatcher()
+    global m, dispatcher, inputs
+    # One Malarm, or the Malarms of the accounts in accounts/
+    malarm = accounts.create((1800, 2400, 1200), "../audio-files/alarm_sound.mp3", 10, json_helper=json_helper)
+    dispatcher = EventDispatcher(journal=AlarmJournal())
+    inputs = InputEvents(dispatcher, pin=10)
+    feed.attach(dispatcher, malarm)
+    # The reloader also runs this block in its watching parent process, only the
+    # serving child may restore (and so fire) the journaled alarms and refresh
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        restored = dispatcher.restore(available_functions)
+        for member in accounts.members(malarm):
+            member.adopt_alarms(restored)
+            RefreshScheduler(member, dispatcher).start()
+        inputs.start()
+        # Loads the audio and speech stacks in the background while the server starts
+        warmup()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""asyncio mode of the web interface: the app.py routes as an ASGI application.
+   The dispatcher timers, scrapes and alarms all run on the same event loop
+   as the server, so there are no threads while idle"""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+import mimetypes
+import datetime as dt
+
+from os import path
+from urllib.parse import parse_qs, quote, unquote
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+import accounts
+from malarm import Malarm
+from event_dispatcher import EventDispatcher, AsyncioTimer
+from json_helper import JsonHelper
+from journal import AlarmJournal
+from refresh_scheduler import RefreshScheduler
+from input_events import InputEvents
+from recurrence import rule_for
+from metrics import REGISTRY, CONTENT_TYPE
+from live_feed import LiveFeed, sse_stream_async
+from http_cache import RenderCache, make_etag, not_modified, static_version, page_version, document_version, \
+    REVALIDATE, STATIC_CACHE_CONTROL, UNVERSIONED_CACHE_CONTROL
+from function import available_functions, warmup
+
+TEMPLATE_DIR = path.normpath(path.join(path.dirname(__file__), "../templates"))
+STATIC_DIR = path.normpath(path.join(path.dirname(__file__), "../static"))
+
+
+class Request:
+    """The parts of an ASGI http request the routes need"""
+
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        self.form = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+        self.query = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        self.cookies = {}
+        for part in self.headers.get("cookie", "").split(";"):
+            if "=" in part:
+                key, value = part.strip().split("=", 1)
+                self.cookies[key] = value
+
+    @staticmethod
+    def get(values: dict, key: str, default=None, type=None):
+        """values[key] converted with type, or the default when it is missing or
+           malformed, like request.args.get(key, default, type=type) in Flask"""
+
+        if key not in values:
+            return default
+        if type is None:
+            return values[key]
+        try:
+            return type(values[key])
+        except ValueError:
+            return default
+
+
+class Response:
+    def __init__(self, body=b"", status=200, content_type="text/html; charset=utf-8", headers=None):
+        self.body = body.encode("utf-8") if isinstance(body, str) else body
+        self.status = status
+        self.headers = [("content-type", content_type)] + (headers or [])
+
+    async def send(self, send, receive=None):
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in self.headers]
+        headers.append((b"content-length", str(len(self.body)).encode()))
+        await send({"type": "http.response.start", "status": self.status, "headers": headers})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+class StreamResponse:
+    """Response with a body that is sent as it is produced by an async generator of
+       strings, until the generator ends or the client disconnects"""
+
+    def __init__(self, chunks, content_type: str, headers=None):
+        self.chunks = chunks
+        self.headers = [("content-type", content_type)] + (headers or [])
+
+    async def send(self, send, receive):
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in self.headers]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        stream = asyncio.get_running_loop().create_task(self.__stream(send))
+        disconnect = asyncio.get_running_loop().create_task(self.__wait_disconnect(receive))
+        await asyncio.wait((stream, disconnect), return_when=asyncio.FIRST_COMPLETED)
+        stream.cancel()
+        disconnect.cancel()
+        # The generator can only be closed once the stream task let go of it
+        await asyncio.gather(stream, disconnect, return_exceptions=True)
+        await self.chunks.aclose()
+
+    async def __stream(self, send):
+        async for chunk in self.chunks:
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    async def __wait_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+
+class AsgiApp:
+    """Minimal ASGI application with the same routes as the Flask app"""
+
+    FLASH_COOKIE = "malarm_flash"
+
+    def __init__(self, malarm: Malarm, dispatcher: EventDispatcher, json_helper: JsonHelper, inputs: InputEvents,
+                 on_startup=None):
+        """on_startup is called once the server reports the startup as complete"""
+
+        self.malarm = malarm
+        self.dispatcher = dispatcher
+        self.json_helper = json_helper
+        self.inputs = inputs
+        self.on_startup = on_startup
+        self.feed = LiveFeed()
+        self.feed.attach(dispatcher, malarm)
+        self.cache = RenderCache()
+        self.env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape())
+        self.routes = {("GET", "/"): self.index,
+                       ("POST", "/schedule_event"): self.schedule_event,
+                       ("POST", "/cancel_event"): self.cancel_event,
+                       ("POST", "/cancel_all"): self.cancel_all,
+                       ("POST", "/status"): self.status,
+                       ("POST", "/magister_scrape"): self.magister_scrape,
+                       ("POST", "/setup_alarms"): self.setup_alarms,
+                       ("POST", "/update_alarms"): self.update_alarms,
+                       ("POST", "/stop"): self.stop,
+                       ("GET", "/api/state"): self.api_state,
+                       ("GET", "/api/changes"): self.api_changes,
+                       ("GET", "/api/stream"): self.api_stream,
+                       ("GET", "/out_json"): self.out_json,
+                       ("GET", "/metrics"): self.metrics}
+        self.tasks = set()
+        self.log = logging.getLogger("Malarm")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                    if self.on_startup:
+                        self.on_startup()
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        request = Request(scope, body)
+        handler = self.routes.get((request.method, request.path))
+        if handler:
+            response = await handler(request)
+        elif request.method == "GET" and request.path.startswith("/static/"):
+            response = self.static_file(request, request.path[len("/static/"):])
+        else:
+            response = Response("Not Found", status=404, content_type="text/plain")
+        await response.send(send, receive)
+
+    @staticmethod
+    def url_for(endpoint: str, filename: str = "") -> str:
+        if endpoint == "static":
+            return f"/static/{filename}?v={static_version(path.join(STATIC_DIR, filename))}"
+        return f"/{endpoint}"
+
+    def cached(self, request: Request, name: str, version: tuple, render,
+               content_type="text/html; charset=utf-8") -> Response:
+        """304 Not Modified when the client has this version already, otherwise the
+           cached rendering of this version (rendered by render() on a miss)"""
+
+        etag = make_etag(name, version)
+        headers = [("etag", etag), ("cache-control", REVALIDATE)]
+        if not_modified(request.headers.get("if-none-match"), etag):
+            return Response(status=304, headers=headers)
+        etag, body = self.cache.get(name, version, render)
+        return Response(body, content_type=content_type, headers=headers)
+
+    def state_version(self) -> tuple:
+        return page_version(self.feed, self.dispatcher, self.json_helper)
+
+    def finish(self, request: Request, messages=None) -> Response:
+        """Ends a form post: a redirect to the index page that shows the messages,
+           or the messages as json when the client asked for json"""
+
+        if messages and not isinstance(messages, list):
+            messages = [messages]
+        if request.headers.get("accept", "").startswith("application/json"):
+            return Response(json.dumps({"messages": messages or []}), content_type="application/json")
+        headers = [("location", "/")]
+        if messages:
+            headers.append(("set-cookie", f"{self.FLASH_COOKIE}={quote(json.dumps(messages))}; Path=/"))
+        return Response(status=302, headers=headers)
+
+    def spawn(self, coro):
+        """Keeps a reference to background tasks so they are not garbage collected"""
+
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def index(self, request: Request) -> Response:
+        if self.FLASH_COOKIE in request.cookies:
+            # The messages are shown once, so that page is not cached
+            messages = json.loads(unquote(request.cookies[self.FLASH_COOKIE]))
+            return Response(self.render_index(messages),
+                            headers=[("set-cookie", f"{self.FLASH_COOKIE}=; Path=/; Max-Age=0")])
+        return self.cached(request, "index", self.state_version(), self.render_index)
+
+    def render_index(self, messages=()) -> str:
+        # Taken before reading the state, the page follows the feed from here
+        seq = self.feed.seq
+        _format = "%H:%M (%d-%m-%Y)"
+        event_list = self.dispatcher.get_current()
+        current_events = [(e.time.strftime(_format), e.name, str(e.rule) if e.rule else "",
+                           e.time.isoformat(timespec="minutes")) for e in event_list]
+        last_update = self.malarm.get_last_update()
+        if last_update == dt.datetime(year=1, month=1, day=1):
+            last_update = "Never"
+        else:
+            last_update = last_update.strftime(_format)
+
+        return self.env.get_template("index.html").render(current_events=current_events
+                                                          , last_update=last_update
+                                                          , status=self.malarm.get_status().name
+                                                          , seq=seq
+                                                          , types=available_functions.keys()
+                                                          , url_for=self.url_for
+                                                          , get_flashed_messages=lambda: messages)
+
+    async def schedule_event(self, request: Request) -> Response:
+        event_due = dt.datetime.fromisoformat(request.form["datetime"])
+        event_function = request.form["function"]
+        if event_function not in available_functions:
+            return self.finish(request, f"Unknown event type {event_function}")
+        rule = rule_for(request.form.get("repeat", "once"), event_due)
+        if rule:
+            return self.finish(request, self.dispatcher.dispatch_rule(rule, available_functions[event_function]))
+        return self.finish(request, self.dispatcher.dispatch(event_due, available_functions[event_function]))
+
+    async def cancel_event(self, request: Request) -> Response:
+        return self.finish(request, self.dispatcher.cancel_event_by_name(request.form["name"]))
+
+    async def cancel_all(self, request: Request) -> Response:
+        self.dispatcher.cancel_all()
+        return self.finish(request)
+
+    async def status(self, request: Request) -> Response:
+        self.dispatcher.status()
+        self.log.info("Json cache: %s", self.json_helper.stats())
+        return self.finish(request)
+
+    async def magister_scrape(self, request: Request) -> Response:
+        self.spawn(self.malarm.refresh_magister_data_async())
+        return self.finish(request)
+
+    async def setup_alarms(self, request: Request) -> Response:
+        return self.finish(request, self.malarm.setup_alarms(self.dispatcher))
+
+    async def update_alarms(self, request: Request) -> Response:
+        return self.finish(request, self.malarm.update_alarms(self.dispatcher))
+
+    async def stop(self, request: Request) -> Response:
+        stopped = self.inputs.stop_alarm("http")
+        return self.finish(request, f"Stopped {', '.join(stopped)}" if stopped else "No alarm is ringing")
+
+    async def api_state(self, request: Request) -> Response:
+        return self.cached(request, "state", self.state_version(),
+                           lambda: json.dumps(self.feed.state(self.dispatcher, self.malarm)), "application/json")
+
+    async def api_changes(self, request: Request) -> Response:
+        """Long poll: waits up to timeout seconds for the deltas after since"""
+
+        since = request.get(request.query, "since", self.feed.seq, type=int)
+        deltas = await self.feed.wait_async(since, min(request.get(request.query, "timeout", 25, type=float), 30))
+        if deltas is None:
+            return self.json_response({"seq": self.feed.seq, "reset": True, "deltas": []})
+        return self.json_response({"seq": deltas[-1]["seq"] if deltas else since, "reset": False, "deltas": deltas})
+
+    async def api_stream(self, request: Request) -> StreamResponse:
+        """Server-sent events, a reconnecting EventSource continues from its Last-Event-ID"""
+
+        since = request.get(request.headers, "last-event-id",
+                            request.get(request.query, "since", self.feed.seq, type=int), type=int)
+        return StreamResponse(sse_stream_async(self.feed, since), "text/event-stream",
+                              headers=[("cache-control", "no-cache"), ("x-accel-buffering", "no")])
+
+    @staticmethod
+    def json_response(data: dict) -> Response:
+        return Response(json.dumps(data), content_type="application/json")
+
+    async def out_json(self, request: Request) -> Response:
+        """Serialized once per version of out.json, which only changes after a scrape"""
+
+        return self.cached(request, "out_json", document_version(self.json_helper, "out.json"),
+                           lambda: json.dumps({"out_json": self.json_helper.get_out()}), "application/json")
+
+    async def metrics(self, request: Request) -> Response:
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    @staticmethod
+    def static_file(request: Request, filename: str) -> Response:
+        file_path = path.normpath(path.join(STATIC_DIR, filename))
+        if not file_path.startswith(STATIC_DIR + path.sep) or not path.isfile(file_path):
+            return Response("Not Found", status=404, content_type="text/plain")
+        stat = os.stat(file_path)
+        etag = make_etag("static", (stat.st_mtime_ns, stat.st_size))
+        headers = [("etag", etag),
+                   ("cache-control", STATIC_CACHE_CONTROL if "v" in request.query else UNVERSIONED_CACHE_CONTROL)]
+        if not_modified(request.headers.get("if-none-match"), etag):
+            return Response(status=304, headers=headers)
+        with open(file_path, "rb") as static:
+            content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+            return Response(static.read(), content_type=content_type, headers=headers)
+
+
+async def main(host="0.0.0.0", port=5000):
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("The asyncio mode needs an ASGI server, install it with `python3 -m pip install uvicorn`")
+
+    loop = asyncio.get_running_loop()
+    json_helper = JsonHelper()
+    # One Malarm, or the Malarms of the accounts in accounts/
+    malarm = accounts.create((1800, 2400, 1200), "../audio-files/alarm_sound.mp3", 10, json_helper=json_helper)
+    dispatcher = EventDispatcher(timer=AsyncioTimer(loop), journal=AlarmJournal())
+    restored = dispatcher.restore(available_functions)
+    for member in accounts.members(malarm):
+        member.adopt_alarms(restored)
+        RefreshScheduler(member, dispatcher).start()
+    inputs = InputEvents(dispatcher, pin=10)
+    inputs.start()
+    # The audio and speech stacks are loaded once the server is up
+    app = AsgiApp(malarm, dispatcher, json_helper, inputs, on_startup=warmup)
+
+    # Serve on the running loop, so the server shares it with the dispatcher
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, lifespan="on"))
+    await server.serve()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+import time
+import asyncio
+import hashlib
+import tempfile
+import logging
+import queue
+import threading
+
+from os import path
+from collections import OrderedDict
+
+from metrics import AUDIO_START
+
+# Hides the pygame banner. Not with redirect_stdout, this module is imported by the
+# warmup thread and the redirect would swallow the prints of the other threads
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+from pygame import mixer
+
+
+class AudioPlayer:
+    """Keeps the mixer initialized and plays decoded clips from memory. Every file is
+       decoded once: the PCM samples are kept in memory (up to memory_budget bytes) and
+       in pcm_folder, from where they are memory-mapped instead of decoded again.
+       A sequence polls the channel every poll_interval seconds to queue the next clip.
+       Channel 0 plays the speech, every ringing alarm claims a channel of its own from
+       the next alarm_channels ones, so alarms of several accounts do not cut each other"""
+
+    def __init__(self, pcm_folder="../speech_cache/pcm", frequency=44100, size=-16, channels=2,
+                 buffer=512, memory_budget=64 * 1024 * 1024, max_age=30 * 24 * 3600, alarm_channels=3,
+                 poll_interval=0.01):
+        mixer.init(frequency=frequency, size=size, channels=channels, buffer=buffer)
+        # The mixer may not grant the requested format, the pcm files have to match the actual one
+        self.format = mixer.get_init()
+        mixer.set_num_channels(max(mixer.get_num_channels(), alarm_channels + 1))
+        mixer.set_reserved(alarm_channels + 1)
+        self.channel = mixer.Channel(0)
+        # More alarms than channels at once wait for a channel, in the order they started
+        self.free_channels = queue.Queue()
+        for number in range(1, alarm_channels + 1):
+            self.free_channels.put(mixer.Channel(number))
+
+        self.pcm_folder = path.normpath(path.join(path.dirname(__file__), pcm_folder))
+        if not path.exists(self.pcm_folder):
+            os.makedirs(self.pcm_folder)
+        self.memory_budget = memory_budget
+        self.sounds = OrderedDict()
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.poll_interval = poll_interval
+        self.log = logging.getLogger("Malarm")
+        self.prune(max_age)
+
+    def prune(self, max_age: float) -> None:
+        """Removes the pcm files that were not used for max_age seconds, e.g. of evicted phrases"""
+
+        now = time.time()
+        for file_name in os.listdir(self.pcm_folder):
+            file_path = path.join(self.pcm_folder, file_name)
+            if now - path.getmtime(file_path) > max_age:
+                os.remove(file_path)
+
+    def __pcm_path(self, file_path: str) -> str:
+        key = hashlib.sha1(f"{path.abspath(file_path)}\n{self.format}".encode("utf-8")).hexdigest()[:20]
+        return path.join(self.pcm_folder, key + ".pcm")
+
+    def __sound_bytes(self, sound: mixer.Sound) -> int:
+        frequency, size, channels = self.format
+        return int(sound.get_length() * frequency * channels * abs(size) // 8)
+
+    def load(self, file_path: str, cache=True) -> mixer.Sound:
+        """Returns the decoded clip, decoding the file only if there is no up to date pcm file.
+           With cache=False the file is decoded without keeping it, e.g. for one-off speech"""
+
+        if not cache:
+            return mixer.Sound(file_path)
+        stat = os.stat(file_path)
+        key = (path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if key in self.sounds:
+                self.sounds.move_to_end(key)
+                return self.sounds[key]
+
+        pcm_path = self.__pcm_path(file_path)
+        if path.exists(pcm_path) and os.stat(pcm_path).st_mtime_ns >= stat.st_mtime_ns:
+            with open(pcm_path, "rb") as pcm:
+                with mmap.mmap(pcm.fileno(), 0, access=mmap.ACCESS_READ) as samples:
+                    sound = mixer.Sound(buffer=samples)
+            # The mtime tells prune the file is still in use, it stays newer than the source
+            os.utime(pcm_path)
+        else:
+            self.log.debug("Decoding %s", file_path)
+            sound = mixer.Sound(file_path)
+            # A unique temp file, the same file may be decoded by two threads at once
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.pcm_folder)
+            with os.fdopen(fd, "wb") as pcm:
+                pcm.write(sound.get_raw())
+            os.replace(tmp_path, pcm_path)
+
+        with self.lock:
+            self.sounds[key] = sound
+            total = sum(map(self.__sound_bytes, self.sounds.values()))
+            while total > self.memory_budget and len(self.sounds) > 1:
+                _, evicted = self.sounds.popitem(last=False)
+                total -= self.__sound_bytes(evicted)
+        return sound
+
+    def preload(self, file_paths) -> None:
+        for file_path in file_paths:
+            try:
+                self.load(file_path)
+            except Exception:
+                self.log.exception("Could not preload %s", file_path)
+
+    def claim_channel(self) -> mixer.Channel:
+        """A channel for one alarm run, blocks while all of them are in use. Give it
+           back with release_channel"""
+
+        return self.free_channels.get()
+
+    def release_channel(self, channel: mixer.Channel) -> None:
+        channel.stop()
+        self.free_channels.put(channel)
+
+    def play(self, file_path: str, loops=0, channel: mixer.Channel = None) -> float:
+        """Starts playing the file (on the speech channel by default), returns its
+           length in seconds (of one loop)"""
+
+        started = time.perf_counter()
+        sound = self.load(file_path)
+        if channel is None:
+            channel = self.channel
+            self.stopped.clear()
+        channel.play(sound, loops=loops)
+        AUDIO_START.observe(time.perf_counter() - started)
+        return sound.get_length()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.channel.stop()
+
+    @staticmethod
+    def __pending(channel: mixer.Channel, queued: bool) -> bool:
+        if queued:
+            return channel.get_queue() is not None
+        return channel.get_busy()
+
+    def wait(self, channel: mixer.Channel, stopped: threading.Event, queued=False) -> bool:
+        """Waits until the channel took its queued clip (queued=True) or finished
+           playing, returns False when stopped"""
+
+        while self.__pending(channel, queued):
+            if stopped.wait(self.poll_interval):
+                return False
+        return True
+
+    async def wait_async(self, channel: mixer.Channel, stopped: threading.Event, queued=False) -> bool:
+        while self.__pending(channel, queued):
+            await asyncio.sleep(self.poll_interval)
+            if stopped.is_set():
+                return False
+        return True
+
+    def play_sequence(self, file_paths, cache=True, stopped: threading.Event = None,
+                      channel: mixer.Channel = None) -> bool:
+        """Plays the files back to back (on the speech channel by default). The next clip
+           is queued as soon as the channel took the previous one from its queue, so
+           there is no gap between them and no queued clip is replaced. Setting stopped
+           (by default the one of stop) cuts the sequence"""
+
+        stopped = stopped or self.stopped
+        started = time.perf_counter()
+        sounds = [self.load(file_path, cache) for file_path in file_paths]
+        if not sounds:
+            return True
+        if channel is None:
+            channel = self.channel
+            self.stopped.clear()
+        channel.play(sounds[0])
+        AUDIO_START.observe(time.perf_counter() - started)
+        for following in sounds[1:]:
+            if not self.wait(channel, stopped, queued=True):
+                channel.stop()
+                return False
+            channel.queue(following)
+        if not self.wait(channel, stopped):
+            channel.stop()
+            return False
+        return True
+
+    async def play_sequence_async(self, file_paths, cache=True, stopped: threading.Event = None,
+                                  channel: mixer.Channel = None) -> bool:
+        stopped = stopped or self.stopped
+        # Decoding may block for a while on a cold cache
+        started = time.perf_counter()
+        sounds = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [self.load(file_path, cache) for file_path in file_paths])
+        if not sounds:
+            return True
+        if channel is None:
+            channel = self.channel
+            self.stopped.clear()
+        channel.play(sounds[0])
+        AUDIO_START.observe(time.perf_counter() - started)
+        for following in sounds[1:]:
+            if not await self.wait_async(channel, stopped, queued=True):
+                channel.stop()
+                return False
+            channel.queue(following)
+        if not await self.wait_async(channel, stopped):
+            channel.stop()
+            return False
+        return True
+
+if __name__ == "__main__":
+    player = AudioPlayer()
+    alarm_sound = path.normpath(path.join(path.dirname(__file__), "../audio-files/alarm_sound.mp3"))
+    t0 = time.perf_counter()
+    player.load(alarm_sound)
+    print(f"First load: {(time.perf_counter() - t0) * 1e3:.1f} ms")
+    player.sounds.clear()
+    t0 = time.perf_counter()
+    player.load(alarm_sound)
+    print(f"Load from pcm file: {(time.perf_counter() - t0) * 1e3:.1f} ms")
+    player.play_sequence([alarm_sound])
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import wave
+import hashlib
+import logging
+import tempfile
+import threading
+import datetime as dt
+
+from os import path
+
+from speech import SpeechManager
+from models import Day, ScheduleException
+
+LESSON_LUT = {"NETL": "nederlands",
+              "SCHK": "scheikunde",
+              "FI": "filosofie",
+              "WISB": "wiskunde b",
+              "NAT": "natuurkunde",
+              "ENTL": "engels",
+              "BIOL": "biologie",
+              "LTC": "latijn",
+              "PE": "gym"}
+
+
+def day_fragments(day: Day, day_start: dt.datetime, dropped: list) -> list:
+    """Splits the briefing of a day into phrases that recur between days, so each
+       of them only has to be synthesized once (see Malarm.get_briefing_fragments)"""
+
+    if not day.hours:
+        return ["Je hebt vandaag vrij, dus ik weet niet waarom je een wekker zet, oelewapper!"]
+
+    lesson = day.hours[0].lesson.split(" - ")
+    fragments = ["Je begint vandaag het",
+                 f"{day.hours[0].number}e uur met",
+                 LESSON_LUT.get(lesson[0]) or "een onbekend vak",
+                 f"om {day_start.time().isoformat(timespec='minutes')}."]
+
+    if day.sched_exception == ScheduleException.SHORT:
+        fragments.append("Vandaag heb je verkort rooster.")
+    elif day.sched_exception == ScheduleException.DAY_OFF:
+        fragments.append("Vandaag heb je een roostervrije dag.")
+
+    if dropped:
+        fragments.append("Je hebt vandaag de volgende tussenuren: het")
+        fragments.extend(f"{hour}e" for hour in dropped[:-1])
+        fragments.append(f"{dropped[-1]}e.")
+    else:
+        fragments.append("Je hebt vandaag geen tussenuren.")
+    fragments.append("Fijne dag!")
+    return fragments
+
+
+class Briefing:
+    """Builds the spoken briefing of a day by splicing the cached fragments into one
+       wav file. The files are cached by their fragments, so an unchanged day is only
+       spliced once and never synthesized again. The prepared briefings are kept by
+       account and date, accounts with the same day share the file"""
+
+    def __init__(self, sm: SpeechManager, folder="../speech_cache/briefings", gap=0.15,
+                 language="nl", max_age=7 * 24 * 3600):
+        self.sm = sm
+        self.folder_path = path.normpath(path.join(path.dirname(__file__), folder))
+        if not path.exists(self.folder_path):
+            os.makedirs(self.folder_path)
+        self.gap = gap
+        self.language = language
+        self.by_date = {}
+        self.lock = threading.Lock()
+        self.log = logging.getLogger("Malarm")
+
+        now = time.time()
+        for file_name in os.listdir(self.folder_path):
+            if now - path.getmtime(path.join(self.folder_path, file_name)) > max_age:
+                os.remove(path.join(self.folder_path, file_name))
+
+    def key(self, fragments: list, language: str = None) -> str:
+        parts = [self.sm.backend.name, language or self.language, str(self.sm.player.format), str(self.gap),
+                 *fragments]
+        return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:20]
+
+    def build(self, fragments: list, language: str = None) -> str:
+        """Returns the path of the spliced briefing, synthesizing only the missing fragments"""
+
+        language = language or self.language
+        file_path = path.join(self.folder_path, self.key(fragments, language) + ".wav")
+        if path.exists(file_path):
+            os.utime(file_path)
+            return file_path
+
+        self.sm.store.warmup(fragments, language)
+        frequency, size, channels = self.sm.player.format
+        frame_size = abs(size) // 8 * channels
+        silence = bytes(int(self.gap * frequency) * frame_size)
+
+        samples = []
+        for fragment in fragments:
+            fragment_path = self.sm.get_reg_file(fragment, language)
+            samples.append(self.sm.player.load(fragment_path).get_raw())
+            samples.append(silence)
+
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.folder_path)
+        with os.fdopen(fd, "wb") as tmp:
+            with wave.open(tmp, "wb") as wav:
+                wav.setnchannels(channels)
+                wav.setsampwidth(abs(size) // 8)
+                wav.setframerate(frequency)
+                wav.writeframes(b"".join(samples[:-1]))
+        os.replace(tmp_path, file_path)
+        return file_path
+
+    def prepare(self, date: dt.date, fragments: list, account: str = None, language: str = None) -> str:
+        file_path = self.build(fragments, language)
+        with self.lock:
+            self.by_date[(account, date)] = file_path
+            for old in [key for key in self.by_date if key[1] < dt.date.today()]:
+                del self.by_date[old]
+        self.sm.player.preload([file_path])
+        return file_path
+
+    def prepare_in_background(self, days: dict, account: str = None, language: str = None) -> threading.Thread:
+        """days maps a date to the fragments of its briefing"""
+
+        def thread_func():
+            for date, fragments in days.items():
+                try:
+                    self.prepare(date, fragments, account, language)
+                except Exception:
+                    self.log.exception("Could not prepare the briefing of %s", date)
+
+        thread = threading.Thread(target=thread_func, name="briefing", daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, date: dt.date, account: str = None) -> str:
+        """Returns the path of the prepared briefing of date, or None"""
+
+        with self.lock:
+            return self.by_date.get((account, date))
+
+    def sequence(self, date: dt.date, account: str = None, language: str = None) -> list:
+        """Good morning, the briefing (if it was prepared) and bye"""
+
+        language = language or self.language
+        briefing = self.get(date, account)
+        return [self.sm.get_reg_file("Good morning", language),
+                *([briefing] if briefing else []),
+                self.sm.get_reg_file("Tot morgen", language)]
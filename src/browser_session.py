@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import logging
+import threading
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException, TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from metrics import SCRAPE_PHASES
+
+DRIVER_START_TIME = SCRAPE_PHASES.child("driver_start")
+LOGIN_TIME = SCRAPE_PHASES.child("login")
+PAGE_LOAD_TIME = SCRAPE_PHASES.child("page_load")
+
+
+class LoginError(Exception):
+    """Raised when logging in to Magister fails"""
+
+
+class BrowserSession:
+    """Long-lived headless Chrome session. The cookies are kept between refreshes,
+       so it only logs in again when the agenda redirects to the login page"""
+
+    GRID = (By.CLASS_NAME, "k-grid-content")
+    GRID_ROW = (By.CSS_SELECTOR, ".k-grid-content tbody tr")
+
+    def __init__(self, base_url="https://esprit.magister.net", headless=True,
+                 timeout=30, idp_marker="microsoft", profile_dir=None):
+        """idp_marker is the part of the url that identifies the identity provider login page,
+           profile_dir keeps the cookies between restarts of the program as well"""
+
+        self.base_url = base_url.rstrip("/")
+        self.agenda_url = self.base_url + "/magister/#/agenda"
+        self.headless = headless
+        self.timeout = timeout
+        self.idp_marker = idp_marker
+        self.profile_dir = profile_dir
+        self.driver = None
+        self.lock = threading.Lock()
+        self.log = logging.getLogger("Malarm")
+        # Called with the name of every phase of a fetch, see metrics.SCRAPE_PHASES
+        self.phase_listener = None
+
+    def __phase(self, phase: str) -> None:
+        if self.phase_listener:
+            try:
+                self.phase_listener(phase)
+            except Exception:
+                self.log.exception("Exception inside phase listener")
+
+    def get_driver(self) -> webdriver.Chrome:
+        if self.driver is None:
+            m_opt = webdriver.ChromeOptions()
+            if self.headless:
+                m_opt.add_argument("--headless")
+                m_opt.add_argument("--disable-gpu")
+            m_opt.add_argument("--window-size=1080,1080")
+            if self.profile_dir:
+                m_opt.add_argument(f"--user-data-dir={self.profile_dir}")
+            self.log.info("Starting browser session")
+            self.__phase("driver_start")
+            started = time.perf_counter()
+            self.driver = webdriver.Chrome(options=m_opt)
+            DRIVER_START_TIME.observe(time.perf_counter() - started)
+        return self.driver
+
+    def wait(self, timeout=None) -> WebDriverWait:
+        return WebDriverWait(self.get_driver(), timeout or self.timeout)
+
+    def fetch_agenda_html(self, creds: dict) -> str:
+        """Returns the html of the rendered agenda, logging in first if the session expired"""
+
+        with self.lock:
+            try:
+                return self.__fetch_agenda_html(creds)
+            except LoginError:
+                raise
+            except WebDriverException:
+                # The browser may have crashed or been closed, retry once with a new one
+                self.log.exception("Browser session failed, restarting it")
+                self.close()
+                return self.__fetch_agenda_html(creds)
+
+    def __fetch_agenda_html(self, creds: dict) -> str:
+        driver = self.get_driver()
+        self.__phase("page_load")
+        started = time.perf_counter()
+        driver.get(self.agenda_url)
+        self.wait().until(lambda d: self.__on_agenda(d) or not self.__at_agenda_url(d))
+
+        if not self.__at_agenda_url(driver):
+            self.login(creds)
+            self.__phase("page_load")
+            started = time.perf_counter()
+            driver.get(self.agenda_url)
+            if not self.__at_agenda_url(driver):
+                raise LoginError("agenda not in url")
+
+        self.wait().until(EC.presence_of_element_located(self.GRID_ROW))
+        PAGE_LOAD_TIME.observe(time.perf_counter() - started)
+        self.log.debug("Agenda has loaded")
+        return driver.page_source
+
+    def get_access_token(self, creds: dict) -> str:
+        """Returns the api access token of the session, logging in first if needed"""
+
+        with self.lock:
+            driver = self.get_driver()
+            driver.get(self.agenda_url)
+            self.wait().until(lambda d: self.__on_agenda(d) or not self.__at_agenda_url(d))
+            if not self.__at_agenda_url(driver):
+                self.login(creds)
+                driver.get(self.agenda_url)
+                self.wait().until(EC.presence_of_element_located(self.GRID))
+
+            # The Magister web app keeps its OpenID Connect user in the session storage
+            users = driver.execute_script(
+                "return Object.keys(sessionStorage)"
+                ".filter(k => k.startsWith('oidc.user:')).map(k => sessionStorage.getItem(k))")
+            for user in users:
+                token = json.loads(user).get("access_token")
+                if token:
+                    return token
+            raise LoginError("No access token in the session")
+
+    def __at_agenda_url(self, driver) -> bool:
+        return driver.current_url.startswith(self.base_url) and "agenda" in driver.current_url
+
+    def __on_agenda(self, driver) -> bool:
+        return self.__at_agenda_url(driver) and bool(driver.find_elements(*self.GRID))
+
+    def login(self, creds: dict) -> None:
+        self.log.info("Logging in")
+        driver = self.get_driver()
+        self.__phase("login")
+        started = time.perf_counter()
+        try:
+            username_submit = self.wait().until(EC.element_to_be_clickable((By.ID, "username_submit")))
+            self.wait().until(lambda d: d.switch_to.active_element.tag_name == "input")
+            ActionChains(driver).send_keys(creds["username"]).perform()
+            username_submit.click()
+
+            try:
+                self.wait().until(EC.url_contains(self.idp_marker))
+            except TimeoutException:
+                raise LoginError(f"{self.idp_marker} not in url")
+
+            pw_submit = self.wait().until(EC.element_to_be_clickable((By.ID, "idSIButton9")))
+            self.wait().until(lambda d: d.switch_to.active_element.tag_name == "input")
+            ActionChains(driver).send_keys(creds["password"]).perform()
+            pw_submit.click()
+
+            # "Stay signed in?" prompt, confirm it so the session cookie is kept
+            self.wait().until(EC.staleness_of(pw_submit))
+            if self.idp_marker in driver.current_url:
+                self.wait().until(EC.element_to_be_clickable((By.ID, "idSIButton9")))
+                ActionChains(driver).send_keys(Keys.ENTER).perform()
+
+            self.wait().until(lambda d: d.current_url.startswith(self.base_url))
+        except TimeoutException:
+            raise LoginError(f"Timed out on {driver.current_url}")
+        LOGIN_TIME.observe(time.perf_counter() - started)
+        self.log.info("Succesfull login")
+
+    def close(self) -> None:
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
@@ -5,10 +5,18 @@ import datetime as dt
 import threading
 import logging
 import sched
+import heapq
+import itertools
+import asyncio
+import bisect
+import functools
 
 from os import path, mkdir
 
-from function import EventFunction, alarm_function
+from function import EventFunction, alarm_function, base_type
+from models import ScheduledEvent
+from recurrence import RecurrenceRule
+from metrics import REGISTRY, TIMER_LATENESS
 
 
 class scheduler_with_polling(sched.scheduler):
@@ -29,24 +37,274 @@ class scheduler_with_polling(sched.scheduler):
     #     super().cancel(event)
 
 
-class ScheduledEvent:
-    """Class for keeping track of event thread info"""
-    def __init__(self, name, time, thread, scheduler):
-        self.name = name
-        self.time = time
-        self.thread = thread
-        self.scheduler = scheduler
+class ThreadedTimer:
+    """Timer backend that runs every event on its own polling scheduler thread"""
 
-    def __repr__(self):
-        return f"({self.name} at {self.time.isoformat(' ', timespec='minutes')})"
+    def schedule(self, timestamp: float, callback) -> tuple:
+        _scheduler = scheduler_with_polling(time.time, time.sleep)
+        _event = _scheduler.enterabs(timestamp, 1, callback)
+        _thread = threading.Thread(target=_scheduler.run, daemon=True)
+        _thread.start()
+        return (_scheduler, _event)
+
+    def schedule_many(self, items: list) -> list:
+        return [self.schedule(timestamp, callback) for timestamp, callback in items]
+
+    def cancel(self, handle: tuple) -> bool:
+        _scheduler, _event = handle
+        try:
+            _scheduler.cancel(_event)
+        except ValueError:
+            return False
+        return True
+
+    def cancel_many(self, handles: list) -> None:
+        for handle in handles:
+            self.cancel(handle)
+
+    def is_pending(self, handle: tuple) -> bool:
+        _scheduler, _event = handle
+        return _event in _scheduler.queue
+
+    def stop(self):
+        pass
+
+
+class HeapTimer:
+    """Timer backend that keeps all events in one heap, serviced by a single thread.
+       The thread sleeps until the next due event and is only woken early when
+       the head of the queue changes."""
+
+    # Upper bound on a single wait, so a wall clock adjustment (e.g. NTP
+    # syncing after boot on a Pi without RTC) is picked up in time
+    MAX_WAIT = 60
+
+    def __init__(self, timefn=time.time):
+        self.timefn = timefn
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._cancelled = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="timer thread", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def schedule(self, timestamp: float, callback) -> list:
+        return self.schedule_many([(timestamp, callback)])[0]
+
+    def schedule_many(self, items: list) -> list:
+        entries = [[timestamp, next(self._counter), callback] for timestamp, callback in items]
+        if not entries:
+            return entries
+        with self._cond:
+            head = self._heap[0] if self._heap else None
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+            if self._heap[0] is not head:
+                self._cond.notify()
+        return entries
+
+    def cancel(self, entry: list) -> bool:
+        with self._cond:
+            if entry[2] is None:
+                return False
+            self.cancel_many([entry])
+        return True
+
+    def cancel_many(self, entries: list) -> None:
+        with self._cond:
+            for entry in entries:
+                if entry[2] is not None:
+                    # Lazy deletion, the entry is dropped once it reaches the head
+                    entry[2] = None
+                    self._cancelled += 1
+            if self._cancelled > len(self._heap) // 2:
+                self._heap = [e for e in self._heap if e[2] is not None]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    @staticmethod
+    def is_pending(entry: list) -> bool:
+        return entry[2] is not None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap) - self._cancelled
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                    self._cancelled -= 1
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - self.timefn()
+                if delay > 0:
+                    self._cond.wait(min(delay, self.MAX_WAIT))
+                    continue
+                entry = heapq.heappop(self._heap)
+                callback, entry[2] = entry[2], None
+            callback()
+
+
+class AsyncioTimer:
+    """Timer backend for the asyncio mode, every event is a loop callback
+       so no threads are involved at all"""
+
+    MAX_WAIT = HeapTimer.MAX_WAIT
+
+    class Handle:
+        def __init__(self, timestamp, callback):
+            self.timestamp = timestamp
+            self.callback = callback
+            self.timer_handle = None
+            self.cancelled = False
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, timefn=time.time):
+        self.loop = loop
+        self.timefn = timefn
+
+    def schedule(self, timestamp: float, callback) -> "AsyncioTimer.Handle":
+        return self.schedule_many([(timestamp, callback)])[0]
+
+    def schedule_many(self, items: list) -> list:
+        handles = [self.Handle(timestamp, callback) for timestamp, callback in items]
+        self._call_in_loop(self._arm_many, handles)
+        return handles
+
+    def cancel(self, handle: "AsyncioTimer.Handle") -> bool:
+        if not self.is_pending(handle):
+            return False
+        self.cancel_many([handle])
+        return True
+
+    def cancel_many(self, handles: list) -> None:
+        handles = [h for h in handles if self.is_pending(h)]
+        for handle in handles:
+            handle.cancelled = True
+        self._call_in_loop(self._disarm_many, handles)
+
+    @staticmethod
+    def is_pending(handle: "AsyncioTimer.Handle") -> bool:
+        return not handle.cancelled and handle.callback is not None
+
+    def stop(self):
+        pass
+
+    def _call_in_loop(self, fn, *args):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _arm_many(self, handles):
+        for handle in handles:
+            self._arm(handle)
+
+    def _arm(self, handle):
+        if handle.cancelled:
+            return
+        delay = handle.timestamp - self.timefn()
+        if delay > 0:
+            # Re-arm at most every MAX_WAIT seconds to follow wall clock changes
+            handle.timer_handle = self.loop.call_later(min(delay, self.MAX_WAIT), self._arm, handle)
+            return
+        callback, handle.callback = handle.callback, None
+        callback()
+
+    @staticmethod
+    def _disarm_many(handles):
+        for handle in handles:
+            if handle.timer_handle is not None:
+                handle.timer_handle.cancel()
+
+
+class EventIndex:
+    """Event store with lookups by name and by (time, type),
+       that keeps the events sorted by time"""
+
+    def __init__(self):
+        self.by_name = {}
+        self.by_key = {}
+        self._sorted = []
+
+    def add(self, event: ScheduledEvent) -> None:
+        self.by_name[event.name] = event
+        self.by_key[(event.time, event.func.type)] = event
+        bisect.insort(self._sorted, (event.time, event.seq, event))
+
+    def remove(self, event: ScheduledEvent) -> bool:
+        if self.by_name.get(event.name) is not event:
+            return False
+        del self.by_name[event.name]
+        if self.by_key.get((event.time, event.func.type)) is event:
+            del self.by_key[(event.time, event.func.type)]
+        i = bisect.bisect_left(self._sorted, (event.time, event.seq))
+        del self._sorted[i]
+        return True
+
+    def get(self, name: str) -> ScheduledEvent:
+        return self.by_name.get(name)
+
+    def find(self, _time: dt.datetime, _type: str) -> ScheduledEvent:
+        return self.by_key.get((_time, _type))
+
+    def sorted(self) -> list:
+        return [entry[2] for entry in self._sorted]
+
+    def __contains__(self, event: ScheduledEvent) -> bool:
+        return self.by_name.get(event.name) is event
+
+    def __len__(self) -> int:
+        return len(self.by_name)
+
+    def __iter__(self):
+        return iter(self.sorted())
 
 
 class EventDispatcher:
 
-    def __init__(self) -> None:
-        self.events = []
+    def __init__(self, timer=None, journal=None) -> None:
+        """Use HeapTimer (default) for a single timer thread, AsyncioTimer to run
+           on an event loop, or ThreadedTimer for the old thread per event behaviour.
+           With an AlarmJournal every change is journaled, see restore()"""
+
+        self.events = EventIndex()
+        self.running = {}
+        # Timer handles by event name, the events themselves are immutable
+        self.handles = {}
         self.event_counter = 0
+        self.lock = threading.RLock()
+        self.journal = journal
+        self.change_listeners = []
+        # Bumped on every change of the scheduled events
+        self.version = 0
+        self.timer = timer or HeapTimer()
+        if hasattr(self.timer, "start"):
+            self.timer.start()
         self.__init_logger()
+        REGISTRY.callback("malarm_dispatcher_queue_depth", "Number of scheduled events", lambda: len(self.events))
+        REGISTRY.callback("malarm_dispatcher_running", "Number of events that are running", lambda: len(self.running))
 
     def __init_logger(self):
         self.log = logging.getLogger("Event Dispatcher")
@@ -77,56 +335,278 @@ class EventDispatcher:
         
         
     def dispatch(self, _time: dt.datetime, func: EventFunction):
-
-        def schedule_function(_scheduler, _time: dt.datetime):
-            _scheduler.enterabs(_time.timestamp(), 1, func)
-            _scheduler.run()
-            self.log.debug("done with thread, removing from list...")
-            for event in self.events:
-                if event.thread == threading.current_thread():
-                    self.events.remove(event)
-                    break
-
-        for event in self.events:
-            if event.time == _time and func.type in event.name:
+        return self.dispatch_many([(_time, func)])[0]
+
+    def dispatch_many(self, items) -> list:
+        """Dispatches an iterable of (time, function) pairs in one step,
+           with a single timer wakeup. Returns a message per item"""
+
+        with self.lock:
+            msgs, new_events = self.__add_events(items)
+            self.__schedule([e for e in new_events if e])
+            self.__changed([e for e in new_events if e], [])
+        return msgs
+
+    def __add_events(self, items) -> tuple:
+        msgs = []
+        new_events = []
+        for _time, func in items:
+            if self.events.find(_time, func.type):
+                msgs.append("Duplicate event found, not dispatching it")
+                new_events.append(None)
+                continue
+
+            self.event_counter += 1
+            _name = f"{func.type}-{self.event_counter}"
+            event = ScheduledEvent(_name, _time, func, self.event_counter, None, 0)
+            self.events.add(event)
+            new_events.append(event)
+            msgs.append("Succesfully set new event.")
+        return msgs, new_events
+
+    def dispatch_rule(self, rule: RecurrenceRule, func: EventFunction) -> str:
+        """Dispatches a recurring event. Only its next occurrence is scheduled, the
+           one after that is computed when it fires (see __advance)"""
+
+        now = dt.datetime.now()
+        first = rule.first()
+        if first is not None and first[0] < now:
+            # Starts from the next occurrence, not with the ones that are already past
+            first = rule.next_after(*first, now)
+        if first is None:
+            return "The rule has no occurrences"
+        with self.lock:
+            if self.events.find(first[0], func.type):
                 return "Duplicate event found, not dispatching it"
-
-        self.event_counter += 1
-        _name = f"{func.type}-{self.event_counter}"
-        _scheduler = scheduler_with_polling(time.time, time.sleep)
-        _thread = threading.Thread(target=schedule_function
-                                   , args=(_scheduler, _time)
-                                   , name=_name
-                                   , daemon=True)
-        _thread.start()
-        event = ScheduledEvent(_name, _time, _thread, _scheduler)
-        self.events.append(event)
-        self.log.info("Scheduled event: %s", event)
+            self.event_counter += 1
+            event = ScheduledEvent(f"{func.type}-{self.event_counter}", first[0], func,
+                                   self.event_counter, rule, first[1])
+            self.events.add(event)
+            self.__schedule([event])
+            self.__changed([event], [])
         return "Succesfully set new event."
 
-    def cancel_event(self, event: ScheduledEvent):
-        scheduler_event = event.scheduler.queue[1]
-        event.scheduler.cancel(scheduler_event)
-        self.log.info("Removed event: %s", event)
-        time.sleep(0.05)
+    def __advance(self, event: ScheduledEvent) -> None:
+        """Replaces the firing occurrence of a recurring event by the next one, under the same name"""
+
+        with self.lock:
+            if not self.events.remove(event):
+                return
+            self.handles.pop(event.name, None)
+            following = event.rule.next(event.time, event.occurrence)
+            if following is None:
+                self.log.info("Last occurrence of %s", event)
+                self.__changed([], [event])
+                return
+            self.event_counter += 1
+            next_event = ScheduledEvent(event.name, following[0], event.func, self.event_counter,
+                                        event.rule, following[1])
+            self.events.add(next_event)
+            self.__schedule([next_event])
+            self.__changed([next_event], [])
+
+    def add_change_listener(self, listener) -> None:
+        """listener(added, removed) is called with the lists of added and removed events
+           after every change of the scheduled events. It is called with the lock held,
+           so the changes arrive in order"""
+
+        self.change_listeners.append(listener)
+
+    def __changed(self, dispatched: list, cancelled: list) -> None:
+        self.__journal(dispatched, cancelled)
+        self.__notify(dispatched, cancelled)
+
+    def __notify(self, dispatched: list, cancelled: list) -> None:
+        if not dispatched and not cancelled:
+            return
+        self.version += 1
+        for listener in self.change_listeners:
+            try:
+                listener(dispatched, cancelled)
+            except:
+                self.log.exception("Exception inside change listener")
+
+    def __journal(self, dispatched: list, cancelled: list) -> None:
+        if not self.journal:
+            return
+        self.journal.record_cancel([e.name for e in cancelled if e.func.persist])
+        self.journal.record_dispatch([e for e in dispatched if e.func.persist])
+        if self.journal.needs_compaction():
+            self.journal.compact(self.events.sorted(), self.event_counter)
+
+    def restore(self, functions: dict) -> list:
+        """Rebuilds the events from the journal, skipping the ones that are already
+           in the past. functions maps an event type to its EventFunction"""
+
+        if not self.journal:
+            return []
+        started = time.time()
+        with self.lock:
+            counter, records = self.journal.load()
+            self.event_counter = max(self.event_counter, counter)
+            restored = []
+            now = dt.datetime.now()
+            for _name, _time, _type, seq, rule, occurrence in records:
+                if _type not in functions:
+                    self.log.warning("Cannot restore %s, unknown type %s", _name, _type)
+                    continue
+                if rule is not None:
+                    # Skip the occurrences that were missed while the program was not running
+                    rule = RecurrenceRule.from_json(rule)
+                    following = rule.next_after(_time, occurrence, now)
+                    if following is None:
+                        continue
+                    _time, occurrence = following
+                event = ScheduledEvent(_name, _time, functions[_type], seq, rule, occurrence)
+                self.events.add(event)
+                restored.append(event)
+            self.__schedule(restored, log_each=False)
+            self.journal.compact(self.events.sorted(), self.event_counter)
+            self.__notify(restored, [])
+        self.log.info("Restored %d events from the journal in %.1f milliseconds",
+                      len(restored), (time.time() - started) * 1000)
+        return restored
+
+    def __schedule(self, events: list, log_each=True) -> None:
+        handles = self.timer.schedule_many(
+            [(e.time.timestamp(), functools.partial(self.__fire, e)) for e in events])
+        for event, handle in zip(events, handles):
+            self.handles[event.name] = handle
+            if log_each:
+                self.log.info("Scheduled event: %s", event)
+
+    def __fire(self, event: ScheduledEvent):
+        """Called by the timer when an event is due, runs the function on its own
+           thread (or task in asyncio mode) so a ringing alarm never blocks the timer"""
+
+        TIMER_LATENESS.observe(time.time() - event.time.timestamp())
+        if event.rule is not None:
+            self.__advance(event)
+
+        if isinstance(self.timer, AsyncioTimer):
+            self.timer.loop.create_task(self.__fire_async(event), name=event.name)
+            return
+
+        def run_function():
+            stopped = threading.Event()
+            self.running[event.name] = (event, stopped)
+            try:
+                event.func(stopped)
+            except:
+                self.log.exception("Exception inside event %s", event.name)
+            finally:
+                self.running.pop(event.name, None)
+                self.__remove_done(event)
+
+        threading.Thread(target=run_function, name=event.name, daemon=True).start()
+
+    async def __fire_async(self, event: ScheduledEvent):
+        stopped = threading.Event()
+        self.running[event.name] = (event, stopped)
+        try:
+            await event.func.run_async(stopped)
+        except:
+            self.log.exception("Exception inside event %s", event.name)
+        finally:
+            self.running.pop(event.name, None)
+            self.__remove_done(event)
+
+    def stop_running(self, type: str, names=None) -> list:
+        """Sets the stop signal of the running events of the given type (e.g. a ringing
+           alarm) of every account, or only of the named ones. Every run has its own
+           signal, so a stop never reaches another run. Returns the signalled names"""
+
+        signalled = []
+        for event, stopped in list(self.running.values()):
+            if base_type(event.func.type) != type or not event.func.stoppable:
+                continue
+            if names is None or event.name in names:
+                self.log.info("Stopping %s", event.name)
+                stopped.set()
+                signalled.append(event.name)
+        return signalled
+
+    def __remove_done(self, event: ScheduledEvent):
+        self.log.debug("done with %s, removing from list...", event.name)
+        with self.lock:
+            if self.events.remove(event):
+                self.handles.pop(event.name, None)
+                self.__changed([], [event])
 
-    def cancel_event_by_name(self, _name):
-        for event in self.events:
-            if event.name == _name:
-                self.cancel_event(event)
-                return f"Removed {_name}"
-        return f"There is no event with name {_name}"
+    def cancel_event(self, event: ScheduledEvent):
+        self.cancel_many([event.name])
+
+    def cancel_event_by_name(self, _name, keep=("Refresh",)):
+        """Cancels the named event, as asked from the web interface. The events of the
+           types in keep are refused, by default the periodic refreshes, which nothing
+           else would schedule again (see cancel_all)"""
+
+        with self.lock:
+            event = self.events.get(_name)
+            if event and base_type(event.func.type) in keep:
+                self.log.warning("Not cancelling %s, it is a periodic event", event)
+                return f"{_name} cannot be cancelled, it is scheduled again by itself"
+            return self.cancel_many([_name])[0]
+
+    def cancel_many(self, names) -> list:
+        """Cancels the events with the given names in one step. Returns a message per name"""
+
+        with self.lock:
+            msgs, removed = self.__remove_events(names)
+            self.timer.cancel_many([self.handles.pop(e.name) for e in removed])
+            self.__changed([], removed)
+        for event in removed:
+            self.log.info("Removed event: %s", event)
+        return msgs
+
+    def __remove_events(self, names) -> tuple:
+        msgs = []
+        removed = []
+        for _name in names:
+            event = self.events.get(_name)
+            if not event:
+                msgs.append(f"There is no event with name {_name}")
+            elif event.name in self.handles and not self.timer.is_pending(self.handles[event.name]):
+                self.log.warning("Event %s is already running", event)
+                msgs.append(f"{_name} is already running")
+            else:
+                self.events.remove(event)
+                removed.append(event)
+                msgs.append(f"Removed {_name}")
+        return msgs, removed
+
+    def cancel_all(self, keep=("Refresh",)):
+        """Cancels every event except the ones of the types in keep, by default the
+           periodic refreshes, which nothing else would schedule again"""
 
-    def cancel_all(self):
         self.log.info("Cancelling all events...")
-        while self.events:
-            self.cancel_event(self.events[0])
-        time.sleep(0.15)
+        with self.lock:
+            self.cancel_many([name for name, event in list(self.events.by_name.items())
+                              if base_type(event.func.type) not in keep])
+            left = [event for event in self.events.by_name.values() if base_type(event.func.type) not in keep]
 
-        if len(self.events) != 0:
+        if left:
             self.log.error("failed to cancel all events")
             self.status()
 
+    def replace(self, names, items) -> tuple:
+        """Cancels the named events and dispatches the new (time, function) pairs
+           as one transaction. Returns the messages and, for each item, the name
+           of the event that is now scheduled for it (an existing one for duplicates)"""
+
+        items = list(items)
+        with self.lock:
+            cancel_msgs, removed = self.__remove_events(names)
+            msgs, new_events = self.__add_events(items)
+            self.timer.cancel_many([self.handles.pop(e.name) for e in removed])
+            self.__schedule([e for e in new_events if e])
+            self.__changed([e for e in new_events if e], removed)
+            new_names = [e.name if e else self.events.find(_time, func.type).name
+                         for e, (_time, func) in zip(new_events, items)]
+        for event in removed:
+            self.log.info("Removed event: %s", event)
+        return cancel_msgs + msgs, new_names
+
     def status(self):
         string = "\n--STATUS--\n--Running Threads--\n"
 
@@ -140,7 +620,10 @@ class EventDispatcher:
         self.log.info(string)
 
     def get_current(self) -> list:
-        return self.events
+        """Returns the scheduled events, sorted by time"""
+
+        with self.lock:
+            return self.events.sorted()
 
     @staticmethod
     def compare_events(event1, event2):
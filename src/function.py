@@ -1,58 +1,193 @@
 import time
 import logging
-import sys
+import asyncio
+import functools
+import threading
+import datetime as dt
 
 from os import path
-from contextlib import redirect_stdout
 
-from speech import SpeechManager
+ALARM_SOUND = path.normpath(path.join(path.dirname(__file__), "../audio-files/alarm_sound.mp3"))
 
-with redirect_stdout(None):
-    from pygame import mixer
+# The audio and speech stacks (pygame, gTTS) are imported and initialized on first
+# use, so importing this module does not delay the startup of the web interface
+_lock = threading.RLock()
+_player = None
+_sm = None
+_briefing = None
+# Alarm sound and speech language by account, warmup() prepares all of them
+_accounts = {None: (ALARM_SOUND, "nl")}
 
-RPI = False
-if "--rpi" in sys.argv:
-    from RPi import GPIO
 
-    RPI = True
+def get_player():
+    """The shared audio.AudioPlayer, mixer.init is called on the first call"""
+
+    global _player
+    with _lock:
+        if _player is None:
+            from audio import AudioPlayer
+            _player = AudioPlayer()
+        return _player
+
+
+def get_sm():
+    """The shared speech.SpeechManager"""
+
+    global _sm
+    with _lock:
+        if _sm is None:
+            from speech import SpeechManager
+            _sm = SpeechManager(player=get_player())
+        return _sm
+
+
+def get_briefing():
+    """The shared briefing.Briefing"""
+
+    global _briefing
+    with _lock:
+        if _briefing is None:
+            from briefing import Briefing
+            _briefing = Briefing(get_sm())
+        return _briefing
 
-sm = SpeechManager()
 
 class EventFunction:
-    def __init__(self, fn, type: str):
+    def __init__(self, fn, type: str, afn=None, persist=True, stoppable=False):
+        """persist=False keeps the events of this function out of the dispatcher journal.
+           A stoppable function is called with the stop signal of its run, a
+           threading.Event that the dispatcher sets to stop that run (see stop_running)"""
+
         self.fn = fn
         self.type = type
+        self.afn = afn
+        self.persist = persist
+        self.stoppable = stoppable
 
-    def __call__(self):
+    def __call__(self, stopped: threading.Event = None):
         time.sleep(0.1)
-        self.fn()
-
-
-def play_alarm() -> None:
-    """Play alarm"""
-
-    mixer.init()
-    mixer.music.load(path.normpath(path.join(path.dirname(__file__), "../audio-files/alarm_sound.mp3")))
-
-    if RPI:
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setup(10, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        mixer.music.play(-1)
-        GPIO.wait_for_edge(10, GPIO.FALLING)
-        mixer.music.stop()
-    else:
-        mixer.music.play()
-        print("Type 'stop' to cut the alarm")
-        while input() != "stop":
-            pass
-        mixer.music.stop()
-
-    time.sleep(2)
-    sm.play_good_morning() #Play good morning when alarm has just stopped
-    time.sleep(2)
-    sm.play_bye()
-
-alarm_function = EventFunction(play_alarm, type='Alarm')
-good_morning_function = EventFunction(sm.play_good_morning, type="Good morning")
+        if self.stoppable:
+            self.fn(stopped or threading.Event())
+        else:
+            self.fn()
+
+    async def run_async(self, stopped: threading.Event = None):
+        """Runs the coroutine version if there is one, otherwise the blocking
+           function is moved to the default executor"""
+
+        args = (stopped or threading.Event(),) if self.stoppable else ()
+        await asyncio.sleep(0.1)
+        if self.afn:
+            await self.afn(*args)
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.fn, *args)
+
+
+def play_alarm(stopped: threading.Event, sound=ALARM_SOUND, account: str = None, language="nl") -> None:
+    """Plays the alarm until its run is stopped, then the briefing. A second stop cuts the
+       briefing. The run has a channel of its own, an alarm of another account keeps ringing"""
+
+    player = get_player()
+    channel = player.claim_channel()
+    try:
+        player.play(sound, loops=-1, channel=channel)
+        print("Press the button or type 'stop' to cut the alarm")
+        stopped.wait()
+        channel.stop()
+
+        #Play good morning when alarm has just stopped
+        stopped.clear()
+        player.play_sequence(get_briefing().sequence(dt.date.today(), account, language),
+                             stopped=stopped, channel=channel)
+    finally:
+        player.release_channel(channel)
+
+
+async def play_alarm_async(stopped: threading.Event, sound=ALARM_SOUND, account: str = None, language="nl") -> None:
+    """Play alarm, coroutine version for the asyncio mode"""
+
+    loop = asyncio.get_running_loop()
+    player = await loop.run_in_executor(None, get_player)
+    channel = await loop.run_in_executor(None, player.claim_channel)
+    try:
+        player.play(sound, loops=-1, channel=channel)
+        print("Press the button or type 'stop' to cut the alarm")
+        await loop.run_in_executor(None, stopped.wait)
+        channel.stop()
+
+        stopped.clear()
+        files = await loop.run_in_executor(None, get_briefing().sequence, dt.date.today(), account, language)
+        await player.play_sequence_async(files, stopped=stopped, channel=channel)
+    finally:
+        player.release_channel(channel)
+
+
+def play_good_morning(language="nl") -> None:
+    get_sm().play_good_morning(language)
+
+
+async def play_good_morning_async(language="nl") -> None:
+    sm = await asyncio.get_running_loop().run_in_executor(None, get_sm)
+    await sm.play_good_morning_async(language)
+
+
+def _warmup() -> None:
+    try:
+        player = get_player()
+        with _lock:
+            sounds = sorted({sound for sound, _ in _accounts.values()})
+            languages = sorted({language for _, language in _accounts.values()})
+        threading.Thread(target=player.preload, args=(sounds,), name="audio warmup", daemon=True).start()
+        for language in languages:
+            get_sm().warmup(language=language)
+    except Exception:
+        logging.getLogger("Malarm").exception("Warmup failed")
+
+
+def warmup() -> threading.Thread:
+    """Imports and initializes the audio and speech stacks, decodes the alarm sound and
+       prepares the fixed phrases in the background, so the first alarm starts right away.
+       Called after the server started, the web interface does not wait for it"""
+
+    thread = threading.Thread(target=_warmup, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+alarm_function = EventFunction(play_alarm, type='Alarm', afn=play_alarm_async, stoppable=True)
+good_morning_function = EventFunction(play_good_morning, type="Good morning", afn=play_good_morning_async)
 available_functions = {"Alarm": alarm_function,
                        "Good morning": good_morning_function}
+
+
+def account_type(type: str, account: str = None) -> str:
+    """The events of the accounts share one dispatcher, their types carry the
+       account, e.g. "Alarm@alice" """
+
+    return f"{type}@{account}" if account else type
+
+
+def base_type(type: str) -> str:
+    return type.partition("@")[0]
+
+
+def register_account(account: str = None, sound=ALARM_SOUND, language="nl") -> dict:
+    """Returns the alarm and good morning functions of an account, by base type.
+       They are added to available_functions, so the web interface can schedule
+       them and the dispatcher can restore their journaled events"""
+
+    with _lock:
+        _accounts[account] = (sound, language)
+    if account is None and (sound, language) == (ALARM_SOUND, "nl"):
+        return {"Alarm": alarm_function, "Good morning": good_morning_function}
+
+    settings = {"sound": sound, "account": account, "language": language}
+    functions = {"Alarm": EventFunction(functools.partial(play_alarm, **settings),
+                                        type=account_type("Alarm", account),
+                                        afn=functools.partial(play_alarm_async, **settings),
+                                        stoppable=True),
+                 "Good morning": EventFunction(functools.partial(play_good_morning, language),
+                                               type=account_type("Good morning", account),
+                                               afn=functools.partial(play_good_morning_async, language))}
+    available_functions.update((function.type, function) for function in functions.values())
+    return functions
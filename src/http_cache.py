@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Conditional GET support for the web apps. A response is identified by the
+   version counters of the state it shows (the dispatcher, the json documents and
+   the live feed), which make strong ETags without hashing the body. The rendered
+   body is kept per response and only rebuilt when one of its versions changed"""
+
+import time
+import threading
+
+from os import path
+
+from metrics import REGISTRY
+
+# Static files are requested with ?v=<mtime>, so they can be cached "forever"
+STATIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+UNVERSIONED_CACHE_CONTROL = "public, max-age=3600"
+# The client may keep the response, but has to revalidate it on every use
+REVALIDATE = "no-cache"
+
+
+# The version counters start over with the process, the boot time keeps the
+# etags of different runs apart. Web workers take both from the owner (wsgi.py)
+BOOT = format(time.time_ns(), "x")
+
+
+def make_etag(name: str, version: tuple) -> str:
+    return '"' + "-".join([name, *map(str, version)]) + '"'
+
+
+def page_version(feed, dispatcher, json_helper) -> tuple:
+    """Version of everything the page shows. The feed seq changes with every
+       event and status change, config.json holds the last update"""
+
+    return BOOT, feed.seq, dispatcher.version, json_helper.version("config.json")
+
+
+def document_version(json_helper, name: str) -> tuple:
+    return BOOT, json_helper.version(name)
+
+
+def not_modified(if_none_match: str, etag: str) -> bool:
+    """Whether the If-None-Match header matches the etag (weak comparison, RFC 9110)"""
+
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def static_version(file_path: str) -> str:
+    try:
+        return str(int(path.getmtime(file_path)))
+    except OSError:
+        return ""
+
+
+class RenderCache:
+    """The last rendering of every response, with the version it was rendered for"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        REGISTRY.callback("malarm_render_cache_hits_total", "Responses served from the render cache",
+                          lambda: self.hits, "counter")
+        REGISTRY.callback("malarm_render_cache_misses_total", "Responses that had to be rendered",
+                          lambda: self.misses, "counter")
+
+    def get(self, name: str, version: tuple, render) -> tuple:
+        """Returns (etag, body), render() is only called when the version changed"""
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry and entry[0] == version:
+                self.hits += 1
+                return entry[1], entry[2]
+        # Rendered outside the lock, two requests may both render a new version
+        body = render()
+        etag = make_etag(name, version)
+        with self.lock:
+            self.misses += 1
+            self.entries[name] = (version, etag, body)
+        return etag, body
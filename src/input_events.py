@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import sys
+import logging
+import threading
+
+from event_dispatcher import EventDispatcher
+
+
+class FakeGPIO:
+    """Stand-in for RPi.GPIO on a machine without pins. press() triggers the
+       edge callbacks like a push button would"""
+
+    BOARD = "BOARD"
+    IN = "IN"
+    PUD_DOWN = "PUD_DOWN"
+    RISING = "RISING"
+    FALLING = "FALLING"
+    BOTH = "BOTH"
+
+    def __init__(self):
+        self.mode = None
+        self.pins = {}
+        self.callbacks = {}
+
+    def setmode(self, mode) -> None:
+        self.mode = mode
+
+    def setup(self, channel: int, direction, pull_up_down=None) -> None:
+        self.pins[channel] = (direction, pull_up_down)
+
+    def add_event_detect(self, channel: int, edge, callback=None, bouncetime=None) -> None:
+        if channel not in self.pins:
+            raise RuntimeError(f"Channel {channel} is not set up")
+        self.callbacks[channel] = (edge, callback)
+
+    def remove_event_detect(self, channel: int) -> None:
+        self.callbacks.pop(channel, None)
+
+    def cleanup(self) -> None:
+        self.pins.clear()
+        self.callbacks.clear()
+
+    def press(self, channel: int) -> None:
+        edge, callback = self.callbacks[channel]
+        if callback and edge in (self.FALLING, self.BOTH):
+            callback(channel)
+
+
+def get_gpio():
+    """RPi.GPIO when the program runs with --rpi, a FakeGPIO otherwise"""
+
+    if "--rpi" in sys.argv:
+        from RPi import GPIO
+        return GPIO
+    return FakeGPIO()
+
+
+class InputEvents:
+    """Turns the stop inputs (push button, "stop" typed on stdin and POST /stop)
+       into stop signals for the ringing alarm. Started once, the inputs are watched
+       with an edge callback and a single reader thread instead of per alarm"""
+
+    def __init__(self, dispatcher: EventDispatcher, gpio=None, pin=10, console=True,
+                 stop_word="stop", bouncetime=300):
+        self.dispatcher = dispatcher
+        self.gpio = gpio if gpio is not None else get_gpio()
+        self.pin = pin
+        self.console = console
+        self.stop_word = stop_word
+        self.bouncetime = bouncetime
+        self.started = False
+        self.log = logging.getLogger("Malarm")
+
+    def start(self) -> None:
+        if self.started:
+            return
+        self.started = True
+
+        self.gpio.setmode(self.gpio.BOARD)
+        self.gpio.setup(self.pin, self.gpio.IN, pull_up_down=self.gpio.PUD_DOWN)
+        self.gpio.add_event_detect(self.pin, self.gpio.FALLING,
+                                   callback=lambda _: self.stop_alarm("button"), bouncetime=self.bouncetime)
+
+        if self.console and sys.stdin is not None:
+            threading.Thread(target=self.__read_console, name="console input", daemon=True).start()
+
+    def __read_console(self) -> None:
+        for line in sys.stdin:
+            if line.strip() == self.stop_word:
+                self.stop_alarm("console")
+
+    def stop_alarm(self, source: str) -> list:
+        """Stops the ringing alarm(s), returns the names of the stopped events"""
+
+        stopped = self.dispatcher.stop_running("Alarm")
+        if not stopped:
+            self.log.info("Stop from %s, but no alarm is ringing", source)
+        return stopped
+
+    def close(self) -> None:
+        if self.started:
+            self.gpio.remove_event_detect(self.pin)
+            self.gpio.cleanup()
+            self.started = False
+
+
+if __name__ == "__main__":
+    import time
+    import datetime as dt
+
+    from function import alarm_function
+
+    gpio = FakeGPIO()
+    dispatcher = EventDispatcher()
+    inputs = InputEvents(dispatcher, gpio=gpio)
+    inputs.start()
+    dispatcher.dispatch(dt.datetime.now() + dt.timedelta(seconds=2), alarm_function)
+    time.sleep(5)
+    gpio.press(inputs.pin)
+    time.sleep(10)
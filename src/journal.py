@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import threading
+import datetime as dt
+
+from os import path
+
+
+class AlarmJournal:
+    """Append-only journal of the dispatch and cancel operations of an EventDispatcher,
+       compacted into a snapshot every now and then. Replaying the snapshot and the
+       journal rebuilds the scheduled events after a restart"""
+
+    def __init__(self, journal_dir="../journal", sync_delay=0.2, compact_every=1000):
+        self.folder_path = path.normpath(path.join(path.dirname(__file__), journal_dir))
+        self.journal_path = path.join(self.folder_path, "journal.jsonl")
+        self.snapshot_path = path.join(self.folder_path, "snapshot.json")
+        self.sync_delay = sync_delay
+        self.compact_every = compact_every
+
+        if not path.exists(self.folder_path):
+            os.mkdir(self.folder_path)
+
+        self.lock = threading.Lock()
+        self.records_since_snapshot = 0
+        self.sync_timer = None
+        self.file = open(self.journal_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def event_record(event) -> dict:
+        record = {"name": event.name,
+                  "time": event.time.isoformat(),
+                  "type": event.func.type,
+                  "seq": event.seq}
+        if event.rule is not None:
+            record["rule"] = event.rule.to_json()
+            record["occurrence"] = event.occurrence
+        return record
+
+    def record_dispatch(self, events: list) -> None:
+        self.append([{"op": "dispatch", **self.event_record(e)} for e in events])
+
+    def record_cancel(self, names: list) -> None:
+        self.append([{"op": "cancel", "name": name} for name in names])
+
+    def append(self, records: list) -> None:
+        """Writes the records as one batch. The fsync is deferred by sync_delay,
+           so a burst of operations shares a single fsync"""
+
+        if not records:
+            return
+        data = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records)
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+            self.records_since_snapshot += len(records)
+            if self.sync_timer is None:
+                self.sync_timer = threading.Timer(self.sync_delay, self.sync)
+                self.sync_timer.daemon = True
+                self.sync_timer.start()
+
+    def sync(self) -> None:
+        with self.lock:
+            if self.sync_timer is not None:
+                self.sync_timer.cancel()
+                self.sync_timer = None
+            if not self.file.closed:
+                os.fsync(self.file.fileno())
+
+    def needs_compaction(self) -> bool:
+        return self.records_since_snapshot >= self.compact_every
+
+    def compact(self, events: list, event_counter: int) -> None:
+        """Writes the current events to a new snapshot and empties the journal"""
+
+        snapshot = {"event_counter": event_counter,
+                    "events": [self.event_record(e) for e in events if e.func.persist]}
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as tmp:
+            tmp.write(json.dumps(snapshot, separators=(",", ":")))
+            tmp.flush()
+            os.fsync(tmp.fileno())
+
+        with self.lock:
+            os.replace(tmp_path, self.snapshot_path)
+            self.file.close()
+            self.file = open(self.journal_path, "w", encoding="utf-8")
+            os.fsync(self.file.fileno())
+            self.records_since_snapshot = 0
+
+    def load(self, now: dt.datetime = None) -> tuple:
+        """Replays the snapshot and the journal. Returns the event counter and a list
+           of (name, time, type, seq, rule, occurrence) tuples, without the events that
+           are in the past. rule is the json of the RecurrenceRule of a recurring event
+           (which is returned even when its occurrence is in the past), otherwise None"""
+
+        now = now or dt.datetime.now()
+        events = {}
+        event_counter = 0
+
+        if path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            event_counter = snapshot["event_counter"]
+            for record in snapshot["events"]:
+                events[record["name"]] = record
+
+        with open(self.journal_path, "r", encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn write at the end of the journal, from a crash mid-append
+                    break
+                if record["op"] == "dispatch":
+                    events[record["name"]] = record
+                    event_counter = max(event_counter, record["seq"])
+                elif record["op"] == "cancel":
+                    events.pop(record["name"], None)
+
+        restored = []
+        for record in events.values():
+            _time = dt.datetime.fromisoformat(record["time"])
+            if _time > now or "rule" in record:
+                restored.append((record["name"], _time, record["type"], record["seq"],
+                                 record.get("rule"), record.get("occurrence", 0)))
+        return event_counter, restored
+
+    def close(self) -> None:
+        self.sync()
+        with self.lock:
+            self.file.close()
@@ -1,65 +1,227 @@
 #!/usr/bin/env python3
 
+import os
+import re
+import sys
 import json
+import time
+import shutil
+import atexit
+import threading
 import datetime as dt
 
 from os import path
 
+from models import schedule_to_json, schedule_from_json
+from metrics import JSON_IO
+
+READ_TIME = JSON_IO.child("read")
+WRITE_TIME = JSON_IO.child("write")
+
+# The json files of an account live in accounts/<name>/ of the json dir
+ACCOUNTS_DIR = "accounts"
+ACCOUNT_NAME = re.compile(r"[A-Za-z0-9_-]+")
+
 
 class JsonHelper:
-    def __init__(self, json_dir="../"):
-        self.path = json_dir
+    """Reads and writes the json files. Parsed documents are cached in memory until
+       the file changes on disk, and writes are coalesced and flushed atomically.
+       The returned documents are shared with the cache, treat them as read-only.
+       With an account, the files of that account are used (see accounts.py)"""
+
+    def __init__(self, json_dir="../", flush_delay=0.5, account: str = None):
+        if account is not None and not ACCOUNT_NAME.fullmatch(account):
+            raise ValueError(f"Invalid account name {account!r}, use letters, digits, - and _")
+        self.path = json_dir if account is None else path.join(json_dir, ACCOUNTS_DIR, account)
+        self.account = account
+        self.flush_delay = flush_delay
+        self.cache = {}
+        self.schedules = {}
+        # Bumped whenever a document is read from disk or written, see version()
+        self.versions = {}
+        self.pending = {}
+        self.lock = threading.RLock()
+        self.flush_timer = None
+        self.hits = 0
+        self.misses = 0
+        atexit.register(self.flush)
 
     def get_absolute_path(self, relative_path: str) -> str:
         return path.normpath(path.join(path.dirname(__file__), self.path, relative_path))
 
-    def initialize(self):
-        for f in ["config.json", "out.json", "credentials.json", "prev_out.json"]:
+    def initialize(self, interactive: bool = None,
+                   files=("config.json", "out.json", "credentials.json", "prev_out.json")):
+        """Creates the missing json files. The credentials are only asked for when
+           interactive, by default when stdin is a terminal, so a service or a server
+           start without a terminal never blocks on input()"""
+
+        if interactive is None:
+            interactive = sys.stdin is not None and sys.stdin.isatty()
+        os.makedirs(self.get_absolute_path(""), exist_ok=True)
+        for f in files:
             abs_path = self.get_absolute_path(f)
             if not path.exists(abs_path):
+                if f == "credentials.json":
+                    # Asked before the file is created, so an interrupted prompt leaves no empty file
+                    username = password = ""
+                    if interactive:
+                        if self.account:
+                            print(f"Magister account of {self.account}")
+                        username = input("Magister username: ") or ""
+                        password = input("Magister password: ") or ""
                 with open(abs_path, "w+", encoding="utf-8") as fhandler:
                     # self.log.debug("Created file: %s", f)
                     print(f"Created file: {f}")
                     if f == "credentials.json":
-                        username = input("Magister username: ") or ""
-                        password = input("Magister password: ") or ""
                         json.dump({"username": username,  "password": password}, fhandler, indent=4)
                     if f in ("out.json", "prev_out.json"):
                         fhandler.write("{}")
 
                     if f == "config.json":
                         json.dump({"last_update": dt.datetime(year=1, month=1, day=1).isoformat()}, fhandler)
-        if not self.get_credentials()["username"] or not self.get_credentials()["password"]:
+        if "credentials.json" not in files:
+            return
+        creds = self.get_credentials()
+        if not creds["username"] or not creds["password"]:
             print("--- Credentials not complete ---")
 
+    def load(self, relative_path: str):
+        """Returns the parsed document, only reading the file when its
+           mtime, inode or size changed since the last read"""
 
-    def get_out(self) -> dict:
-        with open(self.get_absolute_path("out.json"), "r", encoding="utf-8") as out:
-            data = json.load(out)
+        with self.lock:
+            data, hit = self.__load(relative_path)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
             return data
 
+    def __load(self, relative_path: str) -> tuple:
+        """Returns the document and whether it came from memory, without counting the
+           hit or miss, so version() does not skew stats()"""
+
+        if relative_path in self.pending:
+            return self.pending[relative_path][0], True
+
+        abs_path = self.get_absolute_path(relative_path)
+        stat = os.stat(abs_path)
+        key = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        cached = self.cache.get(relative_path)
+        if cached and cached[0] == key:
+            return cached[1], True
+
+        started = time.perf_counter()
+        with open(abs_path, "r", encoding="utf-8") as fhandler:
+            data = json.load(fhandler)
+        READ_TIME.observe(time.perf_counter() - started)
+        self.cache[relative_path] = (key, data)
+        self.versions[relative_path] = self.versions.get(relative_path, 0) + 1
+        return data, False
+
+    def dump(self, relative_path: str, data, **kwargs) -> None:
+        """Write-behind: the document is cached right away and written to disk
+           after flush_delay, so repeated writes to a file are coalesced"""
+
+        with self.lock:
+            self.pending[relative_path] = (data, kwargs)
+            self.versions[relative_path] = self.versions.get(relative_path, 0) + 1
+            if self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_delay, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def flush(self) -> None:
+        """Writes the pending documents, each to a temp file that is renamed over the original"""
+
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            pending, self.pending = self.pending, {}
+
+            for relative_path, (data, kwargs) in pending.items():
+                started = time.perf_counter()
+                abs_path = self.get_absolute_path(relative_path)
+                tmp_path = path.join(path.dirname(abs_path), "." + path.basename(abs_path) + ".tmp")
+                with open(tmp_path, "w", encoding="utf-8") as tmp:
+                    json.dump(data, tmp, **kwargs)
+                    tmp.flush()
+                    os.fsync(tmp.fileno())
+                os.replace(tmp_path, abs_path)
+                WRITE_TIME.observe(time.perf_counter() - started)
+
+                stat = os.stat(abs_path)
+                self.cache[relative_path] = ((stat.st_mtime_ns, stat.st_ino, stat.st_size), data)
+
+    def version(self, relative_path: str) -> int:
+        """A counter that changes with the document, also when the file is changed
+           on disk. Costs a stat of the file, not a read"""
+
+        with self.lock:
+            self.__load(relative_path)
+            return self.versions.get(relative_path, 0)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0}
+
+    def get_out(self) -> dict:
+        return self.load("out.json")
+
+    def get_prev_out(self) -> dict:
+        return self.load("prev_out.json")
+
+    def load_schedule(self, relative_path: str) -> tuple:
+        """Returns the Days of the file. They are parsed once per version of the
+           document, so all consumers share the same (immutable) instances"""
+
+        with self.lock:
+            data = self.load(relative_path)
+            cached = self.schedules.get(relative_path)
+            if cached and cached[0] is data:
+                return cached[1]
+            days = schedule_from_json(data)
+            self.schedules[relative_path] = (data, days)
+            return days
+
+    def get_schedule(self) -> tuple:
+        return self.load_schedule("out.json")
+
+    def get_prev_schedule(self) -> tuple:
+        return self.load_schedule("prev_out.json")
+
+    def get_config(self) -> dict:
+        return self.load("config.json")
+
     def get_last_update(self) -> dt.datetime:
-        with open(self.get_absolute_path("config.json"), "r", encoding="utf-8") as config:
-            data = json.load(config)
-            return dt.datetime.fromisoformat(data["last_update"])
+        return dt.datetime.fromisoformat(self.load("config.json")["last_update"])
 
     def get_credentials(self) -> dict:
-        with open(self.get_absolute_path("credentials.json"), "r", encoding="utf-8") as creds:
-            data = json.load(creds)
-            if "username" not in data:
-                print("Username not found!")
-            if "password" not in data:
-                print("Password not found!")
+        data = self.load("credentials.json")
+        if "username" not in data:
+            print("Username not found!")
+        if "password" not in data:
+            print("Password not found!")
         return data
 
-    def write_out(self, data: list) -> None:
-        with open(self.get_absolute_path("out.json"), "w", encoding="utf-8") as out:
-            json.dump(data, out, sort_keys=True, indent=4)
+    def write_out(self, days) -> None:
+        data = schedule_to_json(days)
+        with self.lock:
+            self.dump("out.json", data, sort_keys=True, indent=4)
+            self.schedules["out.json"] = (data, tuple(days))
 
     def last_update_data(self, last_update: dt.datetime) -> None:
-        with open(self.get_absolute_path("config.json"), "w", encoding="utf-8") as config:
-            json.dump({"last_update": last_update.isoformat()}, config, sort_keys=True, indent=True)
+        # Keep the other settings (e.g. the timetables)
+        config = {**self.get_config(), "last_update": last_update.isoformat()}
+        self.dump("config.json", config, sort_keys=True, indent=True)
 
     def update_previous(self) -> None:
-        with open(self.get_absolute_path("prev_out.json"), "w+", encoding="utf-8") as prev_out:
-            json.dump(self.get_out(), prev_out, indent=4)
+        """Copies out.json to prev_out.json, without parsing it"""
+
+        with self.lock:
+            self.flush()
+            shutil.copyfile(self.get_absolute_path("out.json"), self.get_absolute_path("prev_out.json"))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Change feed of the web interface. The dispatcher and Malarm publish their changes
+   as deltas with a sequence number, and clients follow them with server-sent events
+   (GET /api/stream) or long polling (GET /api/changes?since=seq) instead of reloading
+   the page. Every change costs one delta, however many events are scheduled"""
+
+import json
+import asyncio
+import threading
+
+from collections import deque
+
+_FORMAT = "%H:%M (%d-%m-%Y)"
+NEVER = "Never"
+
+
+def event_json(event) -> dict:
+    return {"name": event.name,
+            "time": event.time.isoformat(timespec="minutes"),
+            "display": event.time.strftime(_FORMAT),
+            "type": event.func.type,
+            "rule": str(event.rule) if event.rule else ""}
+
+
+def last_update_str(last_update) -> str:
+    if last_update.year == 1:
+        return NEVER
+    return last_update.strftime(_FORMAT)
+
+
+class LiveFeed:
+    """Bounded backlog of deltas. A client that reconnects with the last seq it saw
+       only receives what it missed, one that fell out of the backlog has to reload
+       the state (since() returns None). Applying a delta twice changes nothing,
+       so the state can be read after taking the seq"""
+
+    def __init__(self, backlog=256):
+        self.seq = 0
+        self.deltas = deque(maxlen=backlog)
+        self.cond = threading.Condition()
+        self.waiters = []
+
+    def publish(self, type: str, data: dict) -> int:
+        with self.cond:
+            self.seq += 1
+            self.deltas.append({"seq": self.seq, "type": type, "data": data})
+            self.cond.notify_all()
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        return self.seq
+
+    def since(self, seq: int) -> list:
+        """Returns the deltas after seq, or None if some of them are no longer kept"""
+
+        with self.cond:
+            if seq > self.seq:
+                # A seq of an earlier run of the server
+                return None
+            if seq == self.seq:
+                return []
+            if not self.deltas or self.deltas[0]["seq"] > seq + 1:
+                return None
+            # The seqs in the backlog are consecutive
+            return list(self.deltas)[seq + 1 - self.deltas[0]["seq"]:]
+
+    def wait(self, seq: int, timeout: float) -> list:
+        """Like since, but waits up to timeout seconds for a delta after seq"""
+
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != seq, timeout)
+        return self.since(seq)
+
+    async def wait_async(self, seq: int, timeout: float) -> list:
+        """Coroutine version of wait, it does not take a thread while waiting"""
+
+        with self.cond:
+            if self.seq != seq:
+                return self.since(seq)
+            waiter = (asyncio.get_running_loop(), asyncio.get_running_loop().create_future())
+            self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.cond:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        return self.since(seq)
+
+    def attach(self, dispatcher, malarm) -> None:
+        """Publishes the event changes of the dispatcher and the status changes of malarm"""
+
+        dispatcher.add_change_listener(
+            lambda added, removed: self.publish("events", {"added": [event_json(e) for e in added],
+                                                           "removed": [e.name for e in removed]}))
+        malarm.add_status_listener(
+            lambda status, phase: self.publish("status", self.status_json(malarm, status, phase)))
+
+    @staticmethod
+    def status_json(malarm, status=None, phase=None) -> dict:
+        if status is None:
+            status, phase = malarm.get_status(), malarm.phase
+        return {"status": status.name,
+                "phase": phase,
+                "last_update": last_update_str(malarm.get_last_update())}
+
+    def state(self, dispatcher, malarm) -> dict:
+        """The full state, for a client that starts following the feed at its seq"""
+
+        seq = self.seq
+        state = {"seq": seq, "events": [event_json(e) for e in dispatcher.get_current()]}
+        state.update(self.status_json(malarm))
+        return state
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def sse_message(delta: dict) -> str:
+    return f"id: {delta['seq']}\nevent: {delta['type']}\ndata: {json.dumps(delta['data'])}\n\n"
+
+
+def sse_stream(feed: LiveFeed, seq: int, keepalive=15):
+    """Server-sent events from seq on. A reset event tells the client to reload
+       the state, the comment lines keep idle connections open"""
+
+    yield "retry: 3000\n\n"
+    while True:
+        deltas = feed.wait(seq, keepalive)
+        seq, messages = _sse_messages(feed, seq, deltas)
+        yield messages
+
+
+async def sse_stream_async(feed: LiveFeed, seq: int, keepalive=15):
+    """Async generator version of sse_stream"""
+
+    yield "retry: 3000\n\n"
+    while True:
+        deltas = await feed.wait_async(seq, keepalive)
+        seq, messages = _sse_messages(feed, seq, deltas)
+        yield messages
+
+
+def _sse_messages(feed: LiveFeed, seq: int, deltas: list) -> tuple:
+    """Returns the new seq and the messages for the deltas after seq"""
+
+    if deltas is None:
+        return feed.seq, f"id: {feed.seq}\nevent: reset\ndata: {{}}\n\n"
+    if not deltas:
+        return seq, ": keepalive\n\n"
+    return deltas[-1]["seq"], "".join(sse_message(delta) for delta in deltas)
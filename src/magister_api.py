@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import threading
+import http.client
+import datetime as dt
+
+from urllib.parse import urlsplit, urlencode
+
+
+class ApiError(Exception):
+    """Raised when the Magister api returns an unexpected response"""
+
+
+class MagisterApiClient:
+    """Fetches the agenda as json from the Magister api over one kept-alive connection,
+       using the access token of an authenticated session"""
+
+    # Appointment statuses for lessons that do not take place
+    CANCELLED_STATUSES = (4, 5)
+    WEEKDAYS = ("maandag", "dinsdag", "woensdag", "donderdag", "vrijdag", "zaterdag", "zondag")
+    MONTHS = ("januari", "februari", "maart", "april", "mei", "juni", "juli",
+              "augustus", "september", "oktober", "november", "december")
+
+    def __init__(self, token_provider, base_url="https://esprit.magister.net", days_ahead=7, timeout=15):
+        """token_provider is called without arguments and returns a fresh access token,
+           e.g. a BrowserSession.get_access_token wrapper"""
+
+        self.token_provider = token_provider
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.days_ahead = days_ahead
+        self.timeout = timeout
+        self.token = None
+        self.person_id = None
+        self.connection = None
+        self.lock = threading.Lock()
+        self.log = logging.getLogger("Malarm")
+
+    def __connect(self) -> http.client.HTTPConnection:
+        if self.connection is None:
+            if self.scheme == "https":
+                self.connection = http.client.HTTPSConnection(self.host, timeout=self.timeout)
+            else:
+                self.connection = http.client.HTTPConnection(self.host, timeout=self.timeout)
+        return self.connection
+
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def get(self, path: str, params: dict = None):
+        """GET request on the kept-alive connection. Reconnects once when the server
+           closed it, and fetches a new token once when the current one is rejected"""
+
+        if params:
+            path += "?" + urlencode(params)
+        with self.lock:
+            if self.token is None:
+                self.token = self.token_provider()
+            for attempt in range(2):
+                try:
+                    connection = self.__connect()
+                    connection.request("GET", path, headers={"Authorization": f"Bearer {self.token}",
+                                                             "Accept": "application/json"})
+                    response = connection.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError):
+                    if self.connection is not None:
+                        self.connection.close()
+                        self.connection = None
+                    if attempt:
+                        raise
+                    continue
+
+                if response.status == 401 and not attempt:
+                    self.log.info("Access token rejected, fetching a new one")
+                    self.token = self.token_provider()
+                    continue
+                if response.status != 200:
+                    raise ApiError(f"GET {path} returned {response.status}")
+                return json.loads(body)
+
+    def get_person_id(self) -> int:
+        if self.person_id is None:
+            self.person_id = self.get("/api/account")["Persoon"]["Id"]
+        return self.person_id
+
+    def get_appointments(self, start: dt.date, end: dt.date) -> list:
+        return self.get(f"/api/personen/{self.get_person_id()}/afspraken",
+                        {"van": start.isoformat(), "tot": end.isoformat()})["Items"]
+
+    def fetch_rows(self, today: dt.date = None) -> list:
+        """Returns the agenda in the (kind, text) row format of agenda_parser,
+           so Malarm.rows_to_data turns it into the same out.json data"""
+
+        today = today or dt.date.today()
+        items = self.get_appointments(today, today + dt.timedelta(days=self.days_ahead))
+        return self.appointments_to_rows(items)
+
+    @classmethod
+    def appointments_to_rows(cls, items: list) -> list:
+        days = {}
+        for item in items:
+            start = cls.parse_time(item["Start"])
+            days.setdefault(start.date(), []).append((start, item))
+
+        rows = []
+        for date in sorted(days):
+            rows.append(("day", f"{cls.WEEKDAYS[date.weekday()]} {date.day} {cls.MONTHS[date.month - 1]}"))
+            lessons = []
+            for start, item in sorted(days[date], key=lambda entry: entry[0]):
+                text = " ".join(filter(None, (item.get("Omschrijving"), item.get("Inhoud"))))
+                if item.get("LesuurVan") is None:
+                    # Whole day items carry the schedule exceptions
+                    rows.append(("other", text))
+                elif item.get("Status") not in cls.CANCELLED_STATUSES:
+                    lessons.append(("hour", f"{item['LesuurVan']} {item.get('Omschrijving') or ''}"))
+            rows.extend(lessons)
+        return rows
+
+    @staticmethod
+    def parse_time(value: str) -> dt.datetime:
+        """Converts the api's UTC timestamps (with 7 digit fractions) to naive local time"""
+
+        value = value.rstrip("Z")
+        if "." in value:
+            value, fraction = value.split(".", 1)
+            value += "." + fraction[:6].ljust(6, "0")
+        return dt.datetime.fromisoformat(value).replace(tzinfo=dt.timezone.utc).astimezone().replace(tzinfo=None)
@@ -4,6 +4,7 @@
 
 # Standard imports
 import time
+import asyncio
 import logging
 import threading
 import datetime as dt
@@ -11,21 +12,21 @@ import datetime as dt
 from os import path, mkdir
 from enum import Enum
 
-# Selenium imports
-from selenium import webdriver
-# from selenium.common.exceptions import NoSuchElementException
-import selenium.webdriver.remote.remote_connection
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.action_chains import ActionChains
-
-# Third-party-imports
-from bs4 import BeautifulSoup
-
 # Custom imports
 # from speech import SpeechManager
 from event_dispatcher import EventDispatcher
-from function import alarm_function
+from function import register_account
+from briefing import day_fragments
+from timetable import load_timetables, infer_date
+from models import Day, Lesson, ScheduleException, shared_lesson
 from json_helper import JsonHelper
+from magister_api import MagisterApiClient
+import agenda_parser
+from metrics import SCRAPE_PHASES
+
+PARSE_TIME = SCRAPE_PHASES.child("parse")
+API_TIME = SCRAPE_PHASES.child("api")
+QUEUED_TIME = SCRAPE_PHASES.child("queued")
 
 
 class MalarmStatus(Enum):
@@ -36,22 +37,57 @@ class MalarmStatus(Enum):
 class Malarm:
     """Main Magister alarm class"""
 
-    def __init__(self, times: tuple, audio_path: str, pin: int) -> None:
-        """Initialize the instance variables and print a startup message"""
+    def __init__(self, times: tuple, audio_path: str, pin: int, json_helper: JsonHelper = None,
+                 parser="bs4", browser=None, fetch="selenium", account: str = None,
+                 scrape_slots: threading.Semaphore = None, keep_browser=True) -> None:
+        """Initialize the instance variables and print a startup message.
+           fetch is "selenium" to scrape the rendered agenda, or "api" to use
+           the Magister api with selenium as the fallback. Without a
+           browser_session.BrowserSession, selenium is imported on the first scrape.
+           account, scrape_slots and keep_browser are set by accounts.Accounts: the
+           scrapes wait for a slot, and the browser is closed after each of them.
+           The "travel_time" and "prep_time" (seconds), "alarm_sound" and "language"
+           in config.json override times, audio_path and the speech language"""
 
         self.RUNNING = False
         self.pin = pin
-        self.audio_path = audio_path
-        self.TRAVEL_T, self.PREP_T, self.PRIME_T = [dt.timedelta(seconds=i) for i in times]
-        self.driver = None
+        self.account = account
+        self.scrape_slots = scrape_slots
+        self.keep_browser = keep_browser
+        self.__browser = browser
+        if browser is not None:
+            browser.phase_listener = self.set_phase
+        self.api_client = None
+        if fetch == "api":
+            self.api_client = MagisterApiClient(
+                lambda: self.browser.get_access_token(self.json_helper.get_credentials()),
+                **({"base_url": browser.base_url} if browser else {}))
         self.status = MalarmStatus.Running
+        # Phase of the running scrape, one of the SCRAPE_PHASES labels
+        self.phase = None
+        self.status_listeners = []
+        self.parser = parser
 
         self.__init_logger()
 
         # self.speech_manager = SpeechManager(cache_folder="speech_cache")
-        self.json_helper = JsonHelper(json_dir="../")
+        self.json_helper = json_helper or JsonHelper(json_dir="../", account=account)
         self.json_helper.initialize()
-        self.upcoming_school_alarms = []
+        config = self.json_helper.get_config()
+        self.timetables = load_timetables(config)
+        times = (config.get("travel_time", times[0]), config.get("prep_time", times[1]), *times[2:])
+        self.TRAVEL_T, self.PREP_T, self.PRIME_T = [dt.timedelta(seconds=i) for i in times]
+        # audio_path is relative to src/, the alarm_sound of config.json to the project folder
+        if "alarm_sound" in config:
+            audio_path = path.join("..", config["alarm_sound"])
+        self.audio_path = path.normpath(path.join(path.dirname(__file__), audio_path))
+        self.language = config.get("language", "nl")
+        self.functions = register_account(account, self.audio_path, self.language)
+        self.school_alarms = {}
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+        self.refresh_task = None
+        self.refresh_listeners = []
 
     def __init_logger(self) -> None:
         """Initialize logger variables"""
@@ -59,7 +95,12 @@ class Malarm:
         self.log = logging.getLogger("Malarm")
         self.log.setLevel(logging.DEBUG)
 
-        selenium.webdriver.remote.remote_connection.LOGGER.setLevel(logging.CRITICAL)
+        # Set by name, so selenium does not have to be imported for it
+        logging.getLogger("selenium.webdriver.remote.remote_connection").setLevel(logging.CRITICAL)
+
+        if self.log.handlers:
+            # Set up by the Malarm of another account
+            return
 
         m_format = "(%(levelname)s) [%(name)s] %(asctime)s: %(message)s"
         m_main_formatter = logging.Formatter(m_format)
@@ -82,6 +123,14 @@ class Malarm:
         self.log.addHandler(m_file_handler)
         self.log.debug("Succesfully initialized logger")
 
+    @property
+    def browser(self):
+        if self.__browser is None:
+            from browser_session import BrowserSession
+            self.__browser = BrowserSession()
+            self.__browser.phase_listener = self.set_phase
+        return self.__browser
+
     def get_html(self) -> str:
         """Uses the selenium browser simulator to log in to Magister
            and returns the html source of the page with all the relevant data"""
@@ -93,60 +142,18 @@ class Malarm:
             self.log.critical("Credentials not complete")
             return ""
 
-        try:
-            m_opt = webdriver.ChromeOptions()
-            m_opt.add_argument("--window-position=0,0")
-            m_opt.add_argument("--window-size=1080,1080")
-            self.driver = webdriver.Chrome(options=m_opt)
+        from browser_session import LoginError
 
+        try:
             self.log.info("Starting webscrape")
-            self.driver.get("https://esprit.magister.net")
-            self.await_page_load()
-            time.sleep(2)
-
-            actions = ActionChains(self.driver)
-            actions.send_keys(creds["username"])
-            actions.perform()
-            time.sleep(2)
-
-            username_submit = self.driver.find_element(By.ID, "username_submit")
-            username_submit.click()
-            self.await_page_load()
-
-            if "microsoft" not in self.driver.current_url:
-                self.log.critical("Failed to login (microsoft not in url)")
-                return ""
-
-            time.sleep(2)
-            actions.send_keys(creds["password"])
-            actions.perform()
-            time.sleep(2)
-
-            pw_submit = self.driver.find_element(By.ID, "idSIButton9")
-            pw_submit.click()
-            self.await_page_load()
-            actions.send_keys(u"\ue007")
-            actions.perform()
-            time.sleep(2)
-
-            self.driver.get("https://esprit.magister.net/magister/#/agenda")
-
-            if "agenda" not in self.driver.current_url:
-                self.log.critical("Failed to login (agenda not in url)")
-                return ""
-
-            self.await_page_load()
-            self.log.info("Succesfull login")
-            time.sleep(3)
-            html = self.driver.page_source
-
+            html = self.browser.fetch_agenda_html(creds)
             self.log.debug("Html fetch completed succesfully")
             return html
+        except LoginError as e:
+            self.log.critical("Failed to login (%s)", e)
         except:
             self.log.exception("Failed to fetch html")
-
-        finally:
-            self.driver.quit()
+        return ""
 
     def process_html(self, html) -> None:
         """Takes in the html of the page and parses the relevant information,
@@ -154,192 +161,324 @@ class Malarm:
 
         self.log.info("Starting the processing of the html")
 
-        self.json_helper.update_previous()
-        time_at_start = time.time() * 1000
-        soup = BeautifulSoup(html, "html.parser")
-        rows = soup.find(class_="k-grid-content").tbody.find_all("tr")
-
-        data = []
-        day_counter = -1
-
-        for entry in rows:
-            if entry.has_attr("role") and entry["role"] == "row":
-                day_counter += 1
-                date = self.text_to_date(entry.text.strip())
-
-                data.append(
-                    {"date":
-                         {"day": date[0], "mon": date[1]},
-                     "sched_exception": 0,
-                     "hours": []})
-            elif entry.find(attrs={"ng-bind": "dataItem.lesuur"}):
-                hour_data = entry.find_all("td")[2]
-                if hour_data:
-                    lesson = hour_data.text.strip()[1:].strip().replace("\n", " ")
-                    hour_number = int(hour_data.text.strip()[0])
-                    timeslot = self.find_timeslot(hour_number, short=False)
-
-                    if data[day_counter]["sched_exception"] == 1:
-                        timeslot = self.find_timeslot(hour_number, short=True)
-
-                    hour_data = {"number": hour_number,
-                                 "lesson": lesson,
-                                 "timeslot": timeslot}
-                    data[day_counter]["hours"].append(hour_data)
-
-            else:
-                verkort_rooster = ("verkort rooster" in entry.text.lower())
-                min_rooster = ("40 minuten rooster" in entry.text.lower())
-                no_min_rooster = ("geen 40 minuten rooster" not in entry.text.lower())
-
-                if (verkort_rooster or min_rooster) and no_min_rooster:
-                    data[day_counter]["sched_exception"] = 1
+        self.process_rows(agenda_parser.BACKENDS[self.parser](html), self.parser)
 
-                elif "roostervrije dag" in entry.text.lower():
-                    data[day_counter]["sched_exception"] = 2
+    def process_rows(self, rows, source: str) -> None:
+        """Turns the rows of a parser backend or the api client into out.json"""
 
+        self.set_phase("parse")
+        self.json_helper.update_previous()
+        time_at_start = time.perf_counter()
+        # The parser backends are generators, so this includes parsing the html
+        data = self.rows_to_data(rows)
+        elapsed = time.perf_counter() - time_at_start
+        PARSE_TIME.observe(elapsed)
         self.json_helper.write_out(data)
 
         self.log.info("Finished processing")
-        self.log.debug("Processing html took: %d milliseconds", time.time() * 1000 - time_at_start)
-
-    def find_timeslot(self, amount: int, short=False) -> str:
-        """Converts the schedule index to a timeslot string"""
-
-        if amount - 1 > 9 or amount < 1:
-            self.log.error("FindTimeslot: amount not in range")
-            return ""
+        self.log.debug("Processing html took: %d milliseconds (%s parser)", elapsed * 1000, source)
+
+    def rows_to_data(self, rows, today: dt.date = None) -> tuple:
+        """Turns the (kind, text) rows of an agenda_parser backend into the Days of out.json.
+           Dates are stored in full and the hours with their start and end in minutes
+           since midnight, so nothing has to be parsed again later on"""
+
+        today = today or dt.date.today()
+        days = []
+
+        for kind, text in rows:
+            if kind == "day":
+                date = infer_date(*self.text_to_date(text.strip()), today)
+                days.append([date, ScheduleException.NONE, []])
+            elif kind == "hour":
+                if text is not None:
+                    hour_text = text.strip()
+                    lesson = hour_text[1:].strip().replace("\n", " ")
+                    days[-1][2].append((int(hour_text[0]), lesson))
 
-        times = ["08:30 - 09:20",
-                 "09:20 - 10:10",
-                 "10:10 - 11:00",
-                 "11:20 - 12:10",
-                 "12:10 - 13:00",
-                 "13:30 - 14:20",
-                 "14:20 - 15:10",
-                 "15:10 - 16:00",
-                 "16:10 - 17:00"]
-
-        times_short = ["08:30 - 09:10",
-                       "09:10 - 09:50",
-                       "09:50 - 10:30",
-                       "10:50 - 11:30",
-                       "11:30 - 12:10",
-                       "12:10 - 12:50",
-                       "13:20 - 14:00",
-                       "14:00 - 14:40",
-                       "14:40 - 15:20"]
-
-        return times_short[amount - 1] if short else times[amount - 1]
+            else:
+                text = text.lower()
+                verkort_rooster = ("verkort rooster" in text)
+                min_rooster = ("40 minuten rooster" in text)
+                no_min_rooster = ("geen 40 minuten rooster" not in text)
 
-    def await_page_load(self) -> None:
-        """A blocking function that returns once the page is loaded"""
+                if (verkort_rooster or min_rooster) and no_min_rooster:
+                    days[-1][1] = ScheduleException.SHORT
+
+                elif "roostervrije dag" in text:
+                    days[-1][1] = ScheduleException.DAY_OFF
+
+        return tuple(Day(date, sched_exception,
+                         tuple(self.make_lesson(number, lesson, sched_exception) for number, lesson in hours))
+                     for date, sched_exception, hours in days)
+
+    def make_lesson(self, number: int, lesson: str, sched_exception: ScheduleException) -> Lesson:
+        timetable = self.timetables["short" if sched_exception == ScheduleException.SHORT else "normal"]
+        start, end = timetable.slot(number) or (None, None)
+        if start is None:
+            self.log.error("Hour %d is not in the %s timetable", number, timetable.name)
+        return shared_lesson(number, lesson, timetable.timeslot(number), start, end)
+
+    def fetch_schedule(self) -> bool:
+        """Fetches the schedule through the api (if enabled) or selenium
+           and writes it to out.json. Returns whether that succeeded.
+           With scrape_slots, it first waits for a free slot"""
+
+        if self.scrape_slots is None:
+            return self.__fetch_schedule()
+
+        self.set_phase("queued")
+        started = time.perf_counter()
+        with self.scrape_slots:
+            QUEUED_TIME.observe(time.perf_counter() - started)
+            self.set_phase(None)
+            try:
+                return self.__fetch_schedule()
+            finally:
+                if not self.keep_browser and self.__browser is not None:
+                    # Only the running scrapes keep a browser open
+                    self.__browser.close()
 
-        while not self.driver.execute_script("return document.readyState") == "complete":
-            time.sleep(1)
+    def __fetch_schedule(self) -> bool:
+        if self.api_client:
+            try:
+                self.set_phase("api")
+                started = time.perf_counter()
+                rows = self.api_client.fetch_rows()
+                API_TIME.observe(time.perf_counter() - started)
+                self.process_rows(rows, "api")
+                return True
+            except:
+                self.log.exception("Api fetch failed, falling back to selenium")
 
-        time.sleep(2)
-        self.log.debug("Page has loaded")
+        html = self.get_html()
+        if not html:
+            self.log.critical("Cannot process html if fetch failed")
+            return False
+        self.process_html(html)
+        return True
 
-    def refresh_magister_data(self):
+    def refresh_magister_data(self) -> threading.Thread:
+        """Starts a refresh on its own thread. While one is running, no other is
+           started and the running thread is returned instead"""
 
         def thread_func():
             self.log.info("Started new thread to refresh magister data")
-            self.status = MalarmStatus.Scraping
+            self.set_status(MalarmStatus.Scraping)
+            success = False
             try:
-                html = self.get_html()
-                if html:
-                    self.process_html(html)
+                success = self.fetch_schedule()
+                if success:
                     self.json_helper.last_update_data(dt.datetime.now())
-                else:
-                    self.log.critical("Cannot process html if fetch failed")
             except:
                 self.log.exception("Exception inside refresh thread")
             finally:
-                self.status = MalarmStatus.Running
+                self.set_status(MalarmStatus.Running)
+                self.__notify_refresh_listeners(success)
+
+        with self.refresh_lock:
+            if self.refresh_thread and self.refresh_thread.is_alive():
+                self.log.info("Refresh already running, not starting another one")
+                return self.refresh_thread
+
+            self.refresh_thread = threading.Thread(target=thread_func, name="refresh thread", daemon=True)
+            self.refresh_thread.start()
+            return self.refresh_thread
+
+    async def refresh_magister_data_async(self) -> bool:
+        """Coroutine version of refresh_magister_data for the asyncio mode. Selenium
+           and the api client are blocking, so the fetch is handed to the executor.
+           Concurrent calls wait for the running refresh instead of starting one"""
+
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.get_running_loop().create_task(self.__refresh_async())
+        else:
+            self.log.info("Refresh already running, waiting for it")
+        return await asyncio.shield(self.refresh_task)
+
+    async def __refresh_async(self) -> bool:
+        self.log.info("Started new task to refresh magister data")
+        self.set_status(MalarmStatus.Scraping)
+        success = False
+        try:
+            success = await asyncio.get_running_loop().run_in_executor(None, self.fetch_schedule)
+            if success:
+                self.json_helper.last_update_data(dt.datetime.now())
+        except:
+            self.log.exception("Exception inside refresh task")
+        finally:
+            self.set_status(MalarmStatus.Running)
+            self.__notify_refresh_listeners(success)
+        return success
 
-        refresh_thread = threading.Thread(target=thread_func, name="refresh thread", daemon=True)
-        refresh_thread.start()
+    def add_refresh_listener(self, listener) -> None:
+        """listener(success: bool) is called after every refresh"""
+
+        self.refresh_listeners.append(listener)
+
+    def __notify_refresh_listeners(self, success: bool) -> None:
+        for listener in self.refresh_listeners:
+            try:
+                listener(success)
+            except:
+                self.log.exception("Exception inside refresh listener")
 
     def get_status(self) -> MalarmStatus:
         return self.status
 
-    def setup_alarms(self, dispatcher: EventDispatcher):
-        self.log.info("Setting up alarms...")
-        return_list = []
-        data = self.json_helper.get_out()
-        now = dt.datetime.now()
-        for day in data:
-            if day["hours"]:
-                day_start = dt.datetime.combine(dt.date(now.year, day["date"]["mon"], day["date"]["day"]),
-                                                dt.datetime.strptime(
-                                                    day["hours"][0]["timeslot"][:5],
-                                                    "%H:%M").time())
-                alarm_dt = day_start - self.TRAVEL_T - self.PREP_T
-                if now > alarm_dt:
-                    return_list.append("Found alarm before now")
-                    continue
-
-                for upcoming_school_alarm in self.upcoming_school_alarms:
-                    if upcoming_school_alarm.date() == alarm_dt.date():
-                        self.upcoming_school_alarms.remove(upcoming_school_alarm)
-
-                self.upcoming_school_alarms.append(alarm_dt)
-                msg = dispatcher.dispatch(alarm_dt, alarm_function)
-                if msg:
-                    return_list.append(msg)
-        return return_list
-
-    @staticmethod
-    def find_dropped(hours: dict) -> list:
-        """Returns a list of integers, each of which represents a dropped hour"""
+    def get_last_update(self) -> dt.datetime:
+        return self.json_helper.get_last_update()
 
-        dropped = []
-        first_hour = hours[0]["number"]
-        last_hour = hours[len(hours) - 1]["number"]
-        present = [hour["number"] for hour in hours]
-        for i in range(first_hour, last_hour + 1):
-            if i not in present:
-                dropped.append(i)
+    def add_status_listener(self, listener) -> None:
+        """listener(status: MalarmStatus, phase: str) is called on every status
+           change and on every phase transition of a scrape"""
 
-        return dropped
+        self.status_listeners.append(listener)
 
-    @staticmethod
-    def get_speech_str(today: dict, day_start: dt.datetime) -> str:
-        """Returns a string that introduces me to my day"""
+    def set_status(self, status: MalarmStatus, phase: str = None) -> None:
+        self.status = status
+        self.phase = phase
+        for listener in self.status_listeners:
+            try:
+                listener(status, phase)
+            except:
+                self.log.exception("Exception inside status listener")
 
-        if today["hours"]:
-            lesson_lut = {"NETL": "nederlands",
-                          "SCHK": "scheikunde",
-                          "FI": "filosofie",
-                          "WISB": "wiskunde b",
-                          "NAT": "natuurkunde",
-                          "ENTL": "engels",
-                          "BIOL": "biologie",
-                          "LTC": "latijn",
-                          "PE": "gym"}
+    def set_phase(self, phase: str) -> None:
+        self.set_status(self.status, phase)
 
-            lesson = today["hours"][0]["lesson"].split(" - ")
-            lesson_str = lesson_lut.get(lesson[0]) or "een onbekend vak"
+    def get_alarm_time(self, day: Day) -> dt.datetime:
+        """Returns when the alarm for the day should go off, or None on a free day
+           and on a day that starts with an hour that is not in the timetable"""
 
-            is_short = ""
+        try:
+            day_start = day.start()
+        except ValueError as error:
+            self.log.error("No alarm: %s", error)
+            return None
+        if day_start is None:
+            return None
+        return day_start - self.TRAVEL_T - self.PREP_T
+
+    def get_day(self, date: dt.date) -> Day:
+        """Returns the scraped day of date, or None if it is not in the schedule"""
+
+        for day in self.json_helper.get_schedule():
+            if day.date == date:
+                return day
+        return None
+
+    def get_briefing_fragments(self, date: dt.date) -> list:
+        """Returns the fragments of the spoken briefing of date, or None if it is not in the schedule"""
+
+        day = self.get_day(date)
+        if day is None:
+            return None
+        try:
+            day_start = day.start()
+        except ValueError as error:
+            self.log.error("No briefing: %s", error)
+            return None
+        return day_fragments(day, day_start, day.dropped())
 
-            if today["sched_exception"] == 1:
-                is_short = "Vandaag heb je verkort rooster. "
-            elif today["sched_exception"] == 2:
-                is_short = "Vandaag heb je een roostervrije dag. "
+    def setup_alarms(self, dispatcher: EventDispatcher):
+        """Replaces the previously set up school alarms with the alarms
+           for the current schedule, as one dispatcher transaction"""
 
-            dropped = ",".join([str(i) + "e" for i in Malarm.find_dropped(today["hours"])])
-            dropped_str = "Je hebt vandaag de volgende tussenuren: het " + dropped if dropped else "Je hebt vandaag geen tussenuren"
+        self.log.info("Setting up alarms...")
+        return_list = []
+        data = self.json_helper.get_schedule()
+        now = dt.datetime.now()
+        alarms = {}
+        for day in data:
+            alarm_dt = self.get_alarm_time(day)
+            if alarm_dt is None:
+                continue
+            if now > alarm_dt:
+                return_list.append("Found alarm before now")
+                continue
+
+            alarms[day.date] = alarm_dt
+
+        msgs, names = dispatcher.replace(list(self.school_alarms.values()),
+                                         [(alarm_dt, self.functions["Alarm"]) for alarm_dt in alarms.values()])
+        self.school_alarms = {date: name for date, name in zip(alarms.keys(), names) if name}
+        return return_list + msgs
+
+    def adopt_alarms(self, events) -> None:
+        """Takes the restored alarms of this account back into school_alarms after a
+           restart, keyed by date, so the next setup or update cancels them when the
+           day changes. On a date with several, the one at the alarm time of the
+           schedule is taken, otherwise the earliest"""
+
+        alarm_type = self.functions["Alarm"].type
+        expected = {day.date: self.get_alarm_time(day) for day in self.json_helper.get_schedule()}
+        for event in sorted(events, key=lambda event: event.time):
+            if event.func.type != alarm_type:
+                continue
+            date = event.time.date()
+            if date not in self.school_alarms or event.time == expected.get(date):
+                self.school_alarms[date] = event.name
+        if self.school_alarms:
+            self.log.info("Adopted %d restored alarms", len(self.school_alarms))
+
+    def update_alarms(self, dispatcher: EventDispatcher) -> list:
+        """Compares out.json with prev_out.json day by day and only cancels, moves
+           or adds the alarms of the days that changed (or have no alarm yet)"""
 
-            to_return = (f"Je begint vandaag het {today['hours'][0]['number']}e uur"
-                         f"met {lesson_str} om "
-                         f"{day_start.time().isoformat(timespec='minutes')}. "
-                         f"{is_short}{dropped_str}. Fijne dag!")
+        now = dt.datetime.now()
+        prev_days = {day.date: day for day in self.json_helper.get_prev_schedule()}
+        new_days = {day.date: day for day in self.json_helper.get_schedule()}
+        changed = self.diff_days(prev_days, new_days)
+
+        # Days that did not change but were never set up (e.g. on the first run), as long
+        # as their alarm is still to come
+        for date, day in new_days.items():
+            if date in changed or date in self.school_alarms or date < now.date():
+                continue
+            alarm_dt = self.get_alarm_time(day)
+            if alarm_dt is not None and alarm_dt > now:
+                changed[date] = "added"
+
+        cancel = []
+        dispatch = []
+        msgs = []
+        for date in sorted(changed):
+            acted = False
+            if date in self.school_alarms:
+                cancel.append(self.school_alarms.pop(date))
+                acted = True
+            alarm_dt = self.get_alarm_time(new_days[date]) if date in new_days else None
+            if alarm_dt is not None and alarm_dt > now:
+                dispatch.append((date, alarm_dt))
+                acted = True
+            # A change of a past day, or of a free day without an alarm, needs nothing
+            if acted:
+                msgs.append(f"{changed[date].capitalize()} day {date.strftime('%d-%m')}")
+
+        self.log.info("Schedule diff: %s", ", ".join(msgs) if msgs else "no changes")
+        _, names = dispatcher.replace(cancel, [(alarm_dt, self.functions["Alarm"]) for _, alarm_dt in dispatch])
+        for (date, _), name in zip(dispatch, names):
+            self.school_alarms[date] = name
+        return msgs or ["No changes in the schedule"]
 
-            return to_return
+    @staticmethod
+    def day_signature(day: Day) -> tuple:
+        return day.signature()
 
-        return "Je hebt vandaag vrij, dus ik weet niet waarom je een wekker zet, oelewapper!"
+    @staticmethod
+    def diff_days(prev_days: dict, new_days: dict) -> dict:
+        """Returns {date: "added" | "changed" | "removed"} for the days that differ"""
+
+        changed = {}
+        for date, day in new_days.items():
+            if date not in prev_days:
+                changed[date] = "added"
+            elif Malarm.day_signature(prev_days[date]) != Malarm.day_signature(day):
+                changed[date] = "changed"
+        for date in prev_days.keys() - new_days.keys():
+            changed[date] = "removed"
+        return changed
 
     @staticmethod
     def text_to_date(text: str) -> list:
@@ -368,6 +507,7 @@ class Malarm:
         """Destructor of the class, makes sure the selenium driver is always closed"""
 
         try:
-            self.driver.quit()
+            if self.__browser is not None:
+                self.__browser.close()
         except AttributeError:
             pass
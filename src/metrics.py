@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Process metrics in the Prometheus text format, served at GET /metrics.
+   Histograms preallocate their buckets, so observing a value only increments
+   counters and does not allocate on the hot path"""
+
+import bisect
+import threading
+
+# Seconds, from fast json reads up to a slow login
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative histogram. With a label, the children are created up front through
+       child(value), so the call sites can keep a reference to them"""
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS, label: str = None, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+        self.children = {value: Histogram(name, help, buckets) for value in labels}
+
+    def child(self, value: str) -> "Histogram":
+        if value not in self.children:
+            self.children[value] = Histogram(self.name, self.help, self.buckets)
+        return self.children[value]
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        if self.label:
+            for value, child in self.children.items():
+                lines.extend(child.samples(f'{self.label}="{value}"'))
+        else:
+            lines.extend(self.samples(""))
+        return lines
+
+    def samples(self, labels: str) -> list:
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        prefix = labels + "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+        suffix = "{" + labels + "}" if labels else ""
+        lines.append(f"{self.name}_sum{suffix} {total}")
+        lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """Gauge or counter whose value is read from a function when the metrics are rendered"""
+
+    def __init__(self, name: str, help: str, type: str, fn):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.fn = fn
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}",
+                f"{self.name} {self.fn()}"]
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name: str, help: str, **kwargs) -> Histogram:
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, help, **kwargs)
+            return self.metrics[name]
+
+    def callback(self, name: str, help: str, fn, type="gauge") -> None:
+        """Registers (or replaces) a metric that is read from fn"""
+
+        with self.lock:
+            self.metrics[name] = CallbackMetric(name, help, type, fn)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SCRAPE_PHASES = REGISTRY.histogram("malarm_scrape_phase_seconds", "Duration of the phases of a Magister scrape",
+                                   label="phase",
+                                   labels=("queued", "driver_start", "login", "page_load", "api", "parse"))
+JSON_IO = REGISTRY.histogram("malarm_json_io_seconds", "Latency of reading and writing the json files",
+                             label="op", labels=("read", "write"))
+TIMER_LATENESS = REGISTRY.histogram("malarm_timer_lateness_seconds",
+                                    "Time between the scheduled and the actual fire time of an event")
+AUDIO_START = REGISTRY.histogram("malarm_audio_start_seconds",
+                                 "Time from a play request until the clip starts playing")
+
+REGISTRY.callback("malarm_threads", "Number of running threads", threading.active_count)
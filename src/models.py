@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Immutable models of the schedule and the dispatcher events, and the versioned
+   (de)serializer of out.json. The serialized form only uses lists, dicts, strings
+   and integers, so it can be written with json, orjson or msgpack alike"""
+
+import datetime as dt
+
+from enum import IntEnum
+from functools import lru_cache
+from dataclasses import dataclass
+
+from timetable import infer_date, to_minutes
+
+SCHEMA_VERSION = 2
+
+
+class ScheduleException(IntEnum):
+    NONE = 0
+    SHORT = 1
+    DAY_OFF = 2
+
+
+@dataclass(frozen=True)
+class Lesson:
+    __slots__ = ("number", "lesson", "timeslot", "start", "end")
+
+    number: int
+    lesson: str
+    timeslot: str
+    start: int  # minutes since midnight, None if the hour is not in the timetable
+    end: int
+
+
+@lru_cache(maxsize=4096)
+def shared_lesson(number: int, lesson: str, timeslot: str, start: int, end: int) -> Lesson:
+    """Lessons are immutable, so the accounts of one class share the instances"""
+
+    return Lesson(number, lesson, timeslot, start, end)
+
+
+@dataclass(frozen=True)
+class Day:
+    __slots__ = ("date", "sched_exception", "hours")
+
+    date: dt.date
+    sched_exception: ScheduleException
+    hours: tuple
+
+    def start(self) -> dt.datetime:
+        """Returns when the first lesson starts, or None on a free day. Raises
+           ValueError if the first hour is not in the timetable"""
+
+        if not self.hours:
+            return None
+        if self.hours[0].start is None:
+            raise ValueError(f"Hour {self.hours[0].number} of {self.date.isoformat()} is not in the timetable")
+        return dt.datetime.combine(self.date, dt.time()) + dt.timedelta(minutes=self.hours[0].start)
+
+    def dropped(self) -> list:
+        """Returns a list of integers, each of which represents a dropped hour"""
+
+        if not self.hours:
+            return []
+        present = {hour.number for hour in self.hours}
+        return [i for i in range(self.hours[0].number, self.hours[-1].number + 1) if i not in present]
+
+    def signature(self) -> tuple:
+        """The parts of a day that decide its alarm: the first hour, the schedule
+           exception and the dropped hours"""
+
+        if not self.hours:
+            return (None, self.sched_exception, ())
+        return ((self.hours[0].number, self.hours[0].start), self.sched_exception, tuple(self.dropped()))
+
+
+@dataclass(frozen=True, eq=False)
+class ScheduledEvent:
+    """Class for keeping track of event info"""
+
+    __slots__ = ("name", "time", "func", "seq", "rule", "occurrence")
+
+    name: str
+    time: dt.datetime
+    func: object  # function.EventFunction
+    seq: int
+    rule: object  # recurrence.RecurrenceRule of a recurring event, otherwise None
+    occurrence: int  # index of this occurrence of the rule
+
+    def __repr__(self):
+        if self.rule is not None:
+            return f"({self.name} at {self.time.isoformat(' ', timespec='minutes')}, {self.rule})"
+        return f"({self.name} at {self.time.isoformat(' ', timespec='minutes')})"
+
+
+def lesson_to_json(lesson: Lesson) -> dict:
+    return {"number": lesson.number, "lesson": lesson.lesson, "timeslot": lesson.timeslot,
+            "start": lesson.start, "end": lesson.end}
+
+
+def day_to_json(day: Day) -> dict:
+    return {"date": day.date.isoformat(),
+            "sched_exception": int(day.sched_exception),
+            "hours": [lesson_to_json(lesson) for lesson in day.hours]}
+
+
+def schedule_to_json(days) -> dict:
+    return {"version": SCHEMA_VERSION, "days": [day_to_json(day) for day in days]}
+
+
+def schedule_from_json(data, today: dt.date = None) -> tuple:
+    """Parses every version of out.json: version 2 ({"version", "days"}), and the
+       plain list of days before that, with {"day", "mon"} dates and only the timeslot string"""
+
+    if isinstance(data, dict):
+        if not data:
+            # Freshly initialized file
+            return ()
+        if data.get("version") != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported out.json version {data.get('version')}")
+        return tuple(Day(dt.date.fromisoformat(day["date"]),
+                         ScheduleException(day["sched_exception"]),
+                         tuple(shared_lesson(**hour) for hour in day["hours"]))
+                     for day in data["days"])
+
+    today = today or dt.date.today()
+    days = []
+    for day in data:
+        date = day["date"]
+        if isinstance(date, dict):
+            date = infer_date(date["day"], date["mon"], today)
+        else:
+            date = dt.date.fromisoformat(date)
+        hours = []
+        for hour in day["hours"]:
+            start = hour.get("start")
+            if start is None and hour["timeslot"]:
+                start = to_minutes(hour["timeslot"][:5])
+            end = hour.get("end")
+            if end is None and hour["timeslot"]:
+                end = to_minutes(hour["timeslot"][-5:])
+            hours.append(shared_lesson(hour["number"], hour["lesson"], hour["timeslot"], start, end))
+        days.append(Day(date, ScheduleException(day["sched_exception"]), tuple(hours)))
+    return tuple(days)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""The alarm owner: the single process that holds the dispatcher, Malarm, the
+   refresh scheduler and the stop inputs, so every alarm fires exactly once however
+   many web workers serve the interface. The workers call it over a Unix socket
+   (see rpc.py and remote.py).
+
+   usage: python3 owner.py   (before starting the workers, see wsgi.py)"""
+
+import os
+import fcntl
+import logging
+import datetime as dt
+
+from os import path
+
+from rpc import RpcServer
+import accounts
+from malarm import Malarm
+from event_dispatcher import EventDispatcher
+from json_helper import JsonHelper
+from journal import AlarmJournal
+from refresh_scheduler import RefreshScheduler
+from input_events import InputEvents
+from recurrence import RecurrenceRule
+from live_feed import LiveFeed
+from metrics import REGISTRY
+from http_cache import page_version, document_version
+from function import available_functions, warmup
+
+SOCKET_PATH = path.normpath(path.join(path.dirname(__file__), "../run/owner.sock"))
+
+
+class OwnerRunningError(Exception):
+    """Raised when another owner already holds the lock of the socket"""
+
+
+class AlarmOwner:
+
+    def __init__(self, socket_path=SOCKET_PATH, json_helper: JsonHelper = None, malarm: Malarm = None,
+                 dispatcher: EventDispatcher = None, inputs: InputEvents = None):
+        self.socket_path = socket_path
+        self.json_helper = json_helper or JsonHelper()
+        # One Malarm, or the Malarms of the accounts in accounts/
+        self.malarm = malarm or accounts.create((1800, 2400, 1200), "../audio-files/alarm_sound.mp3", 10,
+                                                json_helper=self.json_helper)
+        self.dispatcher = dispatcher or EventDispatcher(journal=AlarmJournal())
+        self.inputs = inputs or InputEvents(self.dispatcher, pin=10)
+        self.feed = LiveFeed()
+        self.feed.attach(self.dispatcher, self.malarm)
+        self.lock_file = None
+        self.server = None
+        self.log = logging.getLogger("Malarm")
+
+        self.methods = {"events": self.events,
+                        "types": lambda: list(available_functions),
+                        "dispatch": self.dispatch,
+                        "dispatch_rule": self.dispatch_rule,
+                        "cancel_event": self.dispatcher.cancel_event_by_name,
+                        "cancel_all": self.dispatcher.cancel_all,
+                        "log_status": self.log_status,
+                        "version": lambda: self.dispatcher.version,
+                        "scrape": self.scrape,
+                        "setup_alarms": lambda: self.malarm.setup_alarms(self.dispatcher),
+                        "update_alarms": lambda: self.malarm.update_alarms(self.dispatcher),
+                        "status": lambda: {"status": self.malarm.get_status().name, "phase": self.malarm.phase},
+                        "last_update": lambda: self.malarm.get_last_update().isoformat(),
+                        "stop_alarm": self.inputs.stop_alarm,
+                        "feed_seq": lambda: self.feed.seq,
+                        "feed_wait": self.feed.wait,
+                        "state": lambda: self.feed.state(self.dispatcher, self.malarm),
+                        "state_version": lambda: page_version(self.feed, self.dispatcher, self.json_helper),
+                        "out_version": lambda: document_version(self.json_helper, "out.json"),
+                        "out_json": self.json_helper.get_out,
+                        "json_stats": self.json_helper.stats,
+                        "metrics": REGISTRY.render}
+
+    def __acquire(self) -> None:
+        """Only one owner may run per socket, a second one would ring every alarm twice"""
+
+        if not path.exists(path.dirname(self.socket_path)):
+            os.mkdir(path.dirname(self.socket_path))
+        self.lock_file = open(self.socket_path + ".lock", "w")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise OwnerRunningError(f"An owner is already running on {self.socket_path}")
+
+    def start(self) -> None:
+        """Takes the lock, restores the alarms, starts the background work and
+           opens the socket. serve_forever() serves it"""
+
+        self.__acquire()
+        restored = self.dispatcher.restore(available_functions)
+        for member in accounts.members(self.malarm):
+            member.adopt_alarms(restored)
+            RefreshScheduler(member, self.dispatcher).start()
+        self.inputs.start()
+        warmup()
+        self.server = RpcServer(self.socket_path, self.methods)
+        self.log.info("Alarm owner listening on %s", self.socket_path)
+
+    def serve_forever(self) -> None:
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self.server:
+            self.server.server_close()
+            os.remove(self.socket_path)
+            self.server = None
+        self.inputs.close()
+        if self.lock_file:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def events(self) -> list:
+        return [AlarmJournal.event_record(e) for e in self.dispatcher.get_current()]
+
+    def dispatch(self, time: str, type: str):
+        return self.dispatcher.dispatch(dt.datetime.fromisoformat(time), available_functions[type])
+
+    def dispatch_rule(self, rule: dict, type: str) -> str:
+        return self.dispatcher.dispatch_rule(RecurrenceRule.from_json(rule), available_functions[type])
+
+    def log_status(self) -> None:
+        self.dispatcher.status()
+        self.log.info("Json cache: %s", self.json_helper.stats())
+
+    def scrape(self) -> None:
+        self.malarm.refresh_magister_data()
+
+
+if __name__ == "__main__":
+    owner = AlarmOwner()
+    owner.start()
+    owner.serve_forever()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import threading
+
+from os import path
+from collections import OrderedDict
+
+
+class PhraseStore:
+    """Cache of synthesized phrases. The index is kept in memory (and in index.json),
+       the files are named after a hash of language and text, and the least recently
+       used phrases are evicted once the files exceed the disk budget"""
+
+    def __init__(self, folder_path: str, backend, disk_budget=50 * 1024 * 1024):
+        """backend is a speech.TtsBackend, its synthesize(text, language, file_stem)
+           writes the speech to file_stem plus its extension and returns that path"""
+
+        self.folder_path = folder_path
+        self.index_path = path.join(folder_path, "index.json")
+        self.backend = backend
+        self.disk_budget = disk_budget
+        self.pinned = set()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+
+        if not path.exists(folder_path):
+            os.mkdir(folder_path)
+        self.__load_index()
+
+    @staticmethod
+    def key(text: str, language: str) -> str:
+        return hashlib.sha1(f"{language}\n{text}".encode("utf-8")).hexdigest()[:20]
+
+    def __load_index(self) -> None:
+        if path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as index:
+                for entry in json.load(index):
+                    self.entries[self.key(entry["text"], entry["language"])] = entry
+            return
+
+        # Import the cache of the old SpeechManager, which named files after a timestamp
+        regular_path = path.join(self.folder_path, "regular.json")
+        if path.exists(regular_path):
+            with open(regular_path, "r", encoding="utf-8") as regular:
+                for text, file_name in json.load(regular).items():
+                    self.__add_entry(text, "nl", file_name)
+            self.__save_index()
+
+    def __save_index(self) -> None:
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as tmp:
+            json.dump(list(self.entries.values()), tmp, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def __add_entry(self, text: str, language: str, file_name: str) -> None:
+        file_path = path.join(self.folder_path, file_name)
+        if not path.exists(file_path):
+            return
+        self.entries[self.key(text, language)] = {"text": text,
+                                                  "language": language,
+                                                  "file": file_name,
+                                                  "size": path.getsize(file_path)}
+        self.entries.move_to_end(self.key(text, language))
+
+    def get(self, text: str, language="nl") -> str:
+        """Returns the path of the cached phrase, or None"""
+
+        key = self.key(text, language)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return path.join(self.folder_path, entry["file"])
+
+    def get_or_create(self, text: str, language="nl") -> str:
+        """Returns the path of the phrase, synthesizing it on a miss"""
+
+        return self.get(text, language) or self.add(text, language)
+
+    def add(self, text: str, language="nl") -> str:
+        return self.add_many([text], language)[0]
+
+    def add_many(self, texts, language="nl") -> list:
+        """Synthesizes the texts in one batch, returns the paths of the phrases"""
+
+        keys = [self.key(text, language) for text in texts]
+        items = [(text, language, path.join(self.folder_path, f".{key}.tmp")) for text, key in zip(texts, keys)]
+        try:
+            tmp_paths = self.backend.synthesize_many(items)
+
+            file_paths = []
+            with self.lock:
+                for text, key, tmp_path in zip(texts, keys, tmp_paths):
+                    file_name = key + path.splitext(tmp_path)[1]
+                    file_path = path.join(self.folder_path, file_name)
+                    os.replace(tmp_path, file_path)
+                    old = self.entries.get(key)
+                    if old is not None and old["file"] != file_name:
+                        # Synthesized by a different backend before
+                        self.__remove_file(old["file"])
+                    self.__add_entry(text, language, file_name)
+                    file_paths.append(file_path)
+                self.__evict()
+                self.__save_index()
+            return file_paths
+        finally:
+            # A backend that failed partway through the batch left the files of the first
+            # texts behind, e.g. the mp3 files of gTTS when FallbackBackend used espeak
+            self.__remove_tmp_files(keys)
+
+    def warmup(self, texts, language="nl", pin=False) -> int:
+        """Synthesizes the phrases that are not cached yet in one batch, returns how many were added"""
+
+        missing = []
+        for text in texts:
+            key = self.key(text, language)
+            if pin:
+                self.pinned.add(key)
+            if key not in self.entries and text not in missing:
+                missing.append(text)
+        if missing:
+            self.add_many(missing, language)
+        return len(missing)
+
+    def __evict(self) -> None:
+        total = sum(entry["size"] for entry in self.entries.values())
+        for key in list(self.entries):
+            if total <= self.disk_budget:
+                break
+            if key in self.pinned:
+                continue
+            entry = self.entries.pop(key)
+            total -= entry["size"]
+            self.__remove_file(entry["file"])
+
+    def __remove_file(self, file_name: str) -> None:
+        try:
+            os.remove(path.join(self.folder_path, file_name))
+        except FileNotFoundError:
+            pass
+
+    def __remove_tmp_files(self, keys: list) -> None:
+        stems = {f".{key}.tmp" for key in keys}
+        for file_name in os.listdir(self.folder_path):
+            if path.splitext(file_name)[0] in stems:
+                self.__remove_file(file_name)
+
+    def texts(self) -> dict:
+        """Returns {text: file name} of the cached phrases"""
+
+        with self.lock:
+            return {entry["text"]: entry["file"] for entry in self.entries.values()}
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {"phrases": len(self.entries),
+                    "bytes": sum(entry["size"] for entry in self.entries.values()),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0}
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import datetime as dt
+
+from dataclasses import dataclass
+
+DAILY = "daily"
+WEEKLY = "weekly"
+
+WEEKDAY_NAMES = ("ma", "di", "wo", "do", "vr", "za", "zo")
+
+
+@dataclass(frozen=True)
+class RecurrenceRule:
+    """RRULE-like recurrence: every interval days (DAILY), or on the given weekdays of
+       every interval weeks (WEEKLY), at the time of day of start. It ends after until
+       and/or after count occurrences, the dates in exdates are skipped (and not counted).
+       Occurrences are computed one at a time, so a rule takes the same memory for any length"""
+
+    __slots__ = ("start", "freq", "interval", "weekdays", "until", "count", "exdates")
+
+    start: dt.datetime
+    freq: str
+    interval: int
+    weekdays: tuple  # 0 is monday, only used for WEEKLY
+    until: dt.datetime
+    count: int
+    exdates: frozenset
+
+    @classmethod
+    def daily(cls, start: dt.datetime, interval=1, until=None, count=None, exdates=()) -> "RecurrenceRule":
+        return cls(start, DAILY, interval, (), until, count, frozenset(exdates))
+
+    @classmethod
+    def weekly(cls, start: dt.datetime, weekdays=None, interval=1, until=None, count=None,
+               exdates=()) -> "RecurrenceRule":
+        weekdays = tuple(sorted(set(weekdays))) if weekdays else (start.weekday(),)
+        return cls(start, WEEKLY, interval, weekdays, until, count, frozenset(exdates))
+
+    @classmethod
+    def on_weekdays(cls, start: dt.datetime, **kwargs) -> "RecurrenceRule":
+        return cls.weekly(start, weekdays=range(5), **kwargs)
+
+    def __matches(self, date: dt.date) -> bool:
+        if self.freq == DAILY:
+            return (date - self.start.date()).days % self.interval == 0
+        start_monday = self.start.date() - dt.timedelta(days=self.start.weekday())
+        return date.weekday() in self.weekdays and (date - start_monday).days // 7 % self.interval == 0
+
+    def __next_date(self, date: dt.date) -> dt.date:
+        if self.freq == DAILY:
+            return date + dt.timedelta(days=self.interval)
+        # At most 7 * interval steps
+        date += dt.timedelta(days=1)
+        while not self.__matches(date):
+            date += dt.timedelta(days=1)
+        return date
+
+    def __occurrence(self, date: dt.date, index: int) -> tuple:
+        """Returns (time, index) for the first occurrence from date on, or None if the rule ended"""
+
+        while True:
+            _time = dt.datetime.combine(date, self.start.time())
+            if (self.until is not None and _time > self.until) or (self.count is not None and index >= self.count):
+                return None
+            if date not in self.exdates:
+                return _time, index
+            date = self.__next_date(date)
+
+    def first(self) -> tuple:
+        """Returns (time, index) of the first occurrence, or None"""
+
+        date = self.start.date()
+        if not self.__matches(date):
+            date = self.__next_date(date)
+        return self.__occurrence(date, 0)
+
+    def next(self, previous: dt.datetime, index: int) -> tuple:
+        """Returns (time, index) of the occurrence after the one at previous with the given index, or None"""
+
+        return self.__occurrence(self.__next_date(previous.date()), index + 1)
+
+    def next_after(self, previous: dt.datetime, index: int, now: dt.datetime) -> tuple:
+        """Like next, but skips the occurrences that are not after now (e.g. missed while
+           the program was not running)"""
+
+        occurrence = (previous, index)
+        while occurrence is not None and occurrence[0] <= now:
+            occurrence = self.next(*occurrence)
+        return occurrence
+
+    def __str__(self) -> str:
+        if self.freq == DAILY:
+            text = "daily" if self.interval == 1 else f"every {self.interval} days"
+        else:
+            days = ",".join(WEEKDAY_NAMES[day] for day in self.weekdays)
+            text = f"weekly on {days}" if self.interval == 1 else f"every {self.interval} weeks on {days}"
+        if self.until is not None:
+            text += f" until {self.until.date().isoformat()}"
+        if self.count is not None:
+            text += f", {self.count} times"
+        return text
+
+    def to_json(self) -> dict:
+        return {"start": self.start.isoformat(),
+                "freq": self.freq,
+                "interval": self.interval,
+                "weekdays": list(self.weekdays),
+                "until": self.until.isoformat() if self.until else None,
+                "count": self.count,
+                "exdates": sorted(date.isoformat() for date in self.exdates)}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "RecurrenceRule":
+        return cls(dt.datetime.fromisoformat(data["start"]),
+                   data["freq"],
+                   data["interval"],
+                   tuple(data["weekdays"]),
+                   dt.datetime.fromisoformat(data["until"]) if data["until"] else None,
+                   data["count"],
+                   frozenset(dt.date.fromisoformat(date) for date in data["exdates"]))
+
+
+REPEAT_OPTIONS = {"daily": RecurrenceRule.daily,
+                  "weekdays": RecurrenceRule.on_weekdays,
+                  "weekly": RecurrenceRule.weekly}
+
+
+def rule_for(repeat: str, start: dt.datetime) -> RecurrenceRule:
+    """Returns the rule for a repeat option of the web interface, None for "once" """
+
+    if repeat in REPEAT_OPTIONS:
+        return REPEAT_OPTIONS[repeat](start)
+    return None
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import logging
+import datetime as dt
+
+from event_dispatcher import EventDispatcher
+from function import EventFunction, get_briefing, account_type
+from malarm import Malarm
+
+
+class RefreshScheduler:
+    """Refreshes the Magister data periodically through the dispatcher. It refreshes
+       more often on the evening before a school day, backs off exponentially after
+       failed refreshes and updates the alarms after every successful one"""
+
+    def __init__(self, malarm: Malarm, dispatcher: EventDispatcher,
+                 interval=dt.timedelta(hours=6),
+                 evening_interval=dt.timedelta(hours=1),
+                 evening=(dt.time(18), dt.time(23)),
+                 first_delay=dt.timedelta(minutes=1),
+                 backoff=dt.timedelta(minutes=5),
+                 max_backoff=dt.timedelta(hours=6)):
+        self.malarm = malarm
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self.evening_interval = evening_interval
+        self.evening = evening
+        self.first_delay = first_delay
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.event_name = None
+        self.function = EventFunction(self.run, type=account_type("Refresh", malarm.account), afn=self.run_async,
+                                      persist=False)
+        self.log = logging.getLogger("Malarm")
+
+        self.malarm.add_refresh_listener(self.on_refresh)
+
+    def start(self) -> None:
+        self.schedule(dt.datetime.now() + self.first_delay)
+
+    def schedule(self, _time: dt.datetime) -> None:
+        """Replaces the pending refresh event (if any) with one at _time"""
+
+        cancel = [self.event_name] if self.event_name else []
+        _, names = self.dispatcher.replace(cancel, [(_time.replace(microsecond=0), self.function)])
+        self.event_name = names[0]
+        self.log.info("Next refresh at %s", _time.isoformat(" ", timespec="minutes"))
+
+    def run(self) -> None:
+        self.event_name = None
+        self.malarm.refresh_magister_data()
+
+    async def run_async(self) -> None:
+        self.event_name = None
+        await self.malarm.refresh_magister_data_async()
+
+    def on_refresh(self, success: bool) -> None:
+        """Called after every refresh, also the ones started from the web interface"""
+
+        now = dt.datetime.now()
+        if success:
+            self.failures = 0
+            # Scheduled first, an exception while updating the alarms must not end the refreshes
+            self.schedule(now + self.next_interval(now))
+            self.malarm.update_alarms(self.dispatcher)
+            self.prepare_briefings(now.date())
+        else:
+            self.failures += 1
+            delay = min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+            self.log.warning("Refresh failed %d time(s) in a row, retrying in %s", self.failures, delay)
+            self.schedule(now + delay)
+
+    def prepare_briefings(self, today: dt.date) -> None:
+        """Prepares the spoken briefings of today and tomorrow in the background,
+           so the alarm can play them right away"""
+
+        days = {}
+        for date in (today, today + dt.timedelta(days=1)):
+            fragments = self.malarm.get_briefing_fragments(date)
+            if fragments:
+                days[date] = fragments
+        if days:
+            get_briefing().prepare_in_background(days, self.malarm.account, self.malarm.language)
+
+    def next_interval(self, now: dt.datetime) -> dt.timedelta:
+        if self.evening[0] <= now.time() < self.evening[1] and self.is_school_day(now.date() + dt.timedelta(days=1)):
+            return self.evening_interval
+        return self.interval
+
+    def is_school_day(self, date: dt.date) -> bool:
+        day = self.malarm.get_day(date)
+        if day is not None:
+            return bool(day.hours)
+        # Not in the scraped schedule, assume a weekday is a school day
+        return date.weekday() < 5
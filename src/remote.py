@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Stand-ins for the dispatcher, Malarm, the live feed and the stop inputs in a web
+   worker. They have the methods the app.py routes use, and forward them to the
+   alarm owner process (owner.py) over RPC"""
+
+import datetime as dt
+
+from collections.abc import Mapping
+
+from rpc import RpcClient
+from malarm import MalarmStatus
+from models import ScheduledEvent
+from recurrence import RecurrenceRule
+from function import EventFunction
+
+
+class RemoteDispatcher:
+
+    def __init__(self, client: RpcClient):
+        self.client = client
+
+    @property
+    def version(self) -> int:
+        return self.client.call("version")
+
+    def get_current(self) -> list:
+        """The scheduled events of the owner, sorted by time. Their functions only
+           carry the type, the events never run in a worker"""
+
+        return [ScheduledEvent(record["name"],
+                               dt.datetime.fromisoformat(record["time"]),
+                               EventFunction(None, type=record["type"]),
+                               record["seq"],
+                               RecurrenceRule.from_json(record["rule"]) if "rule" in record else None,
+                               record.get("occurrence", 0))
+                for record in self.client.call("events")]
+
+    def dispatch(self, _time: dt.datetime, func):
+        return self.client.call("dispatch", time=_time.isoformat(), type=func.type)
+
+    def dispatch_rule(self, rule: RecurrenceRule, func) -> str:
+        return self.client.call("dispatch_rule", rule=rule.to_json(), type=func.type)
+
+    def cancel_event_by_name(self, _name: str):
+        return self.client.call("cancel_event", _name=_name)
+
+    def cancel_all(self) -> None:
+        self.client.call("cancel_all")
+
+    def status(self) -> None:
+        """Logs the status in the owner process"""
+
+        self.client.call("log_status")
+
+
+class RemoteFunctions(Mapping):
+    """The available_functions of the owner, which has registered the accounts. Their
+       functions only carry the type, which is all RemoteDispatcher sends"""
+
+    def __init__(self, client: RpcClient):
+        self.client = client
+
+    def types(self) -> list:
+        return self.client.call("types")
+
+    def __getitem__(self, type: str) -> EventFunction:
+        if type not in self.types():
+            raise KeyError(type)
+        return EventFunction(None, type=type)
+
+    def __contains__(self, type) -> bool:
+        return type in self.types()
+
+    def __iter__(self):
+        return iter(self.types())
+
+    def __len__(self) -> int:
+        return len(self.types())
+
+
+class RemoteMalarm:
+
+    def __init__(self, client: RpcClient):
+        self.client = client
+
+    def get_status(self) -> MalarmStatus:
+        return MalarmStatus[self.client.call("status")["status"]]
+
+    @property
+    def phase(self) -> str:
+        return self.client.call("status")["phase"]
+
+    def get_last_update(self) -> dt.datetime:
+        return dt.datetime.fromisoformat(self.client.call("last_update"))
+
+    def refresh_magister_data(self) -> None:
+        self.client.call("scrape")
+
+    def setup_alarms(self, dispatcher=None):
+        """Sets up the alarms in the owner, on its own dispatcher"""
+
+        return self.client.call("setup_alarms")
+
+    def update_alarms(self, dispatcher=None) -> list:
+        return self.client.call("update_alarms")
+
+
+class RemoteJsonHelper:
+    """The json documents as the owner has them, its writes may not be on disk yet"""
+
+    def __init__(self, client: RpcClient):
+        self.client = client
+
+    def get_out(self) -> dict:
+        return self.client.call("out_json")
+
+    def stats(self) -> dict:
+        return self.client.call("json_stats")
+
+
+class RemoteFeed:
+
+    def __init__(self, client: RpcClient):
+        self.client = client
+
+    @property
+    def seq(self) -> int:
+        return self.client.call("feed_seq")
+
+    def wait(self, seq: int, timeout: float) -> list:
+        return self.client.call("feed_wait", seq=seq, timeout=timeout)
+
+    def state(self, dispatcher=None, malarm=None) -> dict:
+        return self.client.call("state")
+
+
+class RemoteInputs:
+
+    def __init__(self, client: RpcClient):
+        self.client = client
+
+    def stop_alarm(self, source: str) -> list:
+        return self.client.call("stop_alarm", source=source)
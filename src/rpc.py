@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Minimal RPC over a local Unix socket, used by the web workers to reach the alarm
+   owner process (see owner.py). Every request and response is one line of json:
+     {"method": "dispatch", "args": {...}}   ->   {"result": ...} or {"error": "..."}"""
+
+import os
+import json
+import socket
+import logging
+import threading
+import socketserver
+
+
+class RpcError(Exception):
+    """Raised by RpcClient.call when the method failed on the server"""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                method = self.server.methods[request["method"]]
+                response = {"result": method(**request.get("args", {}))}
+            except Exception as e:
+                self.server.log.exception("RPC request failed")
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class RpcServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves the methods (name -> function) on a Unix socket, a thread per connection.
+       The socket is only accessible to the user that runs the server"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, methods: dict):
+        self.methods = methods
+        self.log = logging.getLogger("Malarm")
+        if os.path.exists(socket_path):
+            # Left behind by a previous run, the caller made sure it is not in use
+            os.remove(socket_path)
+        umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            os.umask(umask)
+
+
+class RpcClient:
+    """Client of an RpcServer. Every thread keeps its own connection, so the threads
+       of a web worker can call at the same time"""
+
+    def __init__(self, socket_path: str, timeout=60):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def __connection(self):
+        if getattr(self.local, "conn", None) is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self.local.conn = (sock, sock.makefile("rb"))
+        return self.local.conn
+
+    def __close(self):
+        sock, reader = self.local.conn
+        self.local.conn = None
+        reader.close()
+        sock.close()
+
+    def call(self, method: str, **args):
+        data = json.dumps({"method": method, "args": args}).encode("utf-8") + b"\n"
+        for attempt in range(2):
+            sock, reader = self.__connection()
+            try:
+                sock.sendall(data)
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError("RPC server closed the connection")
+                break
+            except socket.timeout:
+                # The call may still be running, retrying could run it twice
+                self.__close()
+                raise
+            except OSError:
+                self.__close()
+                # The owner may have been restarted, reconnect once
+                if attempt:
+                    raise
+        response = json.loads(line)
+        if "error" in response:
+            raise RpcError(response["error"])
+        return response["result"]
@@ -1,81 +1,258 @@
-import time
-import datetime as dt
+import asyncio
 import json
-from io import BytesIO
-from os import path, system, mkdir
-from contextlib import redirect_stdout
+import logging
+import shutil
+import tempfile
+import threading
+import subprocess
+import importlib.util
+from os import path
 
-from gtts import gTTS
-from pydub import AudioSegment
+from phrase_store import PhraseStore
+from metrics import REGISTRY
 
-with redirect_stdout(None):
-    from pygame import mixer
+
+class TtsBackend:
+    """Base class of the text to speech engines. synthesize writes the speech to
+       file_stem + extension and returns that path"""
+
+    name = ""
+    extension = ".wav"
+
+    def available(self) -> bool:
+        return True
+
+    def synthesize(self, text: str, language: str, file_stem: str) -> str:
+        raise NotImplementedError
+
+    def synthesize_many(self, items: list) -> list:
+        """items is a list of (text, language, file_stem), returns the written paths"""
+
+        return [self.synthesize(text, language, file_stem) for text, language, file_stem in items]
+
+
+class GttsBackend(TtsBackend):
+    """Google Translate's text to speech, needs a network connection"""
+
+    name = "gtts"
+    extension = ".mp3"
+
+    def available(self) -> bool:
+        return importlib.util.find_spec("gtts") is not None
+
+    def synthesize(self, text: str, language: str, file_stem: str) -> str:
+        from gtts import gTTS
+
+        file_path = file_stem + self.extension
+        gTTS(text=text, lang=language, slow=False).save(file_path)
+        return file_path
+
+
+class EspeakBackend(TtsBackend):
+    """Offline synthesis with espeak-ng. espeak-ng writes one file per invocation,
+       so a batch starts up to `processes` invocations at the same time"""
+
+    name = "espeak"
+
+    def __init__(self, executable="espeak-ng", speed=150, processes=4):
+        self.executable = executable
+        self.speed = speed
+        self.processes = processes
+
+    def available(self) -> bool:
+        return shutil.which(self.executable) is not None
+
+    def synthesize(self, text: str, language: str, file_stem: str) -> str:
+        return self.synthesize_many([(text, language, file_stem)])[0]
+
+    def synthesize_many(self, items: list) -> list:
+        paths = []
+        running = []
+        for text, language, file_stem in items:
+            file_path = file_stem + self.extension
+            paths.append(file_path)
+            running.append(subprocess.Popen([self.executable, "-v", language, "-s", str(self.speed),
+                                             "-w", file_path, "--stdin"],
+                                            stdin=subprocess.PIPE, stderr=subprocess.PIPE))
+            running[-1].stdin.write(text.encode("utf-8"))
+            running[-1].stdin.close()
+            if len(running) >= self.processes:
+                self.__wait(running.pop(0))
+        for process in running:
+            self.__wait(process)
+        return paths
+
+    def __wait(self, process: subprocess.Popen) -> None:
+        if process.wait() != 0:
+            raise RuntimeError(f"{self.executable} failed: {process.stderr.read().decode(errors='replace')}")
+
+
+class PiperBackend(TtsBackend):
+    """Offline neural synthesis with piper. A batch is synthesized by one piper
+       process per language, so the voice model is only loaded once"""
+
+    name = "piper"
+
+    def __init__(self, executable="piper", models=None):
+        """models maps a language to the path of its .onnx voice model"""
+
+        self.executable = executable
+        self.models = models or {"nl": path.normpath(path.join(path.dirname(__file__),
+                                                               "../voices/nl_NL-mls-medium.onnx"))}
+
+    def available(self) -> bool:
+        return shutil.which(self.executable) is not None and all(map(path.exists, self.models.values()))
+
+    def synthesize(self, text: str, language: str, file_stem: str) -> str:
+        return self.synthesize_many([(text, language, file_stem)])[0]
+
+    def synthesize_many(self, items: list) -> list:
+        by_language = {}
+        for text, language, file_stem in items:
+            by_language.setdefault(language, []).append({"text": text, "output_file": file_stem + self.extension})
+
+        for language, lines in by_language.items():
+            if language not in self.models:
+                raise RuntimeError(f"No piper voice for language {language}")
+            # --json-input reads one {"text", "output_file"} object per line
+            subprocess.run([self.executable, "--model", self.models[language], "--json-input"],
+                           input="\n".join(json.dumps(line) for line in lines).encode("utf-8"),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        return [file_stem + self.extension for _, _, file_stem in items]
+
+
+class FallbackBackend(TtsBackend):
+    """Uses the first backend, and the second one when the first fails (e.g. gTTS without network)"""
+
+    def __init__(self, primary: TtsBackend, fallback: TtsBackend):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+        self.log = logging.getLogger("Malarm")
+
+    def available(self) -> bool:
+        return self.primary.available() or self.fallback.available()
+
+    def synthesize(self, text: str, language: str, file_stem: str) -> str:
+        return self.synthesize_many([(text, language, file_stem)])[0]
+
+    def synthesize_many(self, items: list) -> list:
+        try:
+            return self.primary.synthesize_many(items)
+        except Exception as e:
+            self.log.warning("%s synthesis failed (%s), falling back to %s", self.primary.name, e, self.fallback.name)
+            return self.fallback.synthesize_many(items)
+
+
+BACKENDS = {"gtts": GttsBackend,
+            "espeak": EspeakBackend,
+            "piper": PiperBackend}
+
+
+def get_backend(name: str) -> TtsBackend:
+    """Returns the backend for a name like "piper" or "gtts+espeak" (gTTS with espeak as fallback)"""
+
+    names = name.split("+")
+    backend = BACKENDS[names[-1]]()
+    for primary in reversed(names[:-1]):
+        backend = FallbackBackend(BACKENDS[primary](), backend)
+    return backend
 
 
 class SpeechManager:
 
-    def __init__(self, cache_folder="../speech_cache"):
-        mixer.init()
+    FIXED_PHRASES = ("Good morning", "Tot morgen")
+
+    def __init__(self, cache_folder="../speech_cache", backend="gtts+espeak", player=None):
+        """player is an audio.AudioPlayer, pygame is only imported when none is given"""
+
+        if player is None:
+            from audio import AudioPlayer
+            player = AudioPlayer()
+        self.player = player
         self.folder_path = path.normpath(path.join(path.dirname(__file__), cache_folder))
-        self.json_path = path.join(self.folder_path, 'regular.json')
-        # print("folder_path: ", self.folder_path, "\njson_path: ", self.json_path)
-        try:
-            mkdir(self.folder_path)
-            with open(self.json_path, "w", encoding="utf-8") as reg_json:
-                reg_json.write("{\n}")
-        except FileExistsError:
-            pass
-            # print("regulars exists")
+        self.backend = get_backend(backend) if isinstance(backend, str) else backend
+        self.store = PhraseStore(self.folder_path, self.backend)
+        REGISTRY.callback("malarm_tts_cache_hits_total", "Phrase cache hits", lambda: self.store.hits, "counter")
+        REGISTRY.callback("malarm_tts_cache_misses_total", "Phrase cache misses", lambda: self.store.misses, "counter")
+        REGISTRY.callback("malarm_tts_cache_hit_ratio", "Phrase cache hit ratio", lambda: self.store.stats()["hit_rate"])
 
-    def play_speech(self, sound_file):
-        mixer.music.load(sound_file)
-        mixer.music.play()
-        while mixer.music.get_busy():
-            time.sleep(0.5)
+    def play_speech(self, sound_file, cache=True):
+        self.player.play_sequence([sound_file], cache)
 
+    async def play_speech_async(self, sound_file, cache=True):
+        await self.player.play_sequence_async([sound_file], cache)
 
-    def add_speech(self, name:str, text:str, language="nl"):
-        speech = gTTS(text=text, lang=language, slow=False)
-        speech.save(path.join(self.folder_path, name + ".mp3"))
-        regulars = self.get_cache()
-        regulars[text] = name + ".mp3"
-        with open(self.json_path, "w+", encoding="utf-8") as reg_json:
-            json.dump(regulars, reg_json, indent=4, sort_keys=True, ensure_ascii=False)
+    def add_speech(self, text:str, language="nl") -> str:
+        return self.store.add(text, language)
 
 
-    def play_good_morning(self):
-        self.play_reg("Good morning")
+    def warmup(self, texts=(), language="nl"):
+        """Synthesizes the given texts in the background, so nothing has to be
+           generated while an alarm is going off. The fixed phrases are never evicted"""
 
+        def thread_func():
+            try:
+                self.store.warmup(self.FIXED_PHRASES, language, pin=True)
+                self.store.warmup(texts, language)
+                # Decode them as well, so playing them does not have to
+                self.player.preload(filter(None, (self.store.get(text, language)
+                                                  for text in (*self.FIXED_PHRASES, *texts))))
+            except Exception:
+                logging.getLogger("Malarm").exception("Speech warmup failed")
 
-    def play_bye(self):
-        self.play_reg("Tot morgen")
+        thread = threading.Thread(target=thread_func, name="speech warmup", daemon=True)
+        thread.start()
+        return thread
+
+
+    def play_good_morning(self, language="nl"):
+        self.play_reg("Good morning", language)
+
+
+    def play_bye(self, language="nl"):
+        self.play_reg("Tot morgen", language)
+
+
+    async def play_good_morning_async(self, language="nl"):
+        await self.play_reg_async("Good morning", language)
+
+
+    async def play_bye_async(self, language="nl"):
+        await self.play_reg_async("Tot morgen", language)
 
 
     def play_misc(self, text:str, language="nl"):
-        file_obj = BytesIO()
-        mp3_obj = BytesIO()
-        speech = gTTS(text=text, lang=language, slow=False)
-        speech.write_to_fp(file_obj)
-        file_obj.seek(0)
-        sound = AudioSegment.from_file(file_obj)
-        mp3_obj = sound.export(file_obj, format="mp3")
-        self.play_speech(mp3_obj)
+        sound_file = self.store.get(text, language)
+        if sound_file is not None:
+            self.play_speech(sound_file)
+            return
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.play_speech(self.backend.synthesize(text, language, path.join(tmp_dir, "misc")), cache=False)
 
 
     def play_reg(self, text:str, language="nl"):
-        name = str(time.time())[11:]
-        regulars = self.get_cache()
-        if  text not in regulars:
-            self.add_speech(name, text, language=language)
-            self.play_speech(path.join(self.folder_path,  name + ".mp3"))
-        else:
-            self.play_speech(path.join(self.folder_path, regulars[text]))
+        self.play_speech(self.get_reg_file(text, language=language))
+
+
+    async def play_reg_async(self, text:str, language="nl"):
+        sound_file = self.store.get(text, language)
+        if sound_file is None:
+            # Synthesis blocks (network request or subprocess), keep it off the loop
+            sound_file = await asyncio.get_running_loop().run_in_executor(
+                None, self.store.add, text, language)
+        await self.play_speech_async(sound_file)
+
+
+    def get_reg_file(self, text:str, language="nl") -> str:
+        """Returns the path of the cached speech file, synthesizing it if needed"""
+
+        return self.store.get_or_create(text, language)
 
 
     def get_cache(self):
-        with open(self.json_path, "r", encoding="utf-8") as reg_json:
-            regular = json.load(reg_json)
-        return regular
+        return self.store.texts()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import datetime as dt
+
+from functools import lru_cache
+from types import MappingProxyType
+from typing import NamedTuple
+
+
+class Timetable(NamedTuple):
+    """Immutable lookup table of the lesson hours, slots[i] is the (start, end)
+       of hour i + 1 in minutes since midnight"""
+
+    name: str
+    slots: tuple
+
+    @classmethod
+    def from_strings(cls, name: str, timeslots) -> "Timetable":
+        """Builds a timetable from strings like "08:30 - 09:20" """
+
+        return cls(name, tuple(tuple(to_minutes(part) for part in timeslot.split("-"))
+                               for timeslot in timeslots))
+
+    def slot(self, number: int) -> tuple:
+        """Returns (start, end) of the hour, or None if the hour is not in the table"""
+
+        if 1 <= number <= len(self.slots):
+            return self.slots[number - 1]
+        return None
+
+    def timeslot(self, number: int) -> str:
+        slot = self.slot(number)
+        if slot is None:
+            return ""
+        return f"{to_clock(slot[0])} - {to_clock(slot[1])}"
+
+
+def to_minutes(clock: str) -> int:
+    hours, minutes = clock.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def to_clock(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def infer_date(day: int, month: int, today: dt.date) -> dt.date:
+    """The agenda only shows day and month, takes the year that puts the date closest
+       to today (so a scrape in late December gets the January days right)"""
+
+    candidates = []
+    for year in (today.year - 1, today.year, today.year + 1):
+        try:
+            candidates.append(dt.date(year, month, day))
+        except ValueError:
+            # 29 February in a year that is not a leap year
+            pass
+    return min(candidates, key=lambda date: abs(date - today))
+
+
+NORMAL = Timetable.from_strings("normal", ("08:30 - 09:20",
+                                           "09:20 - 10:10",
+                                           "10:10 - 11:00",
+                                           "11:20 - 12:10",
+                                           "12:10 - 13:00",
+                                           "13:30 - 14:20",
+                                           "14:20 - 15:10",
+                                           "15:10 - 16:00",
+                                           "16:10 - 17:00"))
+
+SHORT = Timetable.from_strings("short", ("08:30 - 09:10",
+                                         "09:10 - 09:50",
+                                         "09:50 - 10:30",
+                                         "10:50 - 11:30",
+                                         "11:30 - 12:10",
+                                         "12:10 - 12:50",
+                                         "13:20 - 14:00",
+                                         "14:00 - 14:40",
+                                         "14:40 - 15:20"))
+
+DEFAULT_TIMETABLES = MappingProxyType({NORMAL.name: NORMAL, SHORT.name: SHORT})
+
+
+@lru_cache(maxsize=256)
+def shared_timetable(name: str, timeslots: tuple) -> Timetable:
+    """Timetables are immutable, so the accounts with the same override share one"""
+
+    return Timetable.from_strings(name, timeslots)
+
+
+def load_timetables(config: dict) -> MappingProxyType:
+    """Returns the default timetables, overridden by the "timetables" entry of
+       config.json, e.g. {"timetables": {"short": ["08:30 - 09:10", ...]}}"""
+
+    timetables = dict(DEFAULT_TIMETABLES)
+    for name, timeslots in config.get("timetables", {}).items():
+        timetables[name] = shared_timetable(name, tuple(timeslots))
+    return MappingProxyType(timetables)
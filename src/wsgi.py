@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Production entry point of the web interface. The app.py routes run in any number
+   of web workers, the alarms in the single owner process (owner.py) that the
+   workers reach over its Unix socket. Start the owner first, from src/:
+
+     python3 owner.py
+     gunicorn --workers 4 --threads 8 --bind 0.0.0.0:5000 wsgi:application
+
+   or serve it with waitress in one process: python3 wsgi.py"""
+
+import os
+import sys
+import secrets
+import tempfile
+
+from os import path
+
+import app as web
+from rpc import RpcClient
+from owner import SOCKET_PATH
+from metrics import CONTENT_TYPE
+from remote import RemoteDispatcher, RemoteMalarm, RemoteFeed, RemoteInputs, RemoteFunctions, RemoteJsonHelper
+
+SECRET_KEY_PATH = path.join(path.dirname(SOCKET_PATH), "secret_key")
+
+
+def shared_secret_key() -> str:
+    """The workers have to sign the flash cookies with the same key. It is taken from
+       $MALARM_SECRET_KEY, or created once next to the socket by the first worker"""
+
+    if os.environ.get("MALARM_SECRET_KEY"):
+        return os.environ["MALARM_SECRET_KEY"]
+    if not path.exists(SECRET_KEY_PATH):
+        os.makedirs(path.dirname(SECRET_KEY_PATH), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.dirname(SECRET_KEY_PATH))
+        with os.fdopen(fd, "w") as tmp:
+            tmp.write(secrets.token_hex(32))
+        try:
+            # Fails if another worker was first, then its key is used
+            os.link(tmp_path, SECRET_KEY_PATH)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(SECRET_KEY_PATH) as key_file:
+        return key_file.read()
+
+
+client = RpcClient(SOCKET_PATH)
+web.dispatcher = RemoteDispatcher(client)
+web.malarm = RemoteMalarm(client)
+web.feed = RemoteFeed(client)
+web.inputs = RemoteInputs(client)
+# The event types of the owner, which include the ones of every account (Alarm@alice)
+web.functions = RemoteFunctions(client)
+web.json_helper = RemoteJsonHelper(client)
+# The versions (and boot id) of the owner, so every worker makes the same etags
+web.state_version = lambda: tuple(client.call("state_version"))
+web.out_version = lambda: tuple(client.call("out_version"))
+web.app.secret_key = shared_secret_key()
+
+
+def metrics():
+    """The metrics of the owner, which runs the alarms, timers and scrapes"""
+
+    return client.call("metrics"), 200, {"Content-Type": CONTENT_TYPE}
+
+
+web.app.view_functions["metrics"] = metrics
+application = web.app
+
+
+if __name__ == "__main__":
+    try:
+        import waitress
+    except ImportError:
+        sys.exit("Serving needs a WSGI server, install it with `python3 -m pip install waitress` (or use gunicorn)")
+    waitress.serve(application, host="0.0.0.0", port=5000, threads=8)
@@ -0,0 +1,142 @@
+// Keeps the page up to date with the change feed of the server (/api/stream, or
+// long polling /api/changes without EventSource), and posts the forms in the
+// background, so the page is never reloaded
+
+(function () {
+	var seq = parseInt(document.body.dataset.seq || "0", 10);
+	var table = document.getElementById("events");
+
+	function eventRow(event) {
+		var row = document.createElement("tr");
+		row.dataset.name = event.name;
+		row.dataset.time = event.time;
+		row.innerHTML =
+			'<td align="center"><span class="badge bg-info"></span></td>' +
+			"<td><h5></h5></td>" +
+			'<td><h5><span></span> <small class="text-muted"></small></h5></td>' +
+			'<td class="table-danger" align="center">' +
+			'<form action="/cancel_event" method="post" style="display: inline;">' +
+			'<input type=hidden name="name"/>' +
+			'<div class="btn-group"><button class="btn btn-danger btn-sm float-end" type="submit">&#10005;</button></div>' +
+			"</form></td>";
+		row.cells[1].firstChild.textContent = event.name;
+		row.cells[2].querySelector("span").textContent = event.display;
+		row.cells[2].querySelector("small").textContent = event.rule;
+		row.querySelector("input").value = event.name;
+		return row;
+	}
+
+	function rows() {
+		return Array.prototype.slice.call(table.querySelectorAll("tr[data-name]"));
+	}
+
+	function removeEvent(name) {
+		rows().forEach(function (row) {
+			if (row.dataset.name === name) {
+				row.remove();
+			}
+		});
+	}
+
+	function addEvent(event) {
+		removeEvent(event.name);
+		var row = eventRow(event);
+		var next = rows().find(function (other) { return other.dataset.time > event.time; });
+		table.insertBefore(row, next || null);
+	}
+
+	function renumber() {
+		var current = rows();
+		current.forEach(function (row, i) {
+			row.querySelector(".badge").textContent = i + 1;
+		});
+		document.getElementById("events-title").textContent = current.length ? "Events" : "No events are set";
+	}
+
+	function applyStatus(data) {
+		document.getElementById("status").textContent = data.status;
+		document.getElementById("phase").textContent = data.phase ? "(" + data.phase + ")" : "";
+		document.getElementById("last-update").textContent = data.last_update;
+	}
+
+	function applyEvents(data) {
+		data.removed.forEach(removeEvent);
+		data.added.forEach(addEvent);
+		renumber();
+	}
+
+	function applyState(state) {
+		rows().forEach(function (row) { row.remove(); });
+		state.events.forEach(addEvent);
+		renumber();
+		applyStatus(state);
+		seq = state.seq;
+	}
+
+	function apply(delta) {
+		if (delta.type === "events") {
+			applyEvents(delta.data);
+		} else if (delta.type === "status") {
+			applyStatus(delta.data);
+		}
+		seq = delta.seq;
+	}
+
+	function reset() {
+		return fetch("/api/state").then(function (response) { return response.json(); }).then(applyState);
+	}
+
+	function stream() {
+		var source = new EventSource("/api/stream?since=" + seq);
+		["events", "status"].forEach(function (type) {
+			source.addEventListener(type, function (message) {
+				apply({seq: parseInt(message.lastEventId, 10), type: type, data: JSON.parse(message.data)});
+			});
+		});
+		source.addEventListener("reset", reset);
+	}
+
+	function poll() {
+		fetch("/api/changes?since=" + seq)
+			.then(function (response) { return response.json(); })
+			.then(function (changes) {
+				if (changes.reset) {
+					return reset();
+				}
+				changes.deltas.forEach(apply);
+			})
+			.catch(function () { return new Promise(function (resolve) { setTimeout(resolve, 3000); }); })
+			.then(poll);
+	}
+
+	function showMessages(messages) {
+		var list = document.getElementById("messages");
+		list.innerHTML = "";
+		messages.forEach(function (message) {
+			var item = document.createElement("li");
+			item.className = "col-4 alert alert-warning mb-1 me-1";
+			item.textContent = message;
+			list.appendChild(item);
+		});
+	}
+
+	document.addEventListener("submit", function (event) {
+		var form = event.target;
+		var submitter = event.submitter;
+		event.preventDefault();
+		fetch(submitter && submitter.getAttribute("formaction") || form.getAttribute("action"), {
+			method: "POST",
+			headers: {"Accept": "application/json"},
+			body: new URLSearchParams(new FormData(form))
+		})
+			.then(function (response) { return response.json(); })
+			.then(function (result) { showMessages(result.messages); })
+			.catch(function () { showMessages(["The server did not respond"]); });
+	});
+
+	if (window.EventSource) {
+		stream();
+	} else {
+		poll();
+	}
+})();
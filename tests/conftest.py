@@ -0,0 +1,25 @@
+import sys
+
+from os import path
+
+import pytest
+
+sys.path.insert(0, path.normpath(path.join(path.dirname(__file__), "../src")))
+
+from local_magister import LocalMagister
+
+
+@pytest.fixture
+def magister():
+    with LocalMagister() as server:
+        yield server
+
+
+@pytest.fixture
+def malarm(tmp_path):
+    """A Malarm on json files in a temporary folder, for rows_to_data"""
+
+    from malarm import Malarm
+    from json_helper import JsonHelper
+
+    return Malarm((1800, 2400, 1200), "../audio-files/alarm_sound.mp3", 10, json_helper=JsonHelper(str(tmp_path)))
@@ -0,0 +1,175 @@
+"""A local stand-in for Magister, served from tests/fixtures: the login page, the
+   identity provider pages (username, password, "stay signed in?"), the agenda and
+   the api, which replays the recorded responses in fixtures/api. The identity
+   provider runs on localhost and Magister on 127.0.0.1, so like the real thing they
+   are two hosts and the session cookie only belongs to Magister"""
+
+import json
+import secrets
+import threading
+import datetime as dt
+
+from os import path
+from html import escape
+from string import Template
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURES = path.join(path.dirname(__file__), "fixtures")
+
+
+class LocalMagister(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, username="student", password="secret"):
+        super().__init__(("127.0.0.1", 0), MagisterHandler)
+        self.username = username
+        self.password = password
+        port = self.server_address[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.idp_url = f"http://localhost:{port}"
+        self.tickets = set()
+        self.sessions = set()
+        # Number of completed logins, a kept session does not log in again
+        self.logins = 0
+        # The agenda page puts the token in the session storage, like the web app
+        self.access_token = secrets.token_hex(16)
+        # Number of accepted connections, the api client keeps one alive
+        self.connections = 0
+        self.thread = None
+
+    def __enter__(self):
+        # A short poll interval, so the shutdown at the end of every test is quick
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    def page(self, name: str, **values) -> bytes:
+        with open(path.join(FIXTURES, name), encoding="utf-8") as fhandler:
+            template = Template(fhandler.read())
+        values = {name: escape(value) for name, value in values.items()}
+        return template.safe_substitute(base_url=self.base_url, idp_url=self.idp_url,
+                                        access_token=self.access_token, **values).encode("utf-8")
+
+    def revoke_token(self) -> None:
+        """Makes the api reject the current token, as when it expired"""
+
+        self.access_token = secrets.token_hex(16)
+
+    @staticmethod
+    def recording(name: str):
+        with open(path.join(FIXTURES, "api", name), encoding="utf-8") as fhandler:
+            return json.load(fhandler)
+
+    def appointments(self, person_id: str, start: str, end: str) -> dict:
+        """The recorded afspraken that start from start up to (not including) end"""
+
+        if person_id != str(self.recording("account.json")["Persoon"]["Id"]):
+            return None
+        start, end = dt.date.fromisoformat(start), dt.date.fromisoformat(end)
+        items = [item for item in self.recording("afspraken.json")["Items"]
+                 if start <= dt.date.fromisoformat(item["Start"][:10]) < end]
+        return {"Items": items, "TotalCount": len(items)}
+
+
+class MagisterHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status: int, body=b"", content_type="text/html; charset=utf-8", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, location: str, headers=()):
+        self.send(303, headers=(("Location", location), *headers))
+
+    def session(self) -> str:
+        for cookie in self.headers.get("Cookie", "").split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == "session" and value in self.server.sessions:
+                return value
+        return None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        server = self.server
+
+        if url.path.startswith("/api/"):
+            self.api(url.path, query)
+        elif url.path == "/magister/":
+            if self.session():
+                self.send(200, server.page("agenda.html"))
+            else:
+                self.send(200, server.page("logged_out.html"))
+        elif url.path == "/magister/session":
+            # Where the identity provider sends the browser back to, with a one-time ticket
+            if query.get("ticket") not in server.tickets:
+                self.send(403, b"Unknown ticket", "text/plain")
+                return
+            server.tickets.discard(query["ticket"])
+            session = secrets.token_hex(8)
+            server.sessions.add(session)
+            server.logins += 1
+            self.redirect(server.base_url + "/magister/", (("Set-Cookie", f"session={session}; Path=/"),))
+        elif url.path == "/login":
+            self.send(200, server.page("login.html"))
+        elif url.path == "/microsoft/login":
+            self.send(200, server.page("password.html", username=query.get("username", ""), error=""))
+        else:
+            self.send(404, b"Not found", "text/plain")
+
+    def api(self, path: str, query: dict):
+        if self.headers.get("Authorization") != f"Bearer {self.server.access_token}":
+            self.send(401, b'{"Message": "Unauthorized"}', "application/json")
+            return
+        parts = path.strip("/").split("/")
+        if parts == ["api", "account"]:
+            data = self.server.recording("account.json")
+        elif len(parts) == 4 and parts[:2] == ["api", "personen"] and parts[3] == "afspraken":
+            data = self.server.appointments(parts[2], query.get("van", ""), query.get("tot", ""))
+        else:
+            data = None
+        if data is None:
+            self.send(404, b'{"Message": "Not found"}', "application/json")
+        else:
+            self.send(200, json.dumps(data).encode("utf-8"), "application/json; charset=utf-8")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = {name: values[0] for name, values in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+        server = self.server
+
+        if self.path == "/microsoft/password":
+            if form.get("username") == server.username and form.get("password") == server.password:
+                ticket = secrets.token_hex(8)
+                server.tickets.add(ticket)
+                self.send(200, server.page("kmsi.html", ticket=ticket))
+            else:
+                self.send(200, server.page("password.html", username=form.get("username", ""),
+                                           error="Uw wachtwoord is onjuist."))
+        elif self.path == "/microsoft/kmsi":
+            self.redirect(f"{server.base_url}/magister/session?ticket={form.get('ticket', '')}")
+        else:
+            self.send(404, b"Not found", "text/plain")
+
+
+if __name__ == "__main__":
+    with LocalMagister() as magister:
+        print(f"Magister stand-in at {magister.base_url}/magister/#/agenda (student / secret)")
+        magister.thread.join()
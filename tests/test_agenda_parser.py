@@ -0,0 +1,47 @@
+from os import path
+
+import pytest
+
+import agenda_parser
+from local_magister import FIXTURES
+
+# The fixture has style and script elements inside rows and a table nested in a row
+EXPECTED = [("day", "maandag 7 september"),
+            ("hour", "1 WISB - abc - 1"),
+            ("hour", "2 NETL - def - 2"),
+            ("hour", "3 ENTL - ghi - 3"),
+            ("day", "dinsdag 8 september"),
+            ("other", "Verkort rooster Alle lessen duren 40 minuten"),
+            ("other", "Alle lessen duren 40 minuten"),
+            ("hour", "2 SCHK - jkl - 2"),
+            ("hour", "3 NAT - mno - 3"),
+            ("day", "woensdag 9 september"),
+            ("other", "Roostervrije dag")]
+
+
+@pytest.fixture(scope="module")
+def html() -> str:
+    with open(path.join(FIXTURES, "agenda.html"), encoding="utf-8") as fhandler:
+        return fhandler.read()
+
+
+def rows(backend: str, html: str) -> list:
+    if backend != "stream":
+        pytest.importorskip(backend)
+    return list(agenda_parser.BACKENDS[backend](html))
+
+
+@pytest.mark.parametrize("backend", sorted(agenda_parser.BACKENDS))
+def test_backend_rows(backend, html):
+    normalized = [(kind, " ".join(text.split())) for kind, text in rows(backend, html)]
+
+    assert normalized == EXPECTED
+
+
+@pytest.mark.parametrize("backend", ["bs4", "lxml"])
+def test_backends_match_stream(backend, html):
+    assert rows(backend, html) == rows("stream", html)
+
+
+def test_stream_rows_across_chunks(html):
+    assert list(agenda_parser.stream_rows(html, chunk_size=7)) == rows("stream", html)
@@ -0,0 +1,65 @@
+import datetime as dt
+
+from os import path
+
+import pytest
+
+pytest.importorskip("selenium")
+
+import agenda_parser
+from browser_session import BrowserSession, LoginError
+from local_magister import FIXTURES
+from selenium.common.exceptions import WebDriverException
+
+WEEK = dt.date(2026, 9, 7)
+
+
+def start_session(magister, **kwargs) -> BrowserSession:
+    session = BrowserSession(base_url=magister.base_url, **kwargs)
+    try:
+        session.get_driver()
+    except WebDriverException as e:
+        pytest.skip(f"Chrome is not available ({e.msg})")
+    return session
+
+
+@pytest.fixture
+def session(magister):
+    session = start_session(magister, timeout=10)
+    yield session
+    session.close()
+
+
+def test_logs_in_and_scrapes_the_agenda(session, magister, malarm):
+    html = session.fetch_agenda_html({"username": magister.username, "password": magister.password})
+
+    assert magister.logins == 1
+    with open(path.join(FIXTURES, "agenda.html"), encoding="utf-8") as fhandler:
+        expected = malarm.rows_to_data(agenda_parser.stream_rows(fhandler.read()), WEEK)
+    assert malarm.rows_to_data(agenda_parser.stream_rows(html), WEEK) == expected
+    assert [len(day.hours) for day in expected] == [3, 2, 0]
+
+
+def test_keeps_the_session_between_fetches(session, magister):
+    creds = {"username": magister.username, "password": magister.password}
+    session.fetch_agenda_html(creds)
+    html = session.fetch_agenda_html(creds)
+
+    assert magister.logins == 1
+    assert "WISB - abc - 1" in html
+
+
+def test_reads_the_api_token_of_the_session(session, magister):
+    token = session.get_access_token({"username": magister.username, "password": magister.password})
+
+    assert token == magister.access_token
+
+
+def test_wrong_password_raises_login_error(magister):
+    session = start_session(magister, timeout=3)
+    try:
+        with pytest.raises(LoginError):
+            session.fetch_agenda_html({"username": magister.username, "password": "wrong"})
+        assert magister.logins == 0
+    finally:
+        session.close()
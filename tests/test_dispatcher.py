@@ -0,0 +1,187 @@
+import time
+import threading
+import datetime as dt
+
+import pytest
+
+from event_dispatcher import EventDispatcher, HeapTimer
+from function import EventFunction, available_functions
+from journal import AlarmJournal
+from models import ScheduledEvent
+from recurrence import RecurrenceRule
+
+
+class Calls:
+    """A function that records the names it was called with, in order"""
+
+    def __init__(self):
+        self.names = []
+        self.called = threading.Event()
+
+    def __call__(self, name: str):
+        self.names.append(name)
+        self.called.set()
+
+    def func(self, type="Alarm") -> EventFunction:
+        return EventFunction(lambda: self(type), type)
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = EventDispatcher()
+    yield dispatcher
+    dispatcher.timer.stop()
+
+
+def test_heap_timer_fires_in_time_order():
+    timer = HeapTimer()
+    timer.start()
+    calls = Calls()
+    now = time.time()
+    try:
+        timer.schedule_many([(now + 0.15, lambda: calls("c")), (now + 0.05, lambda: calls("a"))])
+        # A new head wakes the timer early
+        timer.schedule(now + 0.1, lambda: calls("b"))
+        cancelled = timer.schedule(now + 0.12, lambda: calls("cancelled"))
+        assert timer.cancel(cancelled)
+        assert not timer.is_pending(cancelled)
+
+        time.sleep(0.4)
+        assert calls.names == ["a", "b", "c"]
+        assert len(timer) == 0
+    finally:
+        timer.stop()
+
+
+def test_cancelled_event_does_not_fire(dispatcher):
+    calls = Calls()
+    soon = dt.datetime.now() + dt.timedelta(seconds=0.1)
+    dispatcher.dispatch(soon, calls.func("Alarm"))
+    dispatcher.dispatch(soon, calls.func("Good morning"))
+
+    assert dispatcher.cancel_many(["Alarm-1", "Nothing-9"]) == ["Removed Alarm-1",
+                                                              "There is no event with name Nothing-9"]
+    assert [event.name for event in dispatcher.events] == ["Good morning-2"]
+
+    assert calls.called.wait(2)
+    time.sleep(0.3)
+    assert calls.names == ["Good morning"]
+
+
+def test_replace_swaps_the_pending_event(dispatcher):
+    calls = Calls()
+    now = dt.datetime.now()
+    dispatcher.dispatch(now + dt.timedelta(seconds=0.1), calls.func("Alarm"))
+    later = now + dt.timedelta(hours=1)
+    dispatcher.dispatch(later, calls.func("Alarm"))
+    version = dispatcher.version
+
+    msgs, names = dispatcher.replace(["Alarm-1"], [(now + dt.timedelta(hours=2), calls.func("Alarm")),
+                                                   (later, calls.func("Alarm"))])
+    assert msgs == ["Removed Alarm-1", "Succesfully set new event.", "Duplicate event found, not dispatching it"]
+    # The duplicate keeps the event that was already scheduled for it
+    assert names == ["Alarm-3", "Alarm-2"]
+    assert [event.name for event in dispatcher.events] == ["Alarm-2", "Alarm-3"]
+    # One transaction, one change
+    assert dispatcher.version == version + 1
+
+    time.sleep(0.3)
+    assert calls.names == []
+
+
+def occurrences(rule: RecurrenceRule) -> list:
+    found = []
+    occurrence = rule.first()
+    while occurrence is not None:
+        found.append(occurrence)
+        occurrence = rule.next(*occurrence)
+    return found
+
+
+def test_rule_ends_after_count_and_until():
+    start = dt.datetime(2026, 9, 7, 7, 30)  # a monday
+    days = [start + dt.timedelta(days=n) for n in range(7)]
+
+    assert occurrences(RecurrenceRule.daily(start, count=3)) == [(days[0], 0), (days[1], 1), (days[2], 2)]
+    assert occurrences(RecurrenceRule.daily(start, until=days[2])) == [(days[0], 0), (days[1], 1), (days[2], 2)]
+    # An excluded date is skipped and not counted
+    assert occurrences(RecurrenceRule.daily(start, count=2, exdates=[days[1].date()])) == [(days[0], 0), (days[2], 1)]
+    # The weekend is skipped, until ends it on the friday
+    assert [occurrence for occurrence, _ in occurrences(RecurrenceRule.on_weekdays(start, until=days[6]))] == days[:5]
+    # The missed occurrences are skipped, the rule still ends after count
+    rule = RecurrenceRule.daily(start, count=3)
+    assert rule.next_after(start, 0, days[1] + dt.timedelta(hours=1)) == (days[2], 2)
+    assert rule.next_after(start, 0, days[2]) is None
+
+
+def test_recurring_event_advances_until_its_count(dispatcher):
+    calls = Calls()
+    start = dt.datetime.now() + dt.timedelta(seconds=0.1)
+    dispatcher.dispatch_rule(RecurrenceRule.daily(start, count=2), calls.func("Alarm"))
+    dispatcher.dispatch_rule(RecurrenceRule.daily(start, count=1), calls.func("Good morning"))
+
+    assert calls.called.wait(2)
+    time.sleep(0.3)
+    assert sorted(calls.names) == ["Alarm", "Good morning"]
+    # The next occurrence keeps the name, the rule with count=1 is done
+    (event,) = dispatcher.events
+    assert (event.name, event.time, event.occurrence) == ("Alarm-1", start + dt.timedelta(days=1), 1)
+
+
+def journal_with(folder: str, events: list) -> AlarmJournal:
+    journal = AlarmJournal(folder)
+    journal.record_dispatch(events)
+    journal.close()
+    return AlarmJournal(folder)
+
+
+def test_journal_load_stops_at_a_torn_line(tmp_path):
+    func = available_functions["Alarm"]
+    now = dt.datetime.now()
+    journal = journal_with(str(tmp_path), [ScheduledEvent("Alarm-1", now + dt.timedelta(hours=1), func, 1, None, 0),
+                                           ScheduledEvent("Alarm-2", now + dt.timedelta(hours=2), func, 2, None, 0)])
+    # A crash in the middle of appending the cancel of Alarm-1
+    with open(journal.journal_path, "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"op":"cancel","na')
+
+    counter, records = journal.load(now)
+    journal.close()
+    assert counter == 2
+    assert [record[0] for record in records] == ["Alarm-1", "Alarm-2"]
+
+
+def test_restore_skips_past_events(tmp_path):
+    now = dt.datetime.now()
+    yesterday = now - dt.timedelta(days=1)
+    journal_with(str(tmp_path), [
+        ScheduledEvent("Alarm-1", yesterday, available_functions["Alarm"], 1, None, 0),
+        ScheduledEvent("Alarm-2", now + dt.timedelta(hours=1), available_functions["Alarm"], 2, None, 0),
+        # Missed yesterday, continues in an hour
+        ScheduledEvent("Good morning-3", yesterday + dt.timedelta(hours=1), available_functions["Good morning"], 3,
+                       RecurrenceRule.daily(yesterday + dt.timedelta(hours=1), count=5), 0),
+        # Its only occurrence was missed
+        ScheduledEvent("Good morning-4", yesterday - dt.timedelta(minutes=1), available_functions["Good morning"], 4,
+                       RecurrenceRule.daily(yesterday - dt.timedelta(minutes=1), count=1), 0)]).close()
+
+    dispatcher = EventDispatcher(journal=AlarmJournal(str(tmp_path)))
+    try:
+        restored = dispatcher.restore(available_functions)
+        assert [event.name for event in restored] == ["Alarm-2", "Good morning-3"]
+        assert (restored[1].time, restored[1].occurrence) == (now + dt.timedelta(hours=1), 1)
+        # New events do not reuse the restored names
+        dispatcher.dispatch(now + dt.timedelta(hours=3), available_functions["Alarm"])
+        assert dispatcher.events.sorted()[-1].name == "Alarm-5"
+    finally:
+        dispatcher.timer.stop()
+        dispatcher.journal.close()
+
+
+def test_refresh_cannot_be_cancelled_by_name(dispatcher):
+    later = dt.datetime.now() + dt.timedelta(hours=1)
+    dispatcher.dispatch(later, EventFunction(None, "Refresh@alice", persist=False))
+    dispatcher.dispatch(later, available_functions["Alarm"])
+
+    assert dispatcher.cancel_event_by_name("Refresh@alice-1") == \
+        "Refresh@alice-1 cannot be cancelled, it is scheduled again by itself"
+    assert dispatcher.cancel_event_by_name("Alarm-2") == "Removed Alarm-2"
+    assert [event.name for event in dispatcher.events] == ["Refresh@alice-1"]
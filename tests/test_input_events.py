@@ -0,0 +1,110 @@
+import json
+import time
+import asyncio
+import threading
+import datetime as dt
+
+import pytest
+
+from event_dispatcher import EventDispatcher
+from function import EventFunction
+from input_events import InputEvents, FakeGPIO
+
+
+class Run:
+    """A stoppable function that records whether its run was stopped"""
+
+    def __init__(self, type: str):
+        self.started = threading.Event()
+        self.was_stopped = None
+        self.release = threading.Event()
+        self.func = EventFunction(self.run, type, stoppable=True)
+
+    def run(self, stopped: threading.Event) -> None:
+        self.started.set()
+        while not stopped.is_set() and not self.release.is_set():
+            stopped.wait(0.01)
+        self.was_stopped = stopped.is_set()
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = EventDispatcher()
+    yield dispatcher
+    dispatcher.timer.stop()
+
+
+@pytest.fixture
+def runs(dispatcher):
+    """A ringing alarm, a running stoppable event of another type and an alarm
+       that is not due yet"""
+
+    ringing, other = Run("Alarm@alice"), Run("Briefing")
+    pending = dispatcher.dispatch(dt.datetime.now() + dt.timedelta(hours=1), Run("Alarm").func)
+    now = dt.datetime.now()
+    dispatcher.dispatch_many([(now, ringing.func), (now, other.func)])
+    assert ringing.started.wait(2) and other.started.wait(2)
+    yield ringing, other
+    other.release.set()
+
+
+def assert_only_the_alarm_stopped(dispatcher: EventDispatcher, ringing: Run, other: Run) -> None:
+    other.release.set()
+    assert ringing.was_stopped is True
+    assert wait_for(lambda: other.was_stopped is not None)
+    assert other.was_stopped is False
+    # The finished runs are removed, the alarm that is not due yet stays scheduled
+    assert wait_for(lambda: [event.func.type for event in dispatcher.events] == ["Alarm"])
+
+
+def wait_for(condition, timeout=2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_button_stops_only_the_ringing_alarm(dispatcher, runs):
+    ringing, other = runs
+    gpio = FakeGPIO()
+    inputs = InputEvents(dispatcher, gpio=gpio, console=False)
+    inputs.start()
+    try:
+        gpio.press(inputs.pin)
+        assert wait_for(lambda: ringing.was_stopped is not None)
+        assert_only_the_alarm_stopped(dispatcher, ringing, other)
+
+        # The stop belonged to that run, the next alarm rings again
+        following = Run("Alarm")
+        dispatcher.dispatch(dt.datetime.now(), following.func)
+        assert following.started.wait(2)
+        following.release.set()
+        assert wait_for(lambda: following.was_stopped is not None)
+        assert following.was_stopped is False
+    finally:
+        inputs.close()
+
+
+def test_post_stop_stops_only_the_ringing_alarm(dispatcher, runs, malarm):
+    pytest.importorskip("jinja2")
+    from asgi_app import AsgiApp
+
+    ringing, other = runs
+    app = AsgiApp(malarm, dispatcher, malarm.json_helper, InputEvents(dispatcher, gpio=FakeGPIO(), console=False))
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app({"type": "http", "method": "POST", "path": "/stop", "query_string": b"",
+                     "headers": [(b"accept", b"application/json")]}, receive, send))
+
+    body = b"".join(message.get("body", b"") for message in sent)
+    assert json.loads(body)["messages"] == ["Stopped Alarm@alice-2"]
+    assert wait_for(lambda: ringing.was_stopped is not None)
+    assert_only_the_alarm_stopped(dispatcher, ringing, other)
@@ -0,0 +1,23 @@
+import os
+
+from json_helper import JsonHelper
+
+
+def test_version_does_not_count_as_a_cache_lookup(tmp_path):
+    json_helper = JsonHelper(str(tmp_path))
+    json_helper.initialize(interactive=False, files=("config.json",))
+    json_helper.get_config()
+    json_helper.get_config()
+    stats = json_helper.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    version = json_helper.version("config.json")
+    assert json_helper.version("config.json") == version
+    assert json_helper.stats() == stats
+
+    # A change on disk is still noticed
+    with open(tmp_path / "config.json", "w", encoding="utf-8") as fhandler:
+        fhandler.write('{"last_update": "2026-09-07T07:00:00", "changed": true}')
+    os.utime(tmp_path / "config.json", ns=(0, 0))
+    assert json_helper.version("config.json") == version + 1
+    assert json_helper.stats() == stats
@@ -0,0 +1,57 @@
+import datetime as dt
+
+from os import path
+
+import pytest
+
+import agenda_parser
+from magister_api import MagisterApiClient, ApiError
+from local_magister import FIXTURES
+
+WEEK = dt.date(2026, 9, 7)
+
+
+def scraped_rows() -> list:
+    with open(path.join(FIXTURES, "agenda.html"), encoding="utf-8") as fhandler:
+        return list(agenda_parser.stream_rows(fhandler.read()))
+
+
+def test_rows_match_the_scraped_agenda(magister, malarm):
+    client = MagisterApiClient(lambda: magister.access_token, base_url=magister.base_url)
+    try:
+        rows = client.fetch_rows(WEEK)
+    finally:
+        client.close()
+
+    # The cancelled lesson and the lesson of a later week are left out, like on the agenda page
+    assert malarm.rows_to_data(rows, WEEK) == malarm.rows_to_data(scraped_rows(), WEEK)
+    # The account and the afspraken over one kept-alive connection
+    assert magister.connections == 1
+
+
+def test_fetches_a_new_token_once_rejected(magister, malarm):
+    provided = []
+
+    def token_provider():
+        provided.append(magister.access_token)
+        return magister.access_token
+
+    client = MagisterApiClient(token_provider, base_url=magister.base_url)
+    try:
+        client.get_person_id()
+        magister.revoke_token()
+        rows = client.fetch_rows(WEEK)
+    finally:
+        client.close()
+
+    assert len(provided) == 2
+    assert malarm.rows_to_data(rows, WEEK) == malarm.rows_to_data(scraped_rows(), WEEK)
+
+
+def test_rejected_twice_raises_api_error(magister):
+    client = MagisterApiClient(lambda: "expired", base_url=magister.base_url)
+    try:
+        with pytest.raises(ApiError):
+            client.fetch_rows(WEEK)
+    finally:
+        client.close()
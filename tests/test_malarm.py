@@ -0,0 +1,67 @@
+import datetime as dt
+
+from event_dispatcher import EventDispatcher
+from journal import AlarmJournal
+from function import available_functions
+from models import Day, Lesson, ScheduleException
+from timetable import NORMAL
+
+
+def school_day(date: dt.date, first_hour: int) -> Day:
+    return Day(date, ScheduleException.NONE,
+               tuple(Lesson(number, f"WISB - abc - {number}", NORMAL.timeslot(number), *NORMAL.slot(number))
+                     for number in range(first_hour, 7)))
+
+
+def alarms(dispatcher: EventDispatcher, date: dt.date) -> list:
+    return sorted(event.time for event in dispatcher.events.by_name.values()
+                  if event.func.type == "Alarm" and event.time.date() == date)
+
+
+def test_restored_alarm_is_moved_after_a_restart(tmp_path, malarm):
+    tomorrow = dt.date.today() + dt.timedelta(days=1)
+    malarm.json_helper.write_out([school_day(tomorrow, 1)])
+    first = EventDispatcher(journal=AlarmJournal(str(tmp_path / "journal")))
+    malarm.setup_alarms(first)
+    first.timer.stop()
+
+    # A restart: a new dispatcher restores the journal, the Malarm starts without school alarms
+    malarm.school_alarms = {}
+    second = EventDispatcher(journal=AlarmJournal(str(tmp_path / "journal")))
+    try:
+        restored = second.restore(available_functions)
+        malarm.adopt_alarms(restored)
+        assert malarm.school_alarms == {tomorrow: restored[0].name}
+
+        # The first hour is dropped
+        malarm.json_helper.update_previous()
+        malarm.json_helper.write_out([school_day(tomorrow, 2)])
+        malarm.update_alarms(second)
+
+        assert alarms(second, tomorrow) == [malarm.get_alarm_time(school_day(tomorrow, 2))]
+    finally:
+        second.timer.stop()
+
+
+def test_day_starting_outside_the_timetable_gets_no_alarm(caplog, malarm):
+    tomorrow = dt.date.today() + dt.timedelta(days=1)
+    day_after = tomorrow + dt.timedelta(days=1)
+    # The 0th hour is not in the timetable, so its lesson has no start
+    early = Day(tomorrow, ScheduleException.NONE, (Lesson(0, "WISB - abc - 0", "", None, None),
+                                                   *school_day(tomorrow, 1).hours))
+    malarm.json_helper.write_out([early, school_day(day_after, 1)])
+    dispatcher = EventDispatcher()
+    try:
+        malarm.setup_alarms(dispatcher)
+        assert alarms(dispatcher, tomorrow) == []
+        assert alarms(dispatcher, day_after) == [malarm.get_alarm_time(school_day(day_after, 1))]
+        assert f"Hour 0 of {tomorrow.isoformat()} is not in the timetable" in caplog.text
+
+        malarm.json_helper.update_previous()
+        malarm.json_helper.write_out([early, school_day(day_after, 2)])
+        malarm.update_alarms(dispatcher)
+        assert alarms(dispatcher, tomorrow) == []
+        assert alarms(dispatcher, day_after) == [malarm.get_alarm_time(school_day(day_after, 2))]
+        assert malarm.get_briefing_fragments(tomorrow) is None
+    finally:
+        dispatcher.timer.stop()
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from phrase_store import PhraseStore
+from speech import TtsBackend, FallbackBackend
+
+
+class FakeBackend(TtsBackend):
+    """Writes the text to file_stem + extension, and fails after fail_after files"""
+
+    def __init__(self, name: str, extension: str, fail_after: int = None):
+        self.name = name
+        self.extension = extension
+        self.fail_after = fail_after
+
+    def synthesize(self, text: str, language: str, file_stem: str) -> str:
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                raise RuntimeError(f"{self.name} failed")
+            self.fail_after -= 1
+        with open(file_stem + self.extension, "w", encoding="utf-8") as fhandler:
+            fhandler.write(text)
+        return file_stem + self.extension
+
+
+def test_fallback_partway_leaves_no_temp_files(tmp_path):
+    store = PhraseStore(str(tmp_path), FallbackBackend(FakeBackend("gtts", ".mp3", fail_after=1),
+                                                       FakeBackend("espeak", ".wav")))
+    file_paths = store.add_many(["Goedemorgen", "Fijne dag!"])
+
+    assert [os.path.splitext(file_path)[1] for file_path in file_paths] == [".wav", ".wav"]
+    assert sorted(os.listdir(tmp_path)) == sorted(["index.json", *map(os.path.basename, file_paths)])
+
+
+def test_failed_batch_leaves_no_temp_files(tmp_path):
+    store = PhraseStore(str(tmp_path), FallbackBackend(FakeBackend("gtts", ".mp3", fail_after=1),
+                                                       FakeBackend("espeak", ".wav", fail_after=1)))
+    with pytest.raises(RuntimeError):
+        store.add_many(["Goedemorgen", "Fijne dag!"])
+
+    assert os.listdir(tmp_path) == []
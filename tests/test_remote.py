@@ -0,0 +1,35 @@
+import threading
+import datetime as dt
+
+import pytest
+
+from rpc import RpcServer, RpcClient
+from remote import RemoteDispatcher, RemoteFunctions
+
+
+@pytest.fixture
+def owner(tmp_path):
+    """An RpcServer with the methods of owner.py that the web worker needs here"""
+
+    dispatched = []
+    methods = {"types": lambda: ["Alarm", "Good morning", "Alarm@alice", "Good morning@alice"],
+               "dispatch": lambda time, type: dispatched.append((time, type)) or ["Succesfully set new event."]}
+    server = RpcServer(str(tmp_path / "owner.sock"), methods)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    yield RpcClient(str(tmp_path / "owner.sock")), dispatched
+    server.shutdown()
+    server.server_close()
+
+
+def test_worker_schedules_the_types_of_the_owner(owner):
+    client, dispatched = owner
+    functions = RemoteFunctions(client)
+
+    assert list(functions) == ["Alarm", "Good morning", "Alarm@alice", "Good morning@alice"]
+    assert "Alarm@bob" not in functions
+    with pytest.raises(KeyError):
+        functions["Alarm@bob"]
+
+    due = dt.datetime(2026, 9, 8, 7, 20)
+    RemoteDispatcher(client).dispatch(due, functions["Alarm@alice"])
+    assert dispatched == [(due.isoformat(), "Alarm@alice")]